@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import random
+import ipaddress
+from urllib.parse import urlparse
+import yt_dlp
+from yt_dlp.utils import determine_protocol
+
+# --- CHỌN SỐ KẾT NỐI ARIA2C THEO LỊCH SỬ TỐC ĐỘ (KHÔNG PHỤ THUỘC DJANGO) ---
+# Mỗi host/CDN có lịch sử tốc độ + tỉ lệ lỗi của từng "profile" tải (native, aria2c 4/8/16
+# kết nối). Lần tải sau chọn profile tốt nhất theo lịch sử, thỉnh thoảng thử profile khác
+# để theo kịp thay đổi phía CDN. File nhỏ và host mà đa kết nối hay lỗi -> downloader gốc của yt-dlp.
+# Dùng chung giữa CLI (main.py) và Celery worker: Redis nếu có, không thì lưu file JSON.
+
+KEY_PREFIX = 'hust:dlstats:'
+STATS_FILE = 'downloader_stats.json'
+# Lịch sử của 1 host tự hết hạn nếu lâu không tải lại (CDN thay đổi chính sách)
+STATS_TTL = 7 * 24 * 3600
+
+# File nhỏ hơn ngưỡng này: chia nhỏ chỉ tốn thêm request, tải thẳng 1 kết nối
+SMALL_FILE_BYTES = 8 * 1024 * 1024
+# Chỉ ghi nhận tốc độ khi tải đủ nhiều (tránh nhiễu do thời gian bắt tay kết nối)
+MIN_SAMPLE_BYTES = 1024 * 1024
+
+EWMA_ALPHA = 0.3
+# Tỉ lệ lỗi vượt ngưỡng -> bỏ profile này với host đó
+MAX_ERROR_RATE = 0.5
+# Xác suất thử profile khác profile tốt nhất
+EXPLORE_RATE = 0.1
+
+# Thứ tự thử lần đầu với host mới (16 kết nối là cấu hình cũ, vẫn thử trước)
+PROFILES = {
+    'aria2c-16': {'connections': 16, 'chunk': '1M'},
+    'aria2c-8': {'connections': 8, 'chunk': '2M'},
+    'aria2c-4': {'connections': 4, 'chunk': '4M'},
+    'native': {'connections': 1, 'chunk': None},
+}
+
+# Giao thức tải 1 file HTTP liền (m3u8/dash tải theo fragment, xem concurrent_fragment_downloads)
+TUNED_PROTOCOLS = ('http', 'https')
+
+
+def host_group(url):
+    """Gom host theo CDN: rr3---sn-abc.googlevideo.com -> googlevideo.com"""
+    host = (urlparse(url).hostname or '').lower()
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        return '.'.join(host.split('.')[-2:])
+
+
+class DownloaderTuner:
+    def __init__(self, redis_url=None, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                client = redis.Redis.from_url(redis_url, decode_responses=True, socket_connect_timeout=1)
+                client.ping()
+                self._redis = client
+            except Exception:
+                # Không kết nối được Redis (CLI chạy máy cá nhân) -> lưu lịch sử trên đĩa
+                self._redis = None
+
+    # --- Lưu trữ lịch sử ---
+    def _load_file(self):
+        try:
+            with open(os.path.join(self.cache_dir, STATS_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def stats(self, host):
+        """{profile: {'bps', 'err', 'n'}} của 1 host"""
+        if self._redis is not None:
+            try:
+                raw = self._redis.hgetall(KEY_PREFIX + host)
+            except Exception:
+                return {}
+            return {name: json.loads(value) for name, value in raw.items()}
+        if not self.cache_dir:
+            return {}
+        entry = self._load_file().get(host)
+        if not entry or entry['expires'] < time.time():
+            return {}
+        return entry['profiles']
+
+    def record(self, host, profile, ok, nbytes=0, seconds=0.0):
+        """Cập nhật trung bình trượt (EWMA) tốc độ và tỉ lệ lỗi của profile"""
+        current = self.stats(host).get(profile) or {'bps': 0.0, 'err': 0.0, 'n': 0}
+        current['err'] = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * current['err']
+        if ok and nbytes >= MIN_SAMPLE_BYTES and seconds > 0:
+            bps = nbytes / seconds
+            current['bps'] = bps if not current['bps'] else EWMA_ALPHA * bps + (1 - EWMA_ALPHA) * current['bps']
+        current['n'] += 1
+
+        if self._redis is not None:
+            try:
+                pipe = self._redis.pipeline()
+                pipe.hset(KEY_PREFIX + host, profile, json.dumps(current))
+                pipe.expire(KEY_PREFIX + host, STATS_TTL)
+                pipe.execute()
+            except Exception:
+                pass
+            return
+        if not self.cache_dir:
+            return
+        data = self._load_file()
+        entry = data.get(host)
+        if not entry or entry['expires'] < time.time():
+            entry = {'profiles': {}}
+        entry['profiles'][profile] = current
+        entry['expires'] = time.time() + STATS_TTL
+        data[host] = entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, STATS_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    # --- Chọn profile ---
+    def choose(self, host, size=None, allow_parallel=True):
+        """Trả về (tên profile, lý do chọn)"""
+        if not allow_parallel:
+            return 'native', 'policy'
+        if size and size < SMALL_FILE_BYTES:
+            return 'native', 'small-file'
+
+        stats = self.stats(host)
+        usable = [
+            name for name in PROFILES
+            if not (stats.get(name, {}).get('n', 0) >= 2 and stats[name]['err'] > MAX_ERROR_RATE)
+        ]
+        if not usable:
+            return 'native', 'errors'
+        # Host mới: thử lần lượt từng profile để có số liệu
+        for name in usable:
+            if not stats.get(name, {}).get('bps'):
+                return name, 'explore'
+        if len(usable) > 1 and random.random() < EXPLORE_RATE:
+            return random.choice(usable), 'explore'
+        best = max(usable, key=lambda name: stats[name]['bps'] * (1 - stats[name]['err']))
+        return best, 'history'
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _discard_partial(name):
+    """Bỏ file dở của aria2c trước khi chuyển sang tải 1 kết nối"""
+    for path in (name + '.part', name + '.part.aria2'):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class AdaptiveYoutubeDL(yt_dlp.YoutubeDL):
+    """
+    YoutubeDL chọn downloader cho từng format vừa được chọn (lúc đó mới biết CDN và dung lượng).
+    aria2c lỗi thì tải lại ngay bằng downloader gốc. Tham số đã dùng nằm ở self.download_params.
+    """
+
+    def __init__(self, params=None, *args, tuner=None, aria2c_path=None, aria2c_args=(),
+                 allow_parallel=True, **kwargs):
+        super().__init__(params, *args, **kwargs)
+        self.tuner = tuner
+        self.aria2c_path = aria2c_path
+        self.aria2c_args = list(aria2c_args)
+        self.allow_parallel = allow_parallel and bool(aria2c_path)
+        self.download_params = []
+
+    def reset(self):
+        """Instance được dùng lại cho task khác (core/sessions.py): xóa số liệu của task trước"""
+        self.download_params = []
+
+    def _apply_profile(self, profile):
+        spec = PROFILES[profile]
+        if profile == 'native':
+            self.params['external_downloader'] = {}
+            self.params['external_downloader_args'] = {}
+        else:
+            n = str(spec['connections'])
+            self.params['external_downloader'] = {'default': self.aria2c_path}
+            self.params['external_downloader_args'] = {
+                'aria2c': ['-x', n, '-s', n, '-k', spec['chunk']] + self.aria2c_args
+            }
+
+    def _timed_dl(self, profile, name, info, subtitle):
+        self._apply_profile(profile)
+        start_bytes = _file_size(name + '.part')
+        started = time.monotonic()
+        ok = False
+        try:
+            result = super().dl(name, info, subtitle)
+            ok = bool(result and result[0])
+        finally:
+            seconds = time.monotonic() - started
+            nbytes = max((_file_size(name) or _file_size(name + '.part')) - start_bytes, 0) if ok else 0
+            self.tuner.record(host_group(info['url']), profile, ok, nbytes, seconds)
+            self.download_params.append({
+                'format_id': info.get('format_id'),
+                'host': host_group(info['url']),
+                'profile': profile,
+                'connections': PROFILES[profile]['connections'],
+                'chunk': PROFILES[profile]['chunk'],
+                'ok': ok,
+                'bytes': nbytes,
+                'seconds': round(seconds, 2),
+            })
+        return result
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if subtitle or test or self.tuner is None or not info.get('url') \
+                or determine_protocol(info) not in TUNED_PROTOCOLS:
+            return super().dl(name, info, subtitle, test)
+
+        saved = (self.params.get('external_downloader'), self.params.get('external_downloader_args'))
+        try:
+            size = info.get('filesize') or info.get('filesize_approx')
+            profile, reason = self.tuner.choose(host_group(info['url']), size, self.allow_parallel)
+            # File .part của aria2c ghi nhiều đoạn không liền nhau: chỉ aria2c (đọc file .aria2) tải tiếp được
+            if os.path.exists(name + '.part.aria2'):
+                if self.allow_parallel and profile == 'native':
+                    profile, reason = 'aria2c-8', 'resume'
+                elif not self.allow_parallel:
+                    _discard_partial(name)
+            self.write_debug(f'Adaptive downloader: {profile} ({reason})')
+            try:
+                result = self._timed_dl(profile, name, info, subtitle)
+            except yt_dlp.utils.DownloadError:
+                if profile == 'native':
+                    raise
+                result = (False, False)
+            if not (result and result[0]) and profile != 'native':
+                # Đa kết nối bị CDN chặn (403/429...) -> tải lại bằng 1 kết nối
+                self.report_warning(f'{profile} failed, retrying with native downloader')
+                _discard_partial(name)
+                result = self._timed_dl('native', name, info, subtitle)
+            return result
+        finally:
+            self.params['external_downloader'], self.params['external_downloader_args'] = saved
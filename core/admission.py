@@ -0,0 +1,215 @@
+import math
+import time
+import hashlib
+import redis
+from django.conf import settings
+from django.db.models import Q, Sum, F, Count
+from .models import DownloadTask
+from .redis_client import get_redis, key
+from . import scheduling
+
+# --- NHẬN JOB CÓ GIỚI HẠN (ADMISSION CONTROL) + VỊ TRÍ HÀNG ĐỢI / ETA ---
+# Mỗi client (theo IP) và cả hệ thống chỉ có tối đa N job đang chạy/chờ. Đầy thì API trả 429
+# kèm Retry-After thay vì đẩy thêm vào broker. Client gửi lại đúng link đang chạy thì nhận lại
+# task cũ. Vị trí trong hàng đợi + ETA tính theo thứ tự làn ưu tiên (core/scheduling.py) và
+# tốc độ xử lý thực tế đo được (tổng chi phí ước tính của các job xong gần đây / thời gian).
+
+# Slot: sorted set member = task_id (batch: batch:<id>:<n>), score = hạn (job bị bỏ quên thì tự nhả),
+# owners: member -> client\tfingerprint. ARGV[8..]: các member xin cùng lúc (đủ hết hoặc không được gì)
+_ADMIT_SCRIPT = """
+for _, k in ipairs({KEYS[1], KEYS[2]}) do
+    for _, m in ipairs(redis.call('zrangebyscore', k, '-inf', ARGV[1])) do
+        redis.call('hdel', KEYS[3], m)
+    end
+    redis.call('zremrangebyscore', k, '-inf', ARGV[1])
+end
+local owner = ARGV[5] .. '\\t' .. ARGV[6]
+for _, m in ipairs(redis.call('zrange', KEYS[1], 0, -1)) do
+    if redis.call('hget', KEYS[3], m) == owner then
+        return {'duplicate', m}
+    end
+end
+local n = #ARGV - 7
+if redis.call('zcard', KEYS[1]) + n > tonumber(ARGV[3]) then
+    return {'client', ''}
+end
+if redis.call('zcard', KEYS[2]) + n > tonumber(ARGV[4]) then
+    return {'global', ''}
+end
+for i = 8, #ARGV do
+    redis.call('zadd', KEYS[1], ARGV[2], ARGV[i])
+    redis.call('zadd', KEYS[2], ARGV[2], ARGV[i])
+    redis.call('hset', KEYS[3], ARGV[i], owner)
+end
+redis.call('expire', KEYS[1], ARGV[7])
+return {'ok', ''}
+"""
+
+_RELEASE_SCRIPT = """
+for i, task_id in ipairs(ARGV) do
+    local owner = redis.call('hget', KEYS[2], task_id)
+    if owner then
+        local client = string.match(owner, '^([^\\t]*)')
+        redis.call('zrem', KEYS[3] .. client, task_id)
+        redis.call('hdel', KEYS[2], task_id)
+    end
+    redis.call('zrem', KEYS[1], task_id)
+end
+return 1
+"""
+
+RUNNING_STATUSES = ('DOWNLOADING', 'DOWNLOADED', 'PROCESSING')
+BATCH_PREFIX = 'batch:'
+
+
+def client_id(request):
+    """Định danh client: IP (sau proxy tin cậy thì lấy IP đầu tiên trong X-Forwarded-For), băm cho gọn"""
+    ip = request.META.get('REMOTE_ADDR', '')
+    if settings.ADMISSION_TRUST_FORWARDED:
+        ip = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip() or ip
+    return hashlib.sha1(ip.encode('utf-8')).hexdigest()[:16]
+
+
+def _client_key(client):
+    return key('admission', 'client', client)
+
+
+def admit(client, task_db):
+    """
+    Xin slot cho task mới. Trả về (kết quả, id task cũ):
+    'ok' | 'duplicate' (client đang có đúng job này) | 'client' / 'global' (đã đầy).
+    Redis lỗi -> cho qua (không chặn được thì thôi, không làm hỏng API).
+    """
+    return _admit(client, task_db.fingerprint, [str(task_db.id)])
+
+
+def batch_slots(batch_id, count, start=0):
+    """Member slot của batch: batch:<id>:<n>, n từ start tới count - 1"""
+    return [f"{BATCH_PREFIX}{batch_id}:{n}" for n in range(start, count)]
+
+
+def admit_batch(client, batch, slots):
+    """
+    Batch giữ cùng lúc `slots` slot (= số task con được chạy song song) của client và toàn hệ thống,
+    nhả dần khi số task con còn lại ít hơn (core/tasks.py advance_batch). Trả về 'ok' | 'client' | 'global'.
+    """
+    result, _ = _admit(client, f"{BATCH_PREFIX}{batch.id}", batch_slots(batch.id, slots))
+    return result
+
+
+def _admit(client, fingerprint, members):
+    now = time.time()
+    try:
+        result, existing = get_redis().eval(
+            _ADMIT_SCRIPT, 3, _client_key(client), key('admission', 'all'), key('admission', 'owners'),
+            now, now + settings.ADMISSION_SLOT_TTL,
+            settings.ADMISSION_CLIENT_LIMIT, settings.ADMISSION_GLOBAL_LIMIT,
+            client, fingerprint, settings.ADMISSION_SLOT_TTL, *members,
+        )
+    except redis.RedisError:
+        return 'ok', None
+    return result, existing or None
+
+
+def release(*task_ids):
+    """Task kết thúc (xong/lỗi/bám theo job khác đã xong) -> trả slot của client"""
+    if not task_ids:
+        return
+    try:
+        get_redis().eval(
+            _RELEASE_SCRIPT, 3, key('admission', 'all'), key('admission', 'owners'), _client_key(''),
+            *[str(t) for t in task_ids],
+        )
+    except redis.RedisError:
+        pass
+
+
+def client_tasks(client):
+    try:
+        return get_redis().zrange(_client_key(client), 0, -1)
+    except redis.RedisError:
+        return []
+
+
+# --- TỐC ĐỘ XỬ LÝ THỰC TẾ ---
+def _done_key():
+    return key('admission', 'done')
+
+
+def record_done(task_db):
+    """Ghi nhận 1 job đã tốn công xử lý xong (member = task_id:chi phí ước tính)"""
+    try:
+        get_redis().zadd(_done_key(), {f"{task_db.id}:{task_db.estimated_cost or 0}": time.time()})
+    except redis.RedisError:
+        pass
+
+
+def capacity(now=None):
+    """
+    Số giây chi phí ước tính hệ thống xử lý được mỗi giây, đo trong ADMISSION_THROUGHPUT_WINDOW
+    giây gần nhất. Chưa đủ mẫu thì coi như mỗi slot tải xử lý 1 giây chi phí/giây.
+    """
+    now = now or time.time()
+    window = settings.ADMISSION_THROUGHPUT_WINDOW
+    try:
+        r = get_redis()
+        r.zremrangebyscore(_done_key(), '-inf', now - window)
+        done = r.zrange(_done_key(), 0, -1, withscores=True)
+    except redis.RedisError:
+        done = []
+    if len(done) < settings.ADMISSION_MIN_SAMPLES:
+        return settings.ADMISSION_FALLBACK_CAPACITY
+    span = min(window, max(now - done[0][1], 60))
+    cost = sum(float(member.rsplit(':', 1)[1]) for member, _ in done)
+    return max(cost / span, 0.01)
+
+
+# --- VỊ TRÍ HÀNG ĐỢI + ETA ---
+def queue_info(task_db, rate=None):
+    """
+    Task đang chờ trong queue tải: {'queue_position', 'queue_wait', 'eta'} (giây).
+    Đứng trước là task PENDING priority nhỏ hơn, hoặc cùng priority nhưng gửi trước;
+    cộng thêm phần còn lại của các task đang chạy. None nếu task không còn chờ.
+    """
+    if task_db.status != 'PENDING' or task_db.leader_id:
+        return None
+    waiting = DownloadTask.objects.filter(status='PENDING', leader__isnull=True)
+    ahead = waiting.filter(
+        Q(priority__lt=task_db.priority) | Q(priority=task_db.priority, created_at__lt=task_db.created_at)
+    ).aggregate(n=Count('id'), cost=Sum('estimated_cost'))
+    running = DownloadTask.objects.filter(status__in=RUNNING_STATUSES, leader__isnull=True).aggregate(
+        cost=Sum(F('estimated_cost') * (100.0 - F('progress')) / 100.0)
+    )
+    rate = rate or capacity()
+    own_cost = task_db.estimated_cost or scheduling.estimate_cost(task_db)
+    wait = ((ahead['cost'] or 0) + (running['cost'] or 0)) / rate
+    return {
+        'queue_position': (ahead['n'] or 0) + 1,
+        'queue_wait': round(wait),
+        'eta': round(wait + own_cost),
+    }
+
+
+def retry_after(reason, client):
+    """Số giây client nên chờ trước khi gửi lại (429): tới lúc 1 slot dự kiến được nhả"""
+    rate = capacity()
+    if reason == 'client':
+        etas = []
+        members = client_tasks(client)
+        task_ids = [m for m in members if not m.startswith(BATCH_PREFIX)]
+        # Slot của batch được nhả khi 1 task con đang chạy của batch xong
+        batch_ids = {m[len(BATCH_PREFIX):].rsplit(':', 1)[0] for m in members if m.startswith(BATCH_PREFIX)}
+        mine = Q(id__in=task_ids)
+        if batch_ids:
+            mine |= Q(batch_id__in=batch_ids, status__in=('PENDING',) + RUNNING_STATUSES)
+        for task_db in DownloadTask.objects.filter(mine):
+            info = queue_info(task_db, rate)
+            etas.append(info['eta'] if info else (task_db.estimated_cost or 0) * (100.0 - task_db.progress) / 100.0)
+        seconds = min(etas) if etas else settings.ADMISSION_MAX_RETRY_AFTER
+    else:
+        # Hết slot toàn hệ thống: trung bình cứ (chi phí trung bình 1 job / tốc độ) giây lại có 1 job xong
+        avg = DownloadTask.objects.filter(
+            status__in=('PENDING',) + RUNNING_STATUSES, leader__isnull=True,
+        ).aggregate(cost=Sum('estimated_cost'), n=Count('id'))
+        seconds = (avg['cost'] or 0) / max(avg['n'] or 1, 1) / rate
+    return min(max(math.ceil(seconds), 1), settings.ADMISSION_MAX_RETRY_AFTER)
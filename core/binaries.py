@@ -0,0 +1,24 @@
+import os
+import shutil
+
+# --- TÌM FILE THỰC THI: FFMPEG, FFPROBE, ARIA2C (KHÔNG PHỤ THUỘC DJANGO) ---
+# Dùng chung cho worker (core/tasks.py) và CLI (main.py).
+
+
+def find_binary(name, bin_dir):
+    """
+    Tìm đường dẫn file thực thi (ffmpeg, aria2c)
+    Ưu tiên tìm trong System Path (Linux/Docker) trước, sau đó mới tìm trong folder bin (Windows)
+    """
+    # 1. Tìm trong môi trường hệ thống (Linux/Docker)
+    path = shutil.which(name)
+    if path:
+        return path
+
+    # 2. Tìm trong thư mục bin của dự án (Windows dev)
+    # Lưu ý: Windows cần đuôi .exe
+    local_path = os.path.join(bin_dir, f"{name}.exe")
+    if os.path.exists(local_path):
+        return local_path
+
+    return None
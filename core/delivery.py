@@ -0,0 +1,282 @@
+import os
+import re
+import hashlib
+import mimetypes
+from urllib.parse import quote
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from . import zipstream, storage
+from .redis_client import get_redis, key
+
+# --- PHÁT FILE TẢI VỀ (RANGE + SENDFILE + LINK KÝ SỐ) ---
+DOWNLOAD_DIR = os.path.join(settings.MEDIA_ROOT, 'downloads')
+SIGNING_SALT = 'core.delivery'
+ZIP_SIGNING_SALT = 'core.delivery.zip'
+CHUNK_SIZE = 1024 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def signed_url(filename):
+    """Link tải có chữ ký, hết hạn sau SIGNED_URL_TTL giây"""
+    token = signing.dumps(filename, salt=SIGNING_SALT, compress=True)
+    return f"/dl/{token}/{quote(filename)}"
+
+
+def unsign(token):
+    """Trả về tên file trong token, None nếu sai chữ ký hoặc đã hết hạn"""
+    try:
+        filename = signing.loads(token, salt=SIGNING_SALT, max_age=settings.SIGNED_URL_TTL)
+    except signing.BadSignature:
+        return None
+    # Chỉ cho phép file nằm trực tiếp trong media/downloads
+    if not filename or os.path.basename(filename) != filename:
+        return None
+    return filename
+
+
+def signed_zip_url(filenames, archive_name):
+    """Link tải nhiều file gộp thành 1 ZIP (tạo khi đang gửi, không ghi file tạm)"""
+    token = signing.dumps({'files': list(filenames), 'name': archive_name}, salt=ZIP_SIGNING_SALT, compress=True)
+    return f"/zip/{token}/{quote(archive_name)}.zip"
+
+
+def unsign_zip(token):
+    """Trả về (danh sách file, tên archive), None nếu sai chữ ký/hết hạn/có file ngoài media/downloads"""
+    try:
+        data = signing.loads(token, salt=ZIP_SIGNING_SALT, max_age=settings.SIGNED_URL_TTL)
+    except signing.BadSignature:
+        return None
+    filenames = data.get('files') or []
+    if not filenames or any(not f or os.path.basename(f) != f for f in filenames):
+        return None
+    return filenames, data.get('name') or 'download'
+
+
+def _etag(st):
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _parse_range(header, size):
+    """Parse 1 khoảng 'bytes=a-b'. Trả về (start, end) hoặc None nếu không hợp lệ/ngoài file"""
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+    else:
+        # bytes=-N: N byte cuối
+        start = max(size - int(m.group(2)), 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def _range_iter(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def _aiter(iterator):
+    """Đọc từng chunk của iterator đồng bộ trong thread, không gom cả body vào RAM"""
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await next_chunk(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+
+def _stream(request, iterator):
+    """
+    Body cho StreamingHttpResponse. Chạy qua ASGI (uvicorn), Django gom iterator đồng bộ
+    thành list rồi mới gửi -> cả file nằm trong RAM. Khi đó phải đưa vào iterator async.
+    """
+    if isinstance(request, ASGIRequest):
+        return _aiter(iterator)
+    return iterator
+
+
+def _range_header(request, etag, mtime):
+    """
+    Header Range cần trả 206, None nếu bỏ qua và trả 200 cả file (RFC 9110 cho phép):
+    không có Range, đơn vị khác 'bytes', nhiều khoảng (không hỗ trợ multipart/byteranges) hoặc If-Range lệch
+    """
+    range_header = request.headers.get('Range')
+    if not range_header or not range_header.strip().startswith('bytes=') or ',' in range_header:
+        return None
+    if not _if_range_ok(request, etag, mtime):
+        return None
+    return range_header
+
+
+def _if_range_ok(request, etag, mtime):
+    """If-Range: chỉ trả 206 nếu client đang giữ đúng phiên bản file"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def serve_file(request, filename):
+    """
+    Phát file trong media/downloads theo MEDIA_DELIVERY:
+    - 'x-accel'    : trả header X-Accel-Redirect cho Nginx tự gửi file (Range do Nginx xử lý)
+    - 'x-sendfile' : trả header X-Sendfile cho Apache/Lighttpd
+    - 'django'     : tự xử lý ETag/Range/If-Range; file nguyên vẹn đi qua FileResponse
+                     (gunicorn dùng sendfile qua wsgi.file_wrapper), qua ASGI thì stream từng chunk
+                     -> mọi byte đi qua Python, chiếm 1 kết nối của web worker đến hết lượt tải
+    """
+    path = os.path.join(DOWNLOAD_DIR, filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return HttpResponse(status=404)
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(True, filename)
+    storage.touch(filename)
+
+    if settings.MEDIA_DELIVERY == 'x-accel':
+        # Nginx gửi hộ, không biết lúc nào xong -> pin theo thời hạn
+        storage.pin([filename])
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(f"downloads/{filename}")
+        response['Content-Disposition'] = disposition
+        return response
+    if settings.MEDIA_DELIVERY == 'x-sendfile':
+        storage.pin([filename])
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        response['Content-Disposition'] = disposition
+        return response
+
+    etag = _etag(st)
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    range_header = _range_header(request, etag, st.st_mtime)
+    if range_header:
+        byte_range = _parse_range(range_header, st.st_size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{st.st_size}"
+            return response
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _stream(request, storage.pin_iter([filename], _range_iter(path, start, length))),
+            status=206, content_type=content_type,
+        )
+        response['Content-Range'] = f"bytes {start}-{end}/{st.st_size}"
+        response['Content-Length'] = str(length)
+        response['Content-Disposition'] = disposition
+    elif isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            _stream(request, storage.pin_iter([filename], _range_iter(path, 0, st.st_size))), content_type=content_type
+        )
+        response['Content-Length'] = str(st.st_size)
+        response['Content-Disposition'] = disposition
+    else:
+        storage.pin([filename])
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type=content_type)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(st.st_mtime)
+    return response
+
+
+# --- ZIP NHIỀU FILE (STORE, TẠO KHI ĐANG GỬI) ---
+def _crc_key(entry):
+    digest = hashlib.sha1(f"{entry.path}:{entry.size}:{entry.mtime_ns}".encode()).hexdigest()
+    return key('crc', digest)
+
+
+def _crc_get(entry):
+    """CRC32 đã tính ở lần gửi trước (để trả Range phía sau dữ liệu mà không đọc lại cả file)"""
+    try:
+        value = get_redis().get(_crc_key(entry))
+    except redis.RedisError:
+        return None
+    return int(value) if value is not None else None
+
+
+def _crc_set(entry, crc):
+    try:
+        get_redis().set(_crc_key(entry), crc, ex=settings.FILE_EXPIRATION + settings.SIGNED_URL_TTL)
+    except redis.RedisError:
+        pass
+
+
+def serve_zip(request, filenames, archive_name):
+    """
+    Gộp các file trong media/downloads thành 1 ZIP không nén, gửi ngay byte đầu tiên.
+    Biết trước dung lượng nên có Content-Length, hỗ trợ Range/If-Range để tải tiếp.
+    File không còn trên đĩa (đã bị dọn) thì bỏ qua.
+    """
+    files = [(f, os.path.join(DOWNLOAD_DIR, f)) for f in filenames if os.path.isfile(os.path.join(DOWNLOAD_DIR, f))]
+    if not files:
+        return HttpResponse(status=404)
+    archive = zipstream.StoreZip(files, crc_get=_crc_get, crc_set=_crc_set)
+    names = [f for f, _ in files]
+    for name in names:
+        storage.touch(name)
+
+    version = ';'.join(f"{e.name.decode()}:{e.size}:{e.mtime_ns}" for e in archive.entries)
+    etag = f'"zip-{hashlib.sha1(version.encode()).hexdigest()[:20]}"'
+    mtime = max(e.mtime_ns for e in archive.entries) / 1e9
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    filename = f"{archive_name}.zip"
+    range_header = _range_header(request, etag, mtime)
+    if range_header:
+        byte_range = _parse_range(range_header, archive.size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{archive.size}"
+            return response
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _stream(request, storage.pin_iter(names, archive.iter_range(start, end))),
+            status=206, content_type='application/zip',
+        )
+        response['Content-Range'] = f"bytes {start}-{end}/{archive.size}"
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = StreamingHttpResponse(
+            _stream(request, storage.pin_iter(names, archive.iter_range())), content_type='application/zip'
+        )
+        response['Content-Length'] = str(archive.size)
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import time
+import hashlib
+from urllib.parse import urlparse, parse_qs
+from .fingerprint import media_key
+
+# --- CACHE KẾT QUẢ EXTRACT CỦA YT-DLP (KHÔNG PHỤ THUỘC DJANGO) ---
+# Dùng chung giữa CLI (main.py) và Celery worker: Redis nếu có, không thì lưu file JSON.
+# Lưu kết quả extract "thô" (process=False) để lần sau chỉ cần chọn format + tải,
+# không phải tải lại trang và manifest. TTL không vượt quá hạn của link ký số trong format.
+
+KEY_PREFIX = 'hust:extract:'
+# Hết hạn sớm hơn link thật một chút để không đưa link sắp chết cho downloader
+EXPIRY_MARGIN = 120
+
+_EXPIRE_PATH_RE = re.compile(r'/expire/(\d+)')
+
+
+def _url_expiry(url):
+    """Đọc thời điểm hết hạn (unix time) nhúng trong link ký số, None nếu không có"""
+    if not url:
+        return None
+    query = parse_qs(urlparse(url).query)
+    for name in ('expire', 'expires', 'Expires', 'x-expires'):
+        if name in query:
+            try:
+                return int(query[name][0])
+            except ValueError:
+                pass
+    # CDN của Facebook/Instagram: oe=<hex timestamp>
+    if 'oe' in query:
+        try:
+            return int(query['oe'][0], 16)
+        except ValueError:
+            pass
+    m = _EXPIRE_PATH_RE.search(url)
+    return int(m.group(1)) if m else None
+
+
+def info_ttl(info, default_ttl):
+    """TTL cho 1 kết quả extract: min(default_ttl, hạn sớm nhất của các link format)"""
+    expiries = []
+    for fmt in info.get('formats') or [info]:
+        for url in (fmt.get('url'), fmt.get('manifest_url')):
+            expiry = _url_expiry(url)
+            if expiry:
+                expiries.append(expiry)
+    if not expiries:
+        return default_ttl
+    return int(min(default_ttl, min(expiries) - time.time() - EXPIRY_MARGIN))
+
+
+def cacheable(info):
+    """Chỉ cache video đơn (playlist có entries dạng generator, không serialize được)"""
+    return bool(info) and info.get('_type', 'video') == 'video' and bool(info.get('formats') or info.get('url'))
+
+
+class ExtractCache:
+    def __init__(self, redis_url=None, cache_dir=None, default_ttl=1800):
+        self.default_ttl = default_ttl
+        self.cache_dir = cache_dir
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                client = redis.Redis.from_url(redis_url, decode_responses=True, socket_connect_timeout=1)
+                client.ping()
+                self._redis = client
+            except Exception:
+                # Không kết nối được Redis (CLI chạy máy cá nhân) -> dùng cache trên đĩa
+                self._redis = None
+
+    def _key(self, url):
+        return hashlib.sha1(media_key(url).encode('utf-8')).hexdigest()
+
+    def get(self, url):
+        key = self._key(url)
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(KEY_PREFIX + key)
+            except Exception:
+                return None
+            return json.loads(raw) if raw else None
+
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry['info']
+
+    def put(self, url, info):
+        """info phải là dict đã qua ydl.sanitize_info()"""
+        if not cacheable(info):
+            return
+        ttl = info_ttl(info, self.default_ttl)
+        if ttl <= 0:
+            return
+        key = self._key(url)
+        if self._redis is not None:
+            try:
+                self._redis.set(KEY_PREFIX + key, json.dumps(info), ex=ttl)
+            except Exception:
+                pass
+            return
+
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'expires': time.time() + ttl, 'info': info}, f)
+        os.replace(tmp_path, path)
+
+
+def extract(ydl, url, cache=None):
+    """
+    Extract 1 lần duy nhất (process=False), có dùng cache nếu được truyền vào.
+    Kết quả đưa tiếp cho ydl.process_ie_result(info, download=True) để chọn format + tải.
+    """
+    return extract_with_source(ydl, url, cache)[0]
+
+
+def extract_with_source(ydl, url, cache=None):
+    """Như extract(), kèm cờ cho biết kết quả lấy từ cache hay không: (info, from_cache)"""
+    if cache is not None:
+        info = cache.get(url)
+        if info:
+            return info, True
+    info = ydl.extract_info(url, download=False, process=False)
+    if info and cache is not None and cacheable(info):
+        cache.put(url, ydl.sanitize_info(info))
+    return info, False
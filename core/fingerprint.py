@@ -0,0 +1,79 @@
+import hashlib
+import json
+from functools import lru_cache
+
+# --- NHẬN DIỆN NỘI DUNG (KHÔNG PHỤ THUỘC DJANGO) ---
+# Module này không import Django để CLI (main.py) cũng dùng chung được.
+
+_EXTRACTORS = None
+
+
+# Tham số chỉ dùng để tracking, bỏ đi không làm đổi nội dung link
+TRACKING_PARAMS = {
+    'si', 'igsh', 'igshid', 'feature', 'pp', 'fbclid', 'gclid', 'mibextid',
+    'is_from_webapp', 'sender_device', '_r', '_t', 'ref', 'ref_src', 's',
+}
+
+
+def normalize_url(url):
+    """
+    Chuẩn hóa URL (canonical) trước khi đưa cho yt-dlp:
+    - Threads đổi domain threads.com -> threads.net
+    - Cắt bỏ tham số tracking (?si=..., utm_*...) nhưng giữ tham số định danh (watch?v=...)
+    """
+    if 'threads.com' in url:
+        url = url.replace('threads.com', 'threads.net')
+    if '?' in url:
+        base, _, query = url.partition('?')
+        query = query.split('#')[0]
+        kept = [
+            p for p in query.split('&')
+            if p and p.split('=')[0] not in TRACKING_PARAMS and not p.startswith('utm_')
+        ]
+        url = f"{base}?{'&'.join(kept)}" if kept else base
+    return url
+
+
+def _extractor_classes():
+    global _EXTRACTORS
+    if _EXTRACTORS is None:
+        from yt_dlp.extractor import gen_extractor_classes
+        # Bỏ Generic vì nó khớp mọi URL và không có ID ổn định
+        _EXTRACTORS = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+    return _EXTRACTORS
+
+
+@lru_cache(maxsize=4096)
+def media_key(url):
+    """
+    Khóa định danh nội dung của một link: 'Extractor:video_id' nếu yt-dlp nhận ra
+    (chỉ match regex, không gọi mạng), ngược lại dùng URL đã chuẩn hóa.
+    Nhờ vậy youtu.be/x và youtube.com/watch?v=x dùng chung một khóa.
+    """
+    for ie in _extractor_classes():
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return f"{ie.ie_key()}:{video_id}"
+            break
+    return normalize_url(url)
+
+
+def task_options(task):
+    """Các tùy chọn ảnh hưởng tới file đầu ra (bỏ qua tùy chọn không dùng tới)"""
+    opts = {
+        'task_type': task.task_type,
+        'use_subtitle': bool(task.use_subtitle),
+        'use_thumbnail': bool(task.use_thumbnail),
+    }
+    if task.task_type == 'audio':
+        opts.update({'audio_format': task.audio_format, 'audio_quality': task.audio_quality})
+    else:
+        opts.update({'resolution': task.resolution, 'container': task.container})
+    return opts
+
+
+def task_fingerprint(task):
+    """Dấu vân tay (sha256) của cặp (nội dung, tùy chọn) dùng làm khóa cache"""
+    payload = json.dumps([media_key(task.url), task_options(task)], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,489 @@
+import io
+import os
+import re
+import json
+import time
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from celery import current_app
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from core import tasks, storage, result_cache
+from core.fingerprint import task_fingerprint
+from core.models import DownloadTask
+from .bench_status import _percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- BENCHMARK ĐẦU-CUỐI KHÔNG CẦN MẠNG ---
+# Server HTTP cục bộ phát media tổng hợp (DASH video/audio tách rời + phụ đề, file progressive),
+# yt-dlp đọc qua extractor generic (nhận ra manifest DASH như với site thật) rồi chạy nguyên
+# pipeline: web (submit_task -> process_download_task -> postprocess_download_task, Celery
+# chạy eager trong process này) và CLI (HUSTDownloader.download).
+
+# Tổ hợp tùy chọn: file phát ra, tùy chọn task (web), tùy chọn wizard (CLI), có cần ffmpeg không
+COMBOS = {
+    'progressive': {
+        'ext': 'mp4', 'ffmpeg': False,
+        'task': {'task_type': 'video', 'container': 'mp4'},
+        'cli': {'type': 'video', 'resolution': '1080', 'container': 'mp4', 'extras': []},
+    },
+    'remux': {
+        'ext': 'mpd', 'ffmpeg': True,
+        'task': {'task_type': 'video', 'container': 'mp4'},
+        'cli': {'type': 'video', 'resolution': '1080', 'container': 'mp4', 'extras': []},
+    },
+    'audio': {
+        'ext': 'mpd', 'ffmpeg': True,
+        'task': {'task_type': 'audio', 'audio_format': 'mp3', 'audio_quality': 'best'},
+        'cli': {'type': 'audio', 'audio_format': 'mp3', 'audio_quality': 'best'},
+    },
+    'subs': {
+        'ext': 'mpd', 'ffmpeg': True,
+        'task': {'task_type': 'video', 'container': 'mp4', 'use_subtitle': True},
+        'cli': {'type': 'video', 'resolution': '1080', 'container': 'mp4', 'extras': ['subtitle']},
+    },
+}
+
+CONTENT_TYPES = {
+    '.mpd': 'application/dash+xml', '.mp4': 'video/mp4', '.m4a': 'audio/mp4', '.vtt': 'text/vtt',
+}
+AUDIO_BITRATE = 128_000
+
+MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}S"
+     minBufferTime="PT2S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+  <Period>
+    <AdaptationSet contentType="video" mimeType="video/mp4">
+      <Representation id="video" codecs="avc1.64001f" width="1280" height="720" frameRate="30" bandwidth="{video_bw}">
+        <BaseURL>video.mp4</BaseURL>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="audio" mimeType="audio/mp4" lang="en">
+      <Representation id="audio" codecs="mp4a.40.2" audioSamplingRate="44100" bandwidth="{audio_bw}">
+        <BaseURL>audio.m4a</BaseURL>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="text" mimeType="text/vtt" lang="en">
+      <Representation id="sub-en" bandwidth="256">
+        <BaseURL>sub.vtt</BaseURL>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+# --- MEDIA TỔNG HỢP ---
+def _ffmpeg(ffmpeg, *args):
+    subprocess.run([ffmpeg, '-y', '-v', 'error', *args], check=True)
+
+
+def _random_file(path, size):
+    with open(path, 'wb') as f:
+        while size > 0:
+            chunk = os.urandom(min(size, 1024 * 1024))
+            f.write(chunk)
+            size -= len(chunk)
+
+
+def _write_subtitles(path, duration):
+    lines = ['WEBVTT', '']
+    for i in range(0, duration, 2):
+        lines += [f"00:{i // 60:02d}:{i % 60:02d}.000 --> 00:{(i + 2) // 60:02d}:{(i + 2) % 60:02d}.000",
+                  f"Benchmark subtitle {i // 2}", '']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def make_fixtures(folder, size_mb, ffmpeg):
+    """
+    Sinh bộ media ~size_mb MB: video.mp4 (H.264, chỉ hình), audio.m4a (AAC), progressive.mp4
+    (cả 2), sub.vtt, manifest.mpd. Không có ffmpeg thì là byte ngẫu nhiên (chỉ đo được phần tải).
+    """
+    os.makedirs(folder, exist_ok=True)
+    size = size_mb * 1024 * 1024
+    # ~1 MB/giây video (8 Mbps), tối thiểu 10 giây
+    duration = max(10, size_mb)
+    video_bw = max(100_000, (size - AUDIO_BITRATE // 8 * duration) * 8 // duration)
+    video, audio = os.path.join(folder, 'video.mp4'), os.path.join(folder, 'audio.m4a')
+    if ffmpeg:
+        # CBR có nal-hrd để x264 chèn filler, kích thước file bám sát bitrate yêu cầu
+        _ffmpeg(ffmpeg, '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                '-b:v', str(video_bw), '-minrate', str(video_bw), '-maxrate', str(video_bw),
+                '-bufsize', str(video_bw), '-x264-params', 'nal-hrd=cbr', '-movflags', '+faststart', video)
+        _ffmpeg(ffmpeg, '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                '-c:a', 'aac', '-b:a', str(AUDIO_BITRATE), audio)
+        _ffmpeg(ffmpeg, '-i', video, '-i', audio, '-c', 'copy', '-movflags', '+faststart',
+                os.path.join(folder, 'progressive.mp4'))
+    else:
+        _random_file(video, size - AUDIO_BITRATE // 8 * duration)
+        _random_file(audio, AUDIO_BITRATE // 8 * duration)
+        _random_file(os.path.join(folder, 'progressive.mp4'), size)
+    _write_subtitles(os.path.join(folder, 'sub.vtt'), duration)
+    with open(os.path.join(folder, 'manifest.mpd'), 'w', encoding='utf-8') as f:
+        f.write(MANIFEST.format(duration=duration, video_bw=video_bw, audio_bw=AUDIO_BITRATE))
+
+
+def _media_bytes(folder, combo):
+    """Dung lượng 1 job phải tải: file progressive hoặc video + audio (+ phụ đề)"""
+    if COMBOS[combo]['ext'] == 'mp4':
+        names = ['progressive.mp4']
+    else:
+        names = ['audio.m4a'] if COMBOS[combo]['task']['task_type'] == 'audio' else ['video.mp4', 'audio.m4a']
+        if COMBOS[combo]['task'].get('use_subtitle'):
+            names.append('sub.vtt')
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in names)
+
+
+# --- SERVER HTTP CỤC BỘ (CÓ RANGE, GIỐNG CDN) ---
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'HUSTBench/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def _resolve(self):
+        """'/<size>mb/job-<...>.mpd' -> manifest, '/<size>mb/job-<...>.mp4' -> progressive, còn lại là file thật"""
+        folder, _, name = urlparse(self.path).path.lstrip('/').rpartition('/')
+        if name.startswith('job-'):
+            name = 'manifest.mpd' if name.endswith('.mpd') else 'progressive.mp4'
+        path = os.path.realpath(os.path.join(self.server.root, folder, name))
+        if not path.startswith(self.server.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send()
+
+    def _send(self, head=False):
+        path = self._resolve()
+        if not path:
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end, status = 0, size - 1, 200
+        m = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            else:
+                start = max(0, size - int(m.group(2)))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if head:
+            return
+        remaining = end - start + 1
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                while remaining > 0:
+                    chunk = f.read(min(256 * 1024, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    self.server.count(len(chunk))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root):
+        super().__init__(('127.0.0.1', 0), _FixtureHandler)
+        self.root = os.path.realpath(root)
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def count(self, n):
+        with self._lock:
+            self.bytes_sent += n
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+# --- ĐO RAM ---
+def _rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _max_rss_bytes(resource.RUSAGE_SELF) if resource else 0
+
+
+def _max_rss_bytes(who):
+    # Linux: KB, macOS: bytes
+    value = resource.getrusage(who).ru_maxrss
+    return value if platform.system() == 'Darwin' else value * 1024
+
+
+class RssSampler:
+    """RSS đỉnh của process benchmark trong 1 lượt đo (lấy mẫu định kỳ)"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+        return False
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark đầu-cuối không cần mạng: server media tổng hợp cục bộ, chạy process_download_task "
+        "(web) và HUSTDownloader.download (CLI) theo mức song song/dung lượng/tổ hợp tùy chọn, "
+        "đo jobs/s, MB/s, p50/p99 độ trễ, RSS đỉnh và ghi kết quả ra JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', default='web,cli', help='web, cli (phân tách bằng dấu phẩy)')
+        parser.add_argument('--combos', default=','.join(COMBOS), help=f"Tổ hợp tùy chọn: {', '.join(COMBOS)}")
+        parser.add_argument('--sizes', default='5,50', help='Dung lượng media (MB), VD: 5,50,200')
+        parser.add_argument('--concurrency', default='1,4', help='Số job chạy cùng lúc, VD: 1,4,8')
+        parser.add_argument('--jobs', type=int, default=8, help='Số job mỗi lượt đo')
+        parser.add_argument('--output', default='', help='File JSON kết quả (mặc định bench-<thời gian>.json)')
+        parser.add_argument('--compare', default='', help='File JSON của lần chạy trước để so sánh')
+        parser.add_argument('--fixtures', default='', help='Thư mục media tổng hợp (giữ lại giữa các lần chạy)')
+        parser.add_argument('--verbose', action='store_true', help='Giữ log của task/yt-dlp')
+
+    def handle(self, *args, **opts):
+        targets = [t for t in opts['targets'].split(',') if t]
+        combos = [c for c in opts['combos'].split(',') if c]
+        sizes = [int(s) for s in opts['sizes'].split(',') if s]
+        levels = [int(c) for c in opts['concurrency'].split(',') if c]
+        unknown = set(combos) - set(COMBOS) or set(targets) - {'web', 'cli'}
+        if unknown:
+            raise CommandError(f"Không hỗ trợ: {', '.join(sorted(unknown))}")
+        try:
+            from core.redis_client import get_redis
+            get_redis().ping()
+        except Exception as e:
+            raise CommandError(f"Cần Redis (REDIS_URL) để chạy pipeline: {e}")
+
+        ffmpeg = tasks.FFMPEG_PATH
+        if not ffmpeg:
+            skipped = [c for c in combos if COMBOS[c]['ffmpeg']]
+            combos = [c for c in combos if not COMBOS[c]['ffmpeg']]
+            if skipped:
+                self.stderr.write(f"⚠️ Không có ffmpeg: bỏ qua {', '.join(skipped)}, media là byte ngẫu nhiên")
+        if not combos:
+            raise CommandError("Không còn tổ hợp nào chạy được")
+
+        fixtures = opts['fixtures'] or os.path.join(tempfile.gettempdir(), 'hust-bench', 'fixtures')
+        for size in sizes:
+            folder = os.path.join(fixtures, f'{size}mb')
+            if not os.path.isfile(os.path.join(folder, 'manifest.mpd')):
+                self.stdout.write(f"🎬 Sinh media tổng hợp {size} MB...")
+                make_fixtures(folder, size, ffmpeg)
+
+        server = FixtureServer(fixtures)
+        threading.Thread(target=server.serve_forever, daemon=True, name='bench-fixtures').start()
+        self.stdout.write(f"🌐 Fixture server: {server.base_url}")
+
+        report = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'tools': {'ffmpeg': ffmpeg, 'ffprobe': tasks.FFPROBE_PATH, 'aria2c': tasks.ARIA2C_PATH},
+            'config': {'jobs': opts['jobs'], 'db': connection.vendor},
+            'results': [],
+        }
+        # Celery chạy task ngay trong process (2 stage nối tiếp trên cùng luồng), site 'default'
+        # (127.0.0.1) không bị giới hạn -> chỉ đo pipeline, không đo hàng đợi/throttle
+        policies = {**settings.SITE_POLICIES}
+        policies['default'] = {**policies['default'], 'concurrency': max(levels) * 2, 'rate': 1000.0, 'burst': 1000}
+        eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        run = int(time.time())
+        try:
+            with override_settings(SITE_POLICIES=policies):
+                for target in targets:
+                    runner = self._web_job if target == 'web' else self._cli_runner(fixtures)
+                    if runner is None:
+                        continue
+                    for combo in combos:
+                        for size in sizes:
+                            for level in levels:
+                                result = self._measure(server, runner, target, combo, size, level, opts, run)
+                                report['results'].append(result)
+                                self._print(result)
+        finally:
+            current_app.conf.task_always_eager = eager
+            server.shutdown()
+            server.server_close()
+
+        output = opts['output'] or f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        self.stdout.write(f"💾 Đã ghi {output}")
+        if opts['compare']:
+            self._compare(opts['compare'], report)
+
+    # --- MỘT LƯỢT ĐO ---
+    def _measure(self, server, runner, target, combo, size, level, opts, run):
+        urls = [
+            f"{server.base_url}/{size}mb/job-{target}-{combo}-{level}-{run}-{i}.{COMBOS[combo]['ext']}"
+            for i in range(opts['jobs'])
+        ]
+        sent_before = server.bytes_sent
+        quiet = contextlib.nullcontext() if opts['verbose'] else contextlib.redirect_stdout(io.StringIO())
+        with RssSampler() as rss, quiet:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                outcomes = list(pool.map(lambda url: runner(url, combo), urls))
+            wall = time.perf_counter() - started
+        latencies = [o['seconds'] for o in outcomes if o['ok']]
+        errors = sorted({o['error'] for o in outcomes if not o['ok']})
+        served = server.bytes_sent - sent_before
+        media = _media_bytes(os.path.join(server.root, f'{size}mb'), combo)
+        return {
+            'target': target, 'combo': combo, 'size_mb': size, 'concurrency': level,
+            'jobs': len(urls), 'ok': len(latencies), 'failed': len(urls) - len(latencies),
+            'seconds': round(wall, 3),
+            'jobs_per_s': round(len(latencies) / wall, 3),
+            # Dung lượng media cần tải của các job thành công / thời gian
+            'mb_per_s': round(media * len(latencies) / 1024 ** 2 / wall, 2),
+            # Tổng byte server đã ghi ra socket (gồm cả lượt đọc thử của extractor generic)
+            'served_mb': round(served / 1024 ** 2, 2),
+            'output_mb': round(sum(o['bytes'] for o in outcomes) / 1024 ** 2, 2),
+            'latency_p50': round(_percentile(latencies, 50), 3),
+            'latency_p99': round(_percentile(latencies, 99), 3),
+            'peak_rss_mb': round(rss.peak / 1024 ** 2, 1),
+            # ffmpeg/aria2c: RSS lớn nhất của 1 process con từ đầu lần chạy (không theo từng lượt)
+            'child_peak_rss_mb': round(_max_rss_bytes(resource.RUSAGE_CHILDREN) / 1024 ** 2, 1) if resource else None,
+            'errors': errors[:5],
+        }
+
+    def _web_job(self, url, combo):
+        """Giống /api/start/: tạo task + fingerprint, submit_task (Celery eager chạy luôn cả 2 stage)"""
+        task = DownloadTask(url=url, **COMBOS[combo]['task'])
+        task.fingerprint = task_fingerprint(task)
+        started = time.perf_counter()
+        try:
+            tasks.submit_task(task)
+            seconds = time.perf_counter() - started
+            task.refresh_from_db()
+            size = 0
+            if task.filename:
+                path = os.path.join(tasks.DOWNLOAD_DIR, task.filename)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                # Dọn ngay để lượt sau không trúng cache và không chiếm ngân sách đĩa
+                result_cache.invalidate(task.fingerprint)
+                storage.forget(task.filename)
+                if os.path.exists(path):
+                    os.remove(path)
+            task.delete()
+            return {'ok': task.status == 'FINISHED', 'seconds': seconds, 'bytes': size, 'error': task.error}
+        finally:
+            connection.close()
+
+    def _cli_runner(self, fixtures):
+        """HUSTDownloader với thư mục tạm riêng; thiếu thư viện/công cụ thì bỏ qua CLI"""
+        try:
+            import main
+            from rich.console import Console
+        except ImportError as e:
+            self.stderr.write(f"⚠️ Bỏ qua CLI: {e}")
+            return None
+        if not main.DIRS['ffmpeg'] or not main.DIRS['aria2c']:
+            self.stderr.write("⚠️ Bỏ qua CLI: cần ffmpeg và aria2c (PATH hoặc bin/)")
+            return None
+        root = os.path.join(os.path.dirname(fixtures), 'cli')
+        main.DIRS.update(
+            downloads=os.path.join(root, 'downloads'),
+            extract_cache=os.path.join(root, 'extract'),
+            downloader_stats=os.path.join(root, 'downloader'),
+        )
+        main.console = Console(file=io.StringIO())
+        downloader = main.HUSTDownloader()
+
+        def job(url, combo):
+            name = urlparse(url).path.rsplit('/', 1)[1].rsplit('.', 1)[0]
+            started = time.perf_counter()
+            downloader.download(url, dict(COMBOS[combo]['cli']))
+            seconds = time.perf_counter() - started
+            # download() tự bắt lỗi -> kết quả là file cuối có tên job
+            outputs = [
+                os.path.join(folder, f) for folder, _, files in os.walk(main.DIRS['downloads'])
+                if '.parts' not in folder for f in files if f.startswith(name) and not f.endswith('.part')
+            ]
+            size = sum(os.path.getsize(p) for p in outputs)
+            for path in outputs:
+                os.remove(path)
+            return {'ok': bool(outputs), 'seconds': seconds, 'bytes': size, 'error': '' if outputs else 'no output'}
+        return job
+
+    # --- IN KẾT QUẢ ---
+    def _print(self, r):
+        self.stdout.write(
+            f"[{r['target']:3}] {r['combo']:11} {r['size_mb']:>5} MB x{r['concurrency']:<3}: "
+            f"{r['ok']}/{r['jobs']} ok | {r['jobs_per_s']:6.2f} jobs/s | {r['mb_per_s']:8.2f} MB/s | "
+            f"p50 {r['latency_p50']:7.2f}s | p99 {r['latency_p99']:7.2f}s | RSS {r['peak_rss_mb']:7.1f} MB"
+            + (f" | lỗi: {r['errors'][0]}" if r['errors'] else '')
+        )
+
+    def _compare(self, path, report):
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)
+
+        def ident(r):
+            return r['target'], r['combo'], r['size_mb'], r['concurrency']
+        old = {ident(r): r for r in previous.get('results', [])}
+        self.stdout.write(f"📊 So với {path} ({previous.get('started_at')}):")
+        for r in report['results']:
+            before = old.get(ident(r))
+            if not before:
+                continue
+            deltas = []
+            for field in ('jobs_per_s', 'mb_per_s', 'latency_p50', 'latency_p99', 'peak_rss_mb'):
+                if before[field]:
+                    deltas.append(f"{field} {(r[field] - before[field]) / before[field] * 100:+.1f}%")
+            self.stdout.write(f"[{r['target']:3}] {r['combo']:11} {r['size_mb']:>5} MB x{r['concurrency']:<3}: {' | '.join(deltas)}")
@@ -0,0 +1,126 @@
+import os
+import time
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from core import tasks, pipeline, sessions
+from core.models import DownloadTask
+from .bench_pipeline import FixtureServer, make_fixtures
+from .bench_status import _percentile
+
+
+def _write_cookies(path, count):
+    """cookies.txt giả (Netscape format) cỡ file export thật từ trình duyệt"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# Netscape HTTP Cookie File\n')
+        for i in range(count):
+            f.write(f".youtube.com\tTRUE\t/\tTRUE\t2000000000\tBENCH{i}\t{'x' * 80}\n")
+            f.write(f"127.0.0.1\tFALSE\t/\tFALSE\t2000000000\tLOCAL{i}\t{'y' * 40}\n")
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo chi phí cố định mỗi task stage tải (tạo YoutubeDL + nạp cookie + extract qua HTTP cục bộ): "
+        "tạo mới mỗi task so với dùng lại YoutubeDL trong SessionPool (core/sessions.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=40, help='Số task mỗi lượt đo')
+        parser.add_argument('--threads', default='1,4', help='Số task chạy cùng lúc (giống FETCH_CONCURRENCY), VD: 1,4')
+        parser.add_argument('--cookies', type=int, default=150, help='Số cookie/domain trong cookies.txt giả (0 = không dùng)')
+        parser.add_argument('--fixtures', default='', help='Thư mục media tổng hợp (mặc định dùng chung với bench_pipeline)')
+
+    def handle(self, *args, **opts):
+        fixtures = opts['fixtures'] or os.path.join(tempfile.gettempdir(), 'hust-bench', 'fixtures')
+        # Chỉ cần extract (không tải) nên 1 MB byte ngẫu nhiên là đủ
+        if not os.path.isfile(os.path.join(fixtures, '1mb', 'manifest.mpd')):
+            make_fixtures(os.path.join(fixtures, '1mb'), 1, None)
+        cookie_file = None
+        if opts['cookies']:
+            cookie_file = os.path.join(tempfile.mkdtemp(prefix='hust-bench-'), 'cookies.txt')
+
+        server = FixtureServer(fixtures)
+        threading.Thread(target=server.serve_forever, daemon=True, name='bench-fixtures').start()
+        self.stdout.write(
+            f"🌐 Fixture server: {server.base_url} | {opts['tasks']} task/lượt | "
+            f"cookies.txt: {opts['cookies'] * 2 if cookie_file else 0} cookie"
+        )
+        # Nạp sẵn extractor như worker thật (warm chạy khi worker khởi động, không tính vào task)
+        sessions.SessionPool().warm()
+        try:
+            results = {}
+            for level in [int(t) for t in opts['threads'].split(',') if t]:
+                for mode in ('new', 'pooled'):
+                    results[(mode, level)] = self._run(server, mode, level, cookie_file, opts)
+                    self._report(mode, level, results[(mode, level)])
+                new, pooled = results[('new', level)], results[('pooled', level)]
+                if pooled['total'] and new['total']:
+                    saved = _percentile(new['total'], 50) - _percentile(pooled['total'], 50)
+                    self.stdout.write(self.style.SUCCESS(
+                        f"   -> {level} luồng: giảm {saved:.1f} ms/task ở p50 "
+                        f"({_percentile(new['total'], 50) / max(_percentile(pooled['total'], 50), 0.001):.1f}x)"
+                    ))
+        finally:
+            server.shutdown()
+            server.server_close()
+            if cookie_file:
+                os.remove(cookie_file)
+                os.rmdir(os.path.dirname(cookie_file))
+
+    def _run(self, server, mode, level, cookie_file, opts):
+        if cookie_file:
+            # Tạo mới mỗi task thì YoutubeDL.close() ghi đè cookies.txt (nhiều luồng ghi cùng lúc
+            # có thể làm hỏng file) -> mỗi lượt đo bắt đầu lại từ file sạch
+            _write_cookies(cookie_file, opts['cookies'])
+        pool = sessions.SessionPool(
+            cookies=sessions.CookieFile(cookie_file) if cookie_file else None,
+            max_idle=max(level, 1), enabled=(mode == 'pooled'),
+        )
+        stats = {'acquire': [], 'extract': [], 'total': [], 'errors': 0}
+        lock = threading.Lock()
+
+        def job(i):
+            # Task chưa lưu DB: chỉ để build_opts sinh đúng bộ tùy chọn của stage tải
+            task_db = DownloadTask(id=uuid.uuid4(), url=f"{server.base_url}/1mb/job-sessions-{mode}-{level}-{i}.mp4")
+            ydl_opts = tasks.build_opts(task_db, progress_hooks=[lambda d: None])
+            ydl_opts.update({'cookiefile': cookie_file, 'quiet': True, 'noprogress': True})
+            started = time.perf_counter()
+            try:
+                with pool.session(
+                    pipeline.FetchOnlyYoutubeDL, ydl_opts,
+                    tuner=tasks.DOWNLOADER_TUNER, aria2c_path=tasks.ARIA2C_PATH,
+                ) as ydl:
+                    acquired = time.perf_counter()
+                    info = ydl.extract_info(task_db.url, download=False, process=False)
+                    if not info:
+                        raise Exception('extract failed')
+            except Exception:
+                with lock:
+                    stats['errors'] += 1
+                return
+            done = time.perf_counter()
+            with lock:
+                stats['acquire'].append((acquired - started) * 1000)
+                stats['extract'].append((done - acquired) * 1000)
+                stats['total'].append((done - started) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as executor:
+            list(executor.map(job, range(opts['tasks'])))
+        stats['wall'] = time.perf_counter() - started
+        stats['pool'] = dict(pool.stats)
+        pool.close()
+        return stats
+
+    def _report(self, mode, level, stats):
+        def fmt(name):
+            return f"{_percentile(stats[name], 50):7.1f} / {_percentile(stats[name], 95):7.1f}"
+
+        self.stdout.write(
+            f"[{mode:6}] {level} luồng: p50/p95 (ms) tạo/lấy YoutubeDL {fmt('acquire')} | "
+            f"extract {fmt('extract')} | tổng {fmt('total')} | "
+            f"{len(stats['total']) / stats['wall']:6.1f} task/s | lỗi {stats['errors']} | "
+            f"tạo mới {stats['pool']['created']}, dùng lại {stats['pool']['reused']}"
+        )
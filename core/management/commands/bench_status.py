@@ -0,0 +1,142 @@
+import time
+import random
+import statistics
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, OperationalError
+from core.models import DownloadTask
+from core.views import _db_state
+
+BENCH_URL = 'https://bench.invalid/status/'
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo độ trễ poll trạng thái (đường DB, khi Redis không có) trong lúc nhiều worker cùng ghi: "
+        "tra từng task so với tra hàng loạt (/api/status/)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=500, help='Số task giả lập')
+        parser.add_argument('--writers', type=int, default=4, help='Số luồng ghi (giả lập Celery worker)')
+        parser.add_argument('--readers', type=int, default=4, help='Số luồng poll trạng thái')
+        parser.add_argument('--batch', type=int, default=50, help='Số task mỗi lượt poll')
+        parser.add_argument('--duration', type=float, default=10.0, help='Thời gian mỗi lượt đo (giây)')
+        parser.add_argument(
+            '--baseline', action='store_true',
+            help='SQLite: đo thêm với cấu hình cũ (rollback journal, không busy_timeout, transaction DEFERRED)',
+        )
+
+    def handle(self, *args, **opts):
+        vendor = connection.vendor
+        tasks = DownloadTask.objects.bulk_create([
+            DownloadTask(url=f"{BENCH_URL}{i}", status='DOWNLOADING', progress=0.0)
+            for i in range(opts['tasks'])
+        ])
+        task_ids = [t.id for t in tasks]
+        self.stdout.write(
+            f"🧪 {vendor}: {len(task_ids)} task, {opts['writers']} luồng ghi, "
+            f"{opts['readers']} luồng đọc, {opts['batch']} task/lượt poll, {opts['duration']}s/lượt"
+        )
+        try:
+            runs = [('tuned', None)]
+            if opts['baseline'] and vendor == 'sqlite':
+                runs.append(('baseline', {'timeout': 5}))
+            for label, options in runs:
+                for mode in ('single', 'bulk'):
+                    self._report(label, mode, self._run(task_ids, mode, options, opts))
+        finally:
+            connections.close_all()
+            if opts['baseline'] and vendor == 'sqlite':
+                # Trả DB về WAL (PRAGMA trong init_command chạy lại khi mở kết nối mới)
+                connection.ensure_connection()
+                connection.close()
+            DownloadTask.objects.filter(url__startswith=BENCH_URL).delete()
+
+    def _run(self, task_ids, mode, options, opts):
+        db_settings = settings.DATABASES['default']
+        saved_options = db_settings.get('OPTIONS')
+        connections.close_all()
+        if options is not None:
+            # Kết nối mở trong các luồng đo đọc cấu hình này; journal đổi 1 lần trước khi đo
+            db_settings['OPTIONS'] = options
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=DELETE')
+            connection.close()
+
+        stop = threading.Event()
+        stats = {'read': [], 'write': [], 'read_errors': 0, 'write_errors': 0}
+        lock = threading.Lock()
+
+        def writer():
+            rnd = random.Random()
+            try:
+                while not stop.is_set():
+                    task_id = rnd.choice(task_ids)
+                    started = time.perf_counter()
+                    try:
+                        DownloadTask.objects.filter(id=task_id).update(progress=rnd.uniform(0, 100))
+                    except OperationalError:
+                        with lock:
+                            stats['write_errors'] += 1
+                        continue
+                    with lock:
+                        stats['write'].append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        def reader():
+            rnd = random.Random()
+            try:
+                while not stop.is_set():
+                    ids = rnd.sample(task_ids, min(opts['batch'], len(task_ids)))
+                    started = time.perf_counter()
+                    try:
+                        if mode == 'bulk':
+                            # Giống /api/status/: 1 query cho mọi task không có trên Redis
+                            states = [_db_state(t) for t in DownloadTask.objects.select_related('leader').filter(id__in=ids)]
+                        else:
+                            states = [_db_state(DownloadTask.objects.select_related('leader').get(id=i)) for i in ids]
+                    except OperationalError:
+                        with lock:
+                            stats['read_errors'] += 1
+                        continue
+                    assert len(states) == len(ids)
+                    with lock:
+                        stats['read'].append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(opts['writers'])]
+        threads += [threading.Thread(target=reader) for _ in range(opts['readers'])]
+        try:
+            for t in threads:
+                t.start()
+            time.sleep(opts['duration'])
+            stop.set()
+            for t in threads:
+                t.join()
+        finally:
+            db_settings['OPTIONS'] = saved_options
+            connections.close_all()
+        stats['duration'] = opts['duration']
+        return stats
+
+    def _report(self, label, mode, stats):
+        reads = [s * 1000 for s in stats['read']]
+        writes = [s * 1000 for s in stats['write']]
+        self.stdout.write(
+            f"[{label:8}] poll {mode:6}: "
+            f"p50 {_percentile(reads, 50):7.2f} ms | p95 {_percentile(reads, 95):7.2f} ms | "
+            f"p99 {_percentile(reads, 99):7.2f} ms | {len(reads) / stats['duration']:7.1f} poll/s | "
+            f"lỗi đọc {stats['read_errors']} || ghi p50 {statistics.median(writes) if writes else 0:6.2f} ms, "
+            f"{len(writes) / stats['duration']:7.1f} ghi/s, lỗi ghi {stats['write_errors']}"
+        )
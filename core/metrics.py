@@ -0,0 +1,208 @@
+import re
+import time
+import socket
+import threading
+import redis
+from .redis_client import get_redis, key
+
+# --- METRICS KIỂU PROMETHEUS (GỘP QUA REDIS) ---
+# Web, worker fetch và worker postprocess là các process (thậm chí các máy) khác nhau nên số liệu
+# được cộng dồn trên Redis (HINCRBY), endpoint /metrics chỉ đọc ra và in theo text format của
+# Prometheus. Ghi metrics lỗi (Redis chết) thì bỏ qua, không bao giờ làm hỏng task.
+
+# Mốc histogram (giây) cho các stage: extract nhanh, tải/convert có thể tới cả tiếng
+STAGE_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# Mốc tốc độ tải (bytes/giây): 256 KB/s ... 64 MB/s
+THROUGHPUT_BUCKETS = tuple(256 * 1024 * 4 ** i for i in range(5))
+
+# name -> (type, help, buckets)
+METRICS = {
+    'hust_extract_seconds': ('histogram', 'Thời gian extract thông tin video', STAGE_BUCKETS),
+    'hust_download_seconds': ('histogram', 'Thời gian tải (stage 1, sau extract)', STAGE_BUCKETS),
+    'hust_postprocess_seconds': ('histogram', 'Thời gian ghép/convert (stage 2)', STAGE_BUCKETS),
+    'hust_task_latency_seconds': ('histogram', 'Thời gian từ lúc tạo task tới khi kết thúc', STAGE_BUCKETS),
+    'hust_download_throughput_bytes': ('histogram', 'Tốc độ tải trung bình của 1 format (bytes/giây)', THROUGHPUT_BUCKETS),
+    'hust_downloaded_bytes_total': ('counter', 'Tổng dung lượng đã tải qua mạng', None),
+    'hust_tasks_total': ('counter', 'Số task kết thúc theo trạng thái', None),
+    'hust_task_failures_total': ('counter', 'Số task lỗi theo stage và nhóm lỗi', None),
+    'hust_extract_cache_total': ('counter', 'Số lần extract theo kết quả cache (hit/miss)', None),
+    'hust_sidecar_cache_total': ('counter', 'Số file thumbnail/phụ đề theo kết quả cache (hit/miss)', None),
+    'hust_singleflight_joins_total': ('counter', 'Số task bám theo job trùng đang chạy', None),
+    'hust_site_throttled_total': ('counter', 'Số lần task bị hoãn do giới hạn theo site', None),
+    'hust_admission_rejected_total': ('counter', 'Số yêu cầu tải bị từ chối (429) theo lý do', None),
+}
+
+# Nhóm lỗi theo nội dung thông báo (yt-dlp/ffmpeg), thứ tự = độ ưu tiên
+FAILURE_CLASSES = (
+    ('rate_limited', r'429|too many requests|rate.?limit'),
+    ('forbidden', r'403|forbidden'),
+    ('not_found', r'404|not found|does not exist'),
+    ('login_required', r'sign in|login|cookies|private'),
+    ('geo_blocked', r'geo|not available in your country'),
+    ('unavailable', r'unavailable|removed|copyright|terminated'),
+    ('format', r'requested format|no video formats|format is not available'),
+    ('timeout', r'timed? ?out'),
+    ('network', r'connection|reset by peer|network|ssl|resolve'),
+    ('ffmpeg', r'ffmpeg|ffprobe|postprocess|merg'),
+    ('disk', r'no space|disk'),
+)
+
+
+def failure_class(error):
+    message = str(error).lower()
+    for name, pattern in FAILURE_CLASSES:
+        if re.search(pattern, message):
+            return name
+    return 'other'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+def _series(name, lbl):
+    return f"{name}{{{lbl}}}" if lbl else name
+
+
+def _execute(build):
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        build(pipe)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def inc(name, amount=1, **labels):
+    _execute(lambda pipe: pipe.hincrbyfloat(key('metrics', name), _labels(labels), amount))
+
+
+def observe(name, value, **labels):
+    """Ghi 1 giá trị vào histogram (đếm theo từng mốc, lúc xuất mới cộng dồn)"""
+    buckets = METRICS[name][2]
+    le = next((b for b in buckets if value <= b), '+Inf')
+    lbl = _labels(labels)
+
+    def build(pipe):
+        h = key('metrics', name)
+        pipe.hincrby(h, f"{lbl}\tb\t{le}", 1)
+        pipe.hincrby(h, f"{lbl}\tcount", 1)
+        pipe.hincrbyfloat(h, f"{lbl}\tsum", value)
+    _execute(build)
+
+
+class Timer:
+    """with metrics.Timer('hust_postprocess_seconds', extractor='youtube'): ..."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.monotonic() - self.started
+        observe(self.name, self.seconds, **self.labels)
+        return False
+
+
+def record_download_params(download_params, extractor):
+    """Dung lượng + tốc độ của từng format đã tải (task.download_params, xem adaptive_dl)"""
+    for p in download_params or []:
+        if p.get('ok') and p.get('bytes'):
+            inc('hust_downloaded_bytes_total', p['bytes'], extractor=extractor)
+            if p.get('seconds'):
+                observe('hust_download_throughput_bytes', p['bytes'] / p['seconds'], extractor=extractor)
+
+
+# --- WORKER ĐANG SỐNG ---
+def announce_worker(hostname, interval=15):
+    """Worker tự báo danh định kỳ (sorted set, score = hạn), chết thì tự rơi khỏi danh sách"""
+    def run():
+        while True:
+            try:
+                get_redis().zadd(key('metrics', 'workers'), {hostname or socket.gethostname(): time.time() + interval * 3})
+            except redis.RedisError:
+                pass
+            time.sleep(interval)
+    threading.Thread(target=run, daemon=True, name='metrics-presence').start()
+
+
+def _fmt(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+# --- XUẤT TEXT FORMAT ---
+def _render_registry(r, lines):
+    for name, (kind, help_text, buckets) in METRICS.items():
+        raw = r.hgetall(key('metrics', name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for lbl, value in sorted(raw.items()):
+                lines.append(f"{_series(name, lbl)} {_fmt(value)}")
+            continue
+        series = {}
+        for field, value in raw.items():
+            lbl, _, rest = field.partition('\t')
+            series.setdefault(lbl, {})[rest] = value
+        for lbl, data in sorted(series.items()):
+            prefix = f"{lbl}," if lbl else ''
+            cumulative = 0
+            for le in list(buckets) + ['+Inf']:
+                cumulative += int(data.get(f"b\t{le}", 0))
+                lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{_series(name + '_sum', lbl)} {_fmt(data.get('sum', 0))}")
+            lines.append(f"{_series(name + '_count', lbl)} {_fmt(data.get('count', 0))}")
+
+
+def _gauge(lines, name, help_text, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, value in samples:
+        lines.append(f"{_series(name, _labels(labels))} {_fmt(value)}")
+
+
+def render(queues, task_counts, result_cache_stats, storage_usage):
+    """
+    Toàn bộ metrics dạng text (Prometheus exposition format 0.0.4).
+    queues: {tên queue: [các list Redis của queue]} (mỗi priority 1 list, xem core/scheduling.py)
+    """
+    r = get_redis()
+    lines = []
+    _render_registry(r, lines)
+
+    pipe = r.pipeline(transaction=False)
+    for lists in queues.values():
+        for name in lists:
+            pipe.llen(name)
+    depths = iter(pipe.execute())
+    _gauge(lines, 'hust_celery_queue_depth', 'Số message đang chờ trong queue Celery (mọi làn ưu tiên)',
+           [({'queue': q}, sum(next(depths) for _ in lists)) for q, lists in queues.items()])
+
+    now = time.time()
+    r.zremrangebyscore(key('metrics', 'workers'), '-inf', now)
+    workers = r.zrangebyscore(key('metrics', 'workers'), now, '+inf')
+    _gauge(lines, 'hust_celery_workers', 'Số worker Celery đang sống (theo nhóm queue)',
+           [({'pool': pool}, sum(1 for w in workers if w.split('@')[0] == pool))
+            for pool in sorted({w.split('@')[0] for w in workers})])
+    _gauge(lines, 'hust_tasks_running', 'Số task đang chạy (còn heartbeat)',
+           [({}, sum(1 for _ in r.scan_iter(key('running', '*'), count=500)))])
+
+    _gauge(lines, 'hust_tasks', 'Số task trong DB theo trạng thái', [({'status': s}, c) for s, c in task_counts])
+    _gauge(lines, 'hust_result_cache_total', 'Cache kết quả (file đã tải) theo kết quả',
+           [({'result': 'hit'}, result_cache_stats['hits']), ({'result': 'miss'}, result_cache_stats['misses'])])
+    _gauge(lines, 'hust_result_cache_hit_ratio', 'Tỉ lệ hit của cache kết quả', [({}, result_cache_stats['hit_rate'])])
+    _gauge(lines, 'hust_storage_bytes', 'Dung lượng media/downloads theo index và ngân sách', [
+        ({'kind': 'used'}, storage_usage['used_bytes'] or 0),
+        ({'kind': 'budget'}, storage_usage['budget_bytes']),
+        ({'kind': 'disk_free'}, storage_usage['disk_free_bytes'] or 0),
+    ])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_remove_downloadtask_is_audio_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_downloadtask_leader'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='download_params',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
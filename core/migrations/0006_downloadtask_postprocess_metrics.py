@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_downloadtask_download_params'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='postprocess_mode',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='postprocess_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 16:25
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_downloadtask_postprocess_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('source_url', models.URLField(blank=True, default='')),
+                ('title', models.CharField(blank=True, default='', max_length=255)),
+                ('status', models.CharField(default='EXPANDING', max_length=20)),
+                ('max_parallel', models.PositiveIntegerField(default=3)),
+                ('options', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='batch_index',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='core.downloadbatch'),
+        ),
+    ]
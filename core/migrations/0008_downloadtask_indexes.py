@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_downloadbatch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='downloadtask',
+            index=models.Index(fields=['status', 'created_at'], name='task_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadtask',
+            index=models.Index(fields=['created_at'], name='task_created_idx'),
+        ),
+    ]
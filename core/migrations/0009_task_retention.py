@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_downloadtask_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTaskSummary',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField(unique=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('finished', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('followers', models.PositiveIntegerField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('postprocess_seconds', models.FloatField(default=0.0)),
+                ('sites', models.JSONField(blank=True, default=dict)),
+                ('failure_reasons', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_task_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='estimated_cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,10 +1,27 @@
 from django.db import models
 import uuid
 
+class DownloadBatch(models.Model):
+    """Một lần gửi nhiều link hoặc 1 playlist/kênh, bung ra thành nhiều DownloadTask con"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Link playlist/kênh gốc (trống nếu gửi danh sách link)
+    source_url = models.URLField(blank=True, default='')
+    title = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=20, default='EXPANDING') # EXPANDING, READY, FAILED
+    # Số task con được chạy cùng lúc, các task còn lại chờ ở trạng thái WAITING
+    max_parallel = models.PositiveIntegerField(default=3)
+    # Tùy chọn tải áp dụng cho mọi task con (task_type, resolution, container...)
+    options = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.source_url or 'batch'} - {self.status}"
+
+
 class DownloadTask(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     url = models.URLField()
-    status = models.CharField(max_length=20, default='PENDING') # PENDING, DOWNLOADING, PROCESSING, FINISHED, FAILED
+    status = models.CharField(max_length=20, default='PENDING') # WAITING (chờ lượt trong batch), PENDING, DOWNLOADING, DOWNLOADED (chờ hậu xử lý), PROCESSING, FINISHED, FAILED
     progress = models.FloatField(default=0.0)
     filename = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -25,5 +42,58 @@ class DownloadTask(models.Model):
     use_subtitle = models.BooleanField(default=False)
     use_thumbnail = models.BooleanField(default=False)
 
+    # Dấu vân tay (nội dung + tùy chọn) dùng cho cache kết quả
+    fingerprint = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
+    # Task trùng đang chạy mà task này bám theo (không tự tải, chỉ đọc tiến trình của leader)
+    leader = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='followers')
+
+    # Downloader đã dùng cho từng format (profile aria2c/native, host CDN, tốc độ đạt được)
+    download_params = models.JSONField(default=list, blank=True)
+
+    # Hậu xử lý ở stage 2: 'remux'/'copy' (copy stream) hoặc 'transcode' (encode lại audio), và thời gian chạy (giây)
+    postprocess_mode = models.CharField(max_length=10, blank=True, default='')
+    postprocess_seconds = models.FloatField(null=True, blank=True)
+
+    # Thuộc batch nào (None nếu gửi lẻ) và thứ tự trong batch
+    batch = models.ForeignKey(DownloadBatch, null=True, blank=True, on_delete=models.CASCADE, related_name='tasks')
+    batch_index = models.PositiveIntegerField(default=0)
+
+    # Lý do lỗi (task FAILED), dùng cho thống kê theo ngày khi task cũ bị dọn
+    error = models.CharField(max_length=255, blank=True, default='')
+
+    # Chi phí ước tính (giây worker) và priority Celery lúc gửi vào queue (làn ưu tiên, xem core/scheduling.py)
+    estimated_cost = models.FloatField(null=True, blank=True)
+    priority = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Lọc theo trạng thái (task đang chạy lúc worker khởi động, task hết hạn...) + sắp theo thời gian
+            models.Index(fields=['status', 'created_at'], name='task_status_created_idx'),
+            # Dọn dẹp/thống kê theo thời gian
+            models.Index(fields=['created_at'], name='task_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.url} - {self.status}"
+
+
+class DailyTaskSummary(models.Model):
+    """Số liệu gộp theo ngày của các task đã bị dọn khỏi DB (xem core/retention.py)"""
+    id = models.BigAutoField(primary_key=True)
+    day = models.DateField(unique=True)
+    total = models.PositiveIntegerField(default=0)
+    finished = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # Task bám theo job trùng (single-flight), không tự tải
+    followers = models.PositiveIntegerField(default=0)
+    # Tổng dung lượng đã tải qua mạng (theo download_params) và thời gian hậu xử lý
+    bytes_downloaded = models.BigIntegerField(default=0)
+    postprocess_seconds = models.FloatField(default=0.0)
+    # {site: số task}, {lý do lỗi: số task}
+    sites = models.JSONField(default=dict, blank=True)
+    failure_reasons = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return f"{self.url} - {self.status}"
\ No newline at end of file
+        return f"{self.day}: {self.finished}/{self.total}"
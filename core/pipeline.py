@@ -0,0 +1,89 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import yt_dlp
+import yt_dlp.postprocessor
+from .adaptive_dl import AdaptiveYoutubeDL
+from .sidecars import ParallelSidecarsMixin
+
+# --- TÁCH PIPELINE: TẢI (I/O) VÀ HẬU XỬ LÝ (CPU) (KHÔNG PHỤ THUỘC DJANGO) ---
+# Stage 1 (queue 'fetch')      : yt-dlp tải file, dừng ngay trước bước hậu xử lý
+# Stage 2 (queue 'postprocess'): ghép/convert/nhúng thumbnail/cắt SponsorBlock bằng ffmpeg
+# Giữa 2 stage, "việc hậu xử lý còn nợ" được ghi ra JSON trong thư mục tạm của task.
+# CLI (main.py) dùng chung: tải hết trước rồi hậu xử lý cả batch song song.
+
+JOBS_FILE = 'postprocess.json'
+
+
+class FetchOnlyYoutubeDL(ParallelSidecarsMixin, AdaptiveYoutubeDL):
+    """
+    YoutubeDL chỉ tải, không hậu xử lý. yt-dlp gọi post_process() ngay sau khi tải xong
+    từng video (kể cả bước merge video+audio) -> ghi lại tham số để stage 2 chạy tiếp.
+    Downloader cho từng format được chọn theo lịch sử tốc độ (xem core/adaptive_dl.py),
+    thumbnail/phụ đề tải song song với file chính (xem core/sidecars.py).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deferred_jobs = []
+
+    def reset(self):
+        super().reset()
+        self.deferred_jobs = []
+
+    def post_process(self, filename, info, files_to_move=None):
+        files_to_move = self.finish_sidecars(info, files_to_move)
+        extra_pps = info.pop('__postprocessors', None) or []
+        self.deferred_jobs.append({
+            'filename': filename,
+            # Tên class của PP do yt-dlp tự thêm (FFmpegMergerPP, các Fixup...) để tạo lại ở stage 2
+            'extra_pps': [type(pp).__name__ for pp in extra_pps],
+            'files_to_move': files_to_move,
+            'info': self.sanitize_info(info),
+        })
+        info['filepath'] = filename
+        return info
+
+
+def save_jobs(work_dir, jobs, resumed=False):
+    path = os.path.join(work_dir, JOBS_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'resumed': resumed, 'jobs': jobs}, f)
+
+
+def load_jobs(work_dir):
+    """Trả về (jobs, resumed) hoặc (None, False) nếu stage 1 chưa ghi gì"""
+    path = os.path.join(work_dir, JOBS_FILE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None, False
+    return data['jobs'], data['resumed']
+
+
+def run_postprocess(ydl, job):
+    """Chạy phần hậu xử lý còn nợ của 1 video, trả về info sau xử lý (info['filepath'] = file cuối)"""
+    info = job['info']
+    info['__postprocessors'] = [getattr(yt_dlp.postprocessor, name)(ydl) for name in job['extra_pps']]
+    return ydl.post_process(job['filename'], info, job['files_to_move'])
+
+
+def run_postprocess_batch(opts, jobs, prepare=None, max_workers=None, sessions=None):
+    """
+    Hậu xử lý nhiều video song song. Việc nặng là process ffmpeg con nên thread là đủ
+    (worker Celery prefork là daemon, không mở được process pool); mỗi thread 1 YoutubeDL riêng.
+    prepare(ydl, job) chạy trước mỗi job (chọn remux/transcode...), trả về mode.
+    sessions: SessionPool (core/sessions.py) để dùng lại YoutubeDL của worker thay vì tạo mới.
+    Trả về list (info, mode) theo đúng thứ tự jobs.
+    """
+    def _run(job):
+        with (sessions.session(yt_dlp.YoutubeDL, opts) if sessions else yt_dlp.YoutubeDL(opts)) as ydl:
+            mode = prepare(ydl, job) if prepare else ''
+            return run_postprocess(ydl, job), mode
+
+    workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [_run(job) for job in jobs]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run, jobs))
@@ -0,0 +1,161 @@
+import json
+import time
+import redis
+from django.conf import settings
+from .redis_client import get_redis, key
+
+# --- KÊNH TIẾN TRÌNH NHANH (REDIS) ---
+# Tiến trình chi tiết (%, bytes, tốc độ, ETA) chỉ ghi vào Redis và có throttle.
+# Database chỉ được ghi khi trạng thái thay đổi (DOWNLOADING -> PROCESSING -> ...).
+
+
+def _state_key(task_id):
+    return key('progress', task_id)
+
+
+def channel(task_id):
+    """Kênh pub/sub báo có thay đổi (endpoint stream lắng nghe kênh này)"""
+    return key('progress', 'events', task_id)
+
+
+def _write(task_id, state):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.set(_state_key(task_id), json.dumps(state), ex=settings.FILE_EXPIRATION)
+        pipe.publish(channel(task_id), '1')
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def publish(task_db, **extra):
+    """Ghi trạng thái hiện tại của task (lấy từ DB object) lên kênh nhanh"""
+    state = {
+        'status': task_db.status,
+        'progress': task_db.progress,
+        'filename': task_db.filename,
+    }
+    state.update(extra)
+    _write(task_db.id, state)
+
+
+def follow(task_id, leader_id):
+    """Task follower (single-flight) đọc thẳng tiến trình của leader"""
+    _write(task_id, {'leader': str(leader_id)})
+
+
+def read(task_id):
+    """Đọc trạng thái từ kênh nhanh. None nếu không có (hết hạn / Redis lỗi)"""
+    try:
+        raw = get_redis().get(_state_key(task_id))
+        state = json.loads(raw) if raw else None
+        if state and 'leader' in state:
+            raw = get_redis().get(_state_key(state['leader']))
+            state = json.loads(raw) if raw else None
+    except redis.RedisError:
+        return None
+    return state
+
+
+def read_many(task_ids):
+    """Đọc trạng thái nhiều task trong 2 lượt MGET (task + leader mà task bám theo). {id: state}"""
+    task_ids = [str(t) for t in task_ids]
+    if not task_ids:
+        return {}
+    try:
+        r = get_redis()
+        states = {
+            task_id: json.loads(raw)
+            for task_id, raw in zip(task_ids, r.mget([_state_key(t) for t in task_ids])) if raw
+        }
+        leader_ids = sorted({s['leader'] for s in states.values() if 'leader' in s})
+        leaders = {}
+        if leader_ids:
+            leaders = {
+                leader_id: json.loads(raw)
+                for leader_id, raw in zip(leader_ids, r.mget([_state_key(t) for t in leader_ids])) if raw
+            }
+    except redis.RedisError:
+        return {}
+    result = {}
+    for task_id, state in states.items():
+        if 'leader' in state:
+            state = leaders.get(state['leader'])
+        if state:
+            result[task_id] = state
+    return result
+
+
+async def aread(client, task_id):
+    """
+    Bản async của read() cho endpoint stream (ASGI), dùng client redis.asyncio.
+    Trả về (id task thực sự phát sự kiện, state) - với follower là id của leader.
+    """
+    source_id = str(task_id)
+    raw = await client.get(_state_key(source_id))
+    state = json.loads(raw) if raw else None
+    if state and 'leader' in state:
+        source_id = state['leader']
+        raw = await client.get(_state_key(source_id))
+        state = json.loads(raw) if raw else None
+    return source_id, state
+
+
+class ProgressReporter:
+    """
+    Nhận callback progress_hooks của yt-dlp, gộp lại rồi đẩy lên Redis:
+    - Chỉ đẩy khi % thay đổi >= PROGRESS_MIN_DELTA và đã qua PROGRESS_MIN_INTERVAL giây
+    - Hoặc mỗi PROGRESS_HEARTBEAT giây (để tốc độ/ETA vẫn được cập nhật khi % đứng yên)
+    - Đổi trạng thái thì lưu DB ngay
+    """
+
+    def __init__(self, task_db):
+        self.task_db = task_db
+        self.state = {}
+        self._last_push = 0.0
+        self._last_progress = -1.0
+
+    def hook(self, d):
+        if d['status'] == 'downloading':
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                percent = min(downloaded * 100.0 / total, 100.0)
+            else:
+                try:
+                    percent = float(d.get('_percent_str', '0%').strip().replace('%', ''))
+                except ValueError:
+                    percent = self._last_progress if self._last_progress > 0 else 0.0
+
+            self.state = {
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'speed': d.get('speed'),
+                'eta': d.get('eta'),
+            }
+            self.task_db.progress = round(percent, 1)
+            self._transition('DOWNLOADING')
+            self._maybe_push()
+        elif d['status'] == 'finished':
+            # Xong 1 file (video hoặc audio); hậu xử lý là stage riêng nên vẫn là DOWNLOADING
+            self.task_db.progress = 100.0
+            self._push()
+
+    def _transition(self, status):
+        if self.task_db.status != status:
+            self.task_db.status = status
+            self.task_db.save(update_fields=['status', 'progress'])
+            self._push()
+
+    def _maybe_push(self):
+        now = time.monotonic()
+        elapsed = now - self._last_push
+        delta = abs(self.task_db.progress - self._last_progress)
+        if (elapsed >= settings.PROGRESS_MIN_INTERVAL and delta >= settings.PROGRESS_MIN_DELTA) \
+                or elapsed >= settings.PROGRESS_HEARTBEAT:
+            self._push()
+
+    def _push(self):
+        self._last_push = time.monotonic()
+        self._last_progress = self.task_db.progress
+        publish(self.task_db, **self.state)
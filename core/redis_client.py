@@ -0,0 +1,18 @@
+import redis
+from django.conf import settings
+
+# Dùng chung một connection pool cho cả process (web hoặc worker)
+_client = None
+
+
+def get_redis():
+    """Redis client dùng chung (Redis cũng chính là broker của Celery)"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
+
+
+def key(*parts):
+    """Ghép key Redis có tiền tố chung để không đụng key của Celery"""
+    return ':'.join(['hust'] + [str(p) for p in parts])
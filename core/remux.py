@@ -0,0 +1,191 @@
+import json
+import math
+import subprocess
+
+# --- GHÉP/CONVERT THEO CODEC: STREAM COPY KHI ĐƯỢC, CHỈ ENCODE KHI BẮT BUỘC (KHÔNG PHỤ THUỘC DJANGO) ---
+# Trước đây mọi job MP4 đều ép "-c:a aac" -> encode lại audio kể cả khi nguồn đã là AAC.
+# Giờ: chọn format ưu tiên stream hợp container, xem codec thật của stream đã tải,
+# hợp container thì chỉ remux (copy), không hợp mới encode audio.
+# Tải audio: ưu tiên nguồn cùng codec với đích (copy), phải encode thì không vượt bitrate nguồn.
+
+# Codec audio "tương thích" theo container (MP4: để chạy được trên iPhone/Windows)
+AUDIO_CODECS = {
+    'mp4': {'aac', 'mp3', 'alac', 'ac3', 'eac3'},
+    'webm': {'opus', 'vorbis'},
+}
+# Codec dùng khi buộc phải encode lại audio
+TRANSCODE_AUDIO = {
+    'mp4': ['-c:a', 'aac'],
+    'webm': ['-c:a', 'libopus'],
+}
+# Đuôi audio ưu tiên khi chọn format (tránh phải encode)
+PREFERRED_AUDIO_EXT = {'mp4': 'm4a', 'webm': 'webm'}
+
+
+def format_selector(resolution, container):
+    """
+    Chuỗi format ưu tiên cặp video+audio hợp container (MP4: mp4 + m4a/AAC),
+    không có thì lấy audio tốt nhất (sẽ encode khi ghép), cuối cùng mới fallback.
+    """
+    # MKV chứa được mọi codec, site cũng không trả stream đuôi .mkv -> không lọc theo đuôi
+    video = f"bestvideo[height<={resolution}]" if container == 'mkv' else f"bestvideo[height<={resolution}][ext={container}]"
+    audio_ext = PREFERRED_AUDIO_EXT.get(container)
+    preferred = f"{video}+bestaudio[ext={audio_ext}]/" if audio_ext else ''
+    return f"{preferred}{video}+bestaudio/best[height<={resolution}][ext={container}]/best"
+
+
+def _normalize_codec(codec):
+    codec = (codec or '').lower()
+    if codec.startswith('mp4a'):
+        return 'aac'
+    if codec.startswith('ac-3'):
+        return 'ac3'
+    if codec.startswith('ec-3'):
+        return 'eac3'
+    return codec.split('.')[0]
+
+
+def _probe_audio_streams(filepath, ffprobe_path):
+    """Các stream audio trong file (ffprobe): [{'codec_name', 'bit_rate'}], None nếu không probe được"""
+    if not ffprobe_path:
+        return None
+    try:
+        result = subprocess.run(
+            [ffprobe_path, '-v', 'error', '-select_streams', 'a',
+             '-show_entries', 'stream=codec_name,bit_rate:format=bit_rate', '-of', 'json', filepath],
+            capture_output=True, text=True, timeout=60,
+        )
+        data = json.loads(result.stdout or '{}')
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+    streams = data.get('streams', [])
+    # Opus/Vorbis trong webm không có bit_rate theo stream -> lấy của cả file (file chỉ có audio)
+    for stream in streams:
+        stream.setdefault('bit_rate', data.get('format', {}).get('bit_rate'))
+    return streams
+
+
+def probe_audio_codecs(filepath, ffprobe_path):
+    """Codec audio thật trong file (ffprobe), None nếu không probe được"""
+    streams = _probe_audio_streams(filepath, ffprobe_path)
+    if streams is None:
+        return None
+    return [_normalize_codec(s.get('codec_name')) for s in streams]
+
+
+def audio_codecs(info, ffprobe_path=None):
+    """Codec audio của các stream sẽ được ghép: ưu tiên probe file đã tải, không được thì đọc metadata"""
+    codecs = []
+    for fmt in info.get('requested_formats') or [info]:
+        acodec = fmt.get('acodec')
+        if acodec == 'none':
+            continue
+        probed = probe_audio_codecs(fmt['filepath'], ffprobe_path) if fmt.get('filepath') else None
+        if probed is not None:
+            codecs.extend(probed)
+        elif acodec:
+            codecs.append(_normalize_codec(acodec))
+    return codecs
+
+
+def merge_plan(info, container, ffprobe_path=None):
+    """
+    Trả về (mode, ffmpeg_args) cho bước ghép:
+    - ('remux', [])             : mọi stream audio đã hợp container -> chỉ copy
+    - ('transcode', [...])      : có audio không hợp -> encode audio, video vẫn copy
+    """
+    allowed = AUDIO_CODECS.get(container)
+    if not allowed:
+        return 'remux', []  # MKV chứa được mọi codec
+    codecs = audio_codecs(info, ffprobe_path)
+    if all(codec in allowed for codec in codecs):
+        return 'remux', []
+    return 'transcode', ['-c:v', 'copy'] + TRANSCODE_AUDIO[container]
+
+
+def apply_merge_plan(ydl, info, container, ffprobe_path=None):
+    """Đặt tham số ffmpeg cho riêng bước ghép (merger) của video này, trả về mode"""
+    mode, args = merge_plan(info, container, ffprobe_path)
+    pp_args = dict(ydl.params.get('postprocessor_args') or {})
+    pp_args['merger+ffmpeg'] = args
+    ydl.params['postprocessor_args'] = pp_args
+    return mode
+
+
+# --- AUDIO ---
+# Nguồn ưu tiên theo định dạng đích: cùng codec thì FFmpegExtractAudio chỉ copy, không encode lại
+AUDIO_SOURCE = {
+    'm4a': 'bestaudio[ext=m4a]',
+    'mp3': 'bestaudio[acodec=mp3]',
+    'opus': 'bestaudio[acodec=opus]',
+}
+# Codec nguồn copy thẳng được sang định dạng đích
+AUDIO_COPY = {
+    'm4a': {'aac'},
+    'mp3': {'mp3'},
+    'opus': {'opus'},
+    'flac': {'flac'},
+}
+LOSSLESS_TARGETS = {'flac', 'wav', 'alac'}
+# Bitrate (kbps) theo mức chất lượng người dùng chọn
+AUDIO_BITRATE = {'best': 320, 'medium': 128}
+
+
+def audio_format_selector(target):
+    pref = AUDIO_SOURCE.get(target)
+    return f"{pref}/bestaudio/best" if pref else 'bestaudio/best'
+
+
+def target_bitrate(quality):
+    return AUDIO_BITRATE.get(quality, AUDIO_BITRATE['medium'])
+
+
+def audio_plan(info, filepath, target, quality, ffprobe_path=None):
+    """
+    Trả về (mode, kbps) cho bước FFmpegExtractAudio:
+    - ('copy', None)       : nguồn đã đúng codec đích -> chỉ đổi container
+    - ('transcode', kbps)  : encode, bitrate = min(mức người dùng chọn, bitrate nguồn)
+    """
+    streams = _probe_audio_streams(filepath, ffprobe_path) if filepath else None
+    if streams:
+        codec = _normalize_codec(streams[0].get('codec_name'))
+        try:
+            source_kbps = int(streams[0]['bit_rate']) / 1000
+        except (TypeError, ValueError, KeyError):
+            source_kbps = info.get('abr')
+    else:
+        codec = _normalize_codec(info.get('acodec'))
+        source_kbps = info.get('abr')
+
+    if codec in AUDIO_COPY.get(target, ()):
+        return 'copy', None
+    if target in LOSSLESS_TARGETS:
+        return 'transcode', None  # Lossless: không có khái niệm bitrate đích
+    kbps = target_bitrate(quality)
+    if source_kbps:
+        # Encode lên bitrate cao hơn nguồn chỉ làm file to ra, không hay hơn
+        kbps = min(kbps, max(int(math.ceil(source_kbps)), 32))
+    return 'transcode', kbps
+
+
+def apply_audio_plan(ydl, info, filepath, target, quality, ffprobe_path=None):
+    """Đặt bitrate cho riêng bước convert audio (FFmpegExtractAudio) của file này, trả về mode"""
+    mode, kbps = audio_plan(info, filepath, target, quality, ffprobe_path)
+    pp_args = dict(ydl.params.get('postprocessor_args') or {})
+    # Tham số cấu hình được thêm sau -b:a mặc định của yt-dlp nên ghi đè được
+    pp_args['extractaudio+ffmpeg'] = ['-b:a', f'{kbps}k'] if kbps else []
+    ydl.params['postprocessor_args'] = pp_args
+    return mode
+
+
+def plan_postprocess(ydl, job, task_type, target, quality=None, ffprobe_path=None):
+    """
+    Chọn cách hậu xử lý 1 video đã tải (dùng làm prepare của pipeline.run_postprocess_batch):
+    video -> remux/transcode lúc ghép, audio -> copy/transcode lúc convert. Trả về mode.
+    """
+    info = job['info']
+    if task_type == 'audio':
+        return apply_audio_plan(ydl, info, job['filename'], target, quality, ffprobe_path)
+    if info.get('requested_formats'):
+        return apply_merge_plan(ydl, info, target, ffprobe_path)
+    return ''
@@ -0,0 +1,86 @@
+import os
+import json
+import redis
+from django.conf import settings
+from .redis_client import get_redis, key
+
+# --- CACHE KẾT QUẢ THEO NỘI DUNG ---
+# fingerprint (nội dung + tùy chọn) -> file đã tải xong trong media/downloads
+DOWNLOAD_DIR = os.path.join(settings.MEDIA_ROOT, 'downloads')
+
+
+def _entry_key(fingerprint):
+    return key('result', fingerprint)
+
+
+def _count(name):
+    try:
+        get_redis().incr(key('result', 'stats', name))
+    except redis.RedisError:
+        pass
+
+
+def lookup(fingerprint):
+    """
+    Tìm file đã tải cho fingerprint. Trả về tên file nếu file vẫn còn nguyên vẹn
+    (cùng size + mtime lúc lưu, tránh trường hợp task khác đã ghi đè), ngược lại None.
+    """
+    if not fingerprint:
+        return None
+    try:
+        raw = get_redis().get(_entry_key(fingerprint))
+    except redis.RedisError:
+        return None
+
+    entry = json.loads(raw) if raw else None
+    if entry:
+        filepath = os.path.join(DOWNLOAD_DIR, entry['filename'])
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            st = None
+        if st and st.st_size == entry['size'] and int(st.st_mtime) == entry['mtime']:
+            _count('hits')
+            # Gia hạn TTL vì link này vẫn đang được dùng
+            try:
+                get_redis().expire(_entry_key(fingerprint), settings.RESULT_CACHE_TTL)
+            except redis.RedisError:
+                pass
+            return entry['filename']
+        invalidate(fingerprint)
+
+    _count('misses')
+    return None
+
+
+def store(fingerprint, filename):
+    """Ghi nhận file vừa tải xong cho fingerprint"""
+    if not fingerprint or not filename:
+        return
+    try:
+        st = os.stat(os.path.join(DOWNLOAD_DIR, filename))
+    except OSError:
+        return
+    entry = {'filename': filename, 'size': st.st_size, 'mtime': int(st.st_mtime)}
+    try:
+        get_redis().set(_entry_key(fingerprint), json.dumps(entry), ex=settings.RESULT_CACHE_TTL)
+    except redis.RedisError:
+        pass
+
+
+def invalidate(fingerprint):
+    try:
+        get_redis().delete(_entry_key(fingerprint))
+    except redis.RedisError:
+        pass
+
+
+def stats():
+    """Bộ đếm hit/miss của cache kết quả"""
+    try:
+        hits, misses = get_redis().mget(key('result', 'stats', 'hits'), key('result', 'stats', 'misses'))
+    except redis.RedisError:
+        hits = misses = None
+    hits, misses = int(hits or 0), int(misses or 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 4) if total else 0.0}
@@ -0,0 +1,138 @@
+import os
+import uuid
+import glob
+import shutil
+import socket
+import threading
+import subprocess
+import redis
+from django.conf import settings
+from .redis_client import get_redis, key
+from . import site_policy
+
+# --- TẢI TIẾP (RESUME) KHI WORKER BỊ RESTART ---
+# Mỗi task có thư mục tạm riêng (media/downloads/.parts/<task_id>) chứa file .part,
+# file điều khiển .aria2 và các fragment .ytdl. Worker chết giữa chừng thì lần chạy
+# sau chỉ cần trỏ yt-dlp vào đúng thư mục này là tải tiếp được.
+DOWNLOAD_DIR = os.path.join(settings.MEDIA_ROOT, 'downloads')
+PARTS_DIR = os.path.join(DOWNLOAD_DIR, '.parts')
+
+
+def work_dir(task_id):
+    return os.path.join(PARTS_DIR, str(task_id))
+
+
+def purge(task_id):
+    """Xóa toàn bộ file tạm của task (tải xong hoặc phải tải lại từ đầu)"""
+    shutil.rmtree(work_dir(task_id), ignore_errors=True)
+
+
+def prepare_resume(task_id):
+    """
+    Chuẩn bị thư mục tạm trước khi tải. Trả về True nếu có dữ liệu cũ để tải tiếp.
+    File .part tải bằng HTTP thường (không có .aria2/.ytdl ghi lại phần đã xác nhận)
+    bị cắt bớt RESUME_ROLLBACK_BYTES ở cuối: đoạn ghi dở lúc worker bị kill là đoạn
+    dễ hỏng nhất, tải lại đoạn đó rẻ hơn nhiều so với file corrupt.
+    """
+    path = work_dir(task_id)
+    os.makedirs(path, exist_ok=True)
+    part_files = glob.glob(os.path.join(glob.escape(path), '*.part'))
+    for part in part_files:
+        if os.path.exists(part + '.aria2') or os.path.exists(part[:-len('.part')] + '.ytdl'):
+            continue
+        size = os.path.getsize(part)
+        os.truncate(part, max(size - settings.RESUME_ROLLBACK_BYTES, 0))
+    return bool(part_files) or bool(os.listdir(path))
+
+
+def verify_media(filepath, ffprobe_path):
+    """Kiểm tra file đầu ra đọc được (ffprobe không báo lỗi và có stream)"""
+    if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
+        return False
+    if not ffprobe_path:
+        return True
+    try:
+        result = subprocess.run(
+            [ffprobe_path, '-v', 'error', '-show_entries', 'stream=index', '-of', 'csv=p=0', filepath],
+            capture_output=True, text=True, timeout=120,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return True  # Không chạy được ffprobe thì không chặn kết quả
+    return result.returncode == 0 and bool(result.stdout.strip())
+
+
+# Chỉ gia hạn / xóa heartbeat nếu mình vẫn là chủ: stage sau (hoặc lượt tải lại) có thể đã giành key
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _heartbeat_key(task_id):
+    return key('running', task_id)
+
+
+def is_alive(task_id):
+    """Task có đang được worker nào chạy không (còn heartbeat)"""
+    try:
+        return bool(get_redis().exists(_heartbeat_key(task_id)))
+    except redis.RedisError:
+        return True  # Không chắc chắn thì coi như còn sống, tránh tải trùng
+
+
+class TaskHeartbeat:
+    """
+    Đánh dấu "task đang chạy ở worker này" trên Redis, gia hạn bằng thread nền
+    (kể cả lúc ffmpeg đang xử lý, không có progress hook nào được gọi).
+    Đồng thời gia hạn slot tải theo site của task.
+    """
+
+    def __init__(self, task_db):
+        self.task_db = task_db
+        # hostname:pid + hậu tố riêng: 2 lượt chạy cùng task trong 1 process (thread pool) không nhận nhầm key của nhau
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Trả về False nếu task đang được worker khác chạy (message bị giao lại)"""
+        try:
+            acquired = get_redis().set(
+                _heartbeat_key(self.task_db.id), self.owner, nx=True, ex=settings.HEARTBEAT_TTL
+            )
+        except redis.RedisError:
+            acquired = True
+        if not acquired:
+            return False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        interval = max(settings.HEARTBEAT_TTL / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                get_redis().eval(_RENEW_SCRIPT, 1, _heartbeat_key(self.task_db.id), self.owner, settings.HEARTBEAT_TTL)
+            except redis.RedisError:
+                pass
+            site_policy.renew(self.task_db)
+
+    def stop(self):
+        """Nhả heartbeat (gọi nhiều lần chỉ có tác dụng lần đầu, không xóa heartbeat của lượt chạy khác)"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        try:
+            get_redis().eval(_RELEASE_SCRIPT, 1, _heartbeat_key(self.task_db.id), self.owner)
+        except redis.RedisError:
+            pass
@@ -0,0 +1,165 @@
+import os
+import re
+import gzip
+import json
+import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django_celery_results.models import TaskResult
+from .models import DownloadTask, DownloadBatch, DailyTaskSummary
+from . import site_policy, singleflight
+
+# --- DỌN LỊCH SỬ TASK CŨ (DB KHÔNG PHÌNH MÃI) ---
+# Task đã kết thúc (FINISHED/FAILED) quá TASK_RETENTION_DAYS ngày bị xóa theo từng lô nhỏ
+# (mỗi lô 1 transaction ngắn, không giữ khóa ghi lâu), số liệu được cộng dồn vào
+# DailyTaskSummary trước khi xóa. Có TASK_ARCHIVE_DIR thì ghi bản sao JSONL (gzip) sau khi lô
+# đã commit (lô bị rollback thì không ghi -> chạy lại không sinh bản ghi trùng trong archive).
+# Sau đó dọn bảng kết quả Celery và VACUUM SQLite khi không có task nào đang chạy.
+TERMINAL_STATUSES = ('FINISHED', 'FAILED')
+# Số lý do lỗi khác nhau tối đa lưu cho 1 ngày, còn lại gộp vào 'other'
+MAX_FAILURE_REASONS = 20
+
+
+def failure_reason(error):
+    """
+    Rút gọn thông báo lỗi để gộp nhóm: bỏ tiền tố 'ERROR:' và id video của yt-dlp
+    ('[youtube] abc123: Video unavailable. ...' -> '[youtube] Video unavailable')
+    """
+    reason = re.sub(r'^ERROR:\s*', '', error or '').strip()
+    reason = re.sub(r'^\[([\w:]+)\]\s*[^\s:]+:\s*', r'[\1] ', reason)
+    reason = reason.split('. ')[0].split('\n')[0]
+    return reason[:80] or 'unknown'
+
+
+def _add_reason(reasons, reason, count=1):
+    if reason not in reasons and len(reasons) >= MAX_FAILURE_REASONS:
+        reason = 'other'
+    reasons[reason] = reasons.get(reason, 0) + count
+
+
+def _summarize(rows):
+    """Gộp các task theo ngày (giờ địa phương): {day: số liệu}"""
+    days = {}
+    for row in rows:
+        day = timezone.localtime(row['created_at']).date()
+        d = days.setdefault(day, {
+            'total': 0, 'finished': 0, 'failed': 0, 'followers': 0,
+            'bytes_downloaded': 0, 'postprocess_seconds': 0.0, 'sites': {}, 'failure_reasons': {},
+        })
+        d['total'] += 1
+        if row['status'] == 'FINISHED':
+            d['finished'] += 1
+        else:
+            d['failed'] += 1
+            _add_reason(d['failure_reasons'], failure_reason(row['error']))
+        if row['leader_id']:
+            d['followers'] += 1
+        d['bytes_downloaded'] += sum(p.get('bytes') or 0 for p in row['download_params'] or [])
+        d['postprocess_seconds'] += row['postprocess_seconds'] or 0.0
+        site = site_policy.site_for(row['url'])
+        d['sites'][site] = d['sites'].get(site, 0) + 1
+    return days
+
+
+def _merge_summary(day, data):
+    summary, _ = DailyTaskSummary.objects.select_for_update().get_or_create(day=day)
+    for field in ('total', 'finished', 'failed', 'followers', 'bytes_downloaded', 'postprocess_seconds'):
+        setattr(summary, field, getattr(summary, field) + data[field])
+    for site, count in data['sites'].items():
+        summary.sites[site] = summary.sites.get(site, 0) + count
+    for reason, count in data['failure_reasons'].items():
+        _add_reason(summary.failure_reasons, reason, count)
+    summary.save()
+
+
+def _archive(rows):
+    """Ghi bản sao các task vừa xóa (1 file gzip/ngày, mỗi lô là 1 member gzip nối tiếp)"""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(timezone.localtime(row['created_at']).date(), []).append(row)
+    os.makedirs(settings.TASK_ARCHIVE_DIR, exist_ok=True)
+    for day, day_rows in by_day.items():
+        path = os.path.join(settings.TASK_ARCHIVE_DIR, f"tasks-{day.isoformat()}.jsonl.gz")
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for row in day_rows:
+                f.write(json.dumps(row, default=str, ensure_ascii=False) + '\n')
+
+
+def compact_tasks(report):
+    cutoff = timezone.now() - datetime.timedelta(days=settings.TASK_RETENTION_DAYS)
+    fields = (
+        'id', 'url', 'status', 'created_at', 'task_type', 'filename', 'fingerprint', 'leader_id',
+        'download_params', 'postprocess_mode', 'postprocess_seconds', 'batch_id', 'error',
+    )
+    while True:
+        with transaction.atomic():
+            rows = list(
+                DownloadTask.objects.filter(status__in=TERMINAL_STATUSES, created_at__lt=cutoff)
+                .order_by('created_at').values(*fields)[:settings.COMPACTION_BATCH_SIZE]
+            )
+            if not rows:
+                break
+            for day, data in _summarize(rows).items():
+                _merge_summary(day, data)
+            # Follower của task bị xóa tự bỏ liên kết (leader SET_NULL)
+            DownloadTask.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        if settings.TASK_ARCHIVE_DIR:
+            _archive(rows)
+        report['tasks_deleted'] += len(rows)
+
+    # Batch cũ đã hết task con (hoặc bung playlist thất bại)
+    batches = DownloadBatch.objects.filter(created_at__lt=cutoff, tasks__isnull=True)
+    report['batches_deleted'] = batches.delete()[0]
+
+
+def compact_results(report):
+    """Kết quả Celery (django-db) chỉ để xem lại khi cần debug, giữ ngắn hơn task"""
+    cutoff = timezone.now() - datetime.timedelta(days=settings.CELERY_RESULT_RETENTION_DAYS)
+    while True:
+        ids = list(
+            TaskResult.objects.filter(date_done__lt=cutoff)
+            .values_list('id', flat=True)[:settings.COMPACTION_BATCH_SIZE]
+        )
+        if not ids:
+            return
+        report['results_deleted'] += TaskResult.objects.filter(id__in=ids).delete()[0]
+
+
+def vacuum(report):
+    """
+    SQLite: VACUUM (viết lại cả file, chặn người ghi trong lúc chạy) chỉ khi không có
+    task nào đang chạy và phần trang trống đủ lớn. Các trường hợp khác chỉ checkpoint WAL.
+    Postgres tự dọn bằng autovacuum.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        freelist = cursor.fetchone()[0]
+        report['free_pages_ratio'] = round(freelist / page_count, 3) if page_count else 0.0
+        # Task kẹt trạng thái chạy từ lâu (worker chết hẳn) không tính là đang chạy
+        busy = DownloadTask.objects.filter(
+            status__in=singleflight.ACTIVE_STATUSES, created_at__gte=timezone.now() - datetime.timedelta(days=1)
+        ).exists()
+        if report['free_pages_ratio'] >= settings.SQLITE_VACUUM_MIN_FREE_RATIO and not busy:
+            size_before = os.path.getsize(connection.settings_dict['NAME'])
+            cursor.execute('VACUUM')
+            report['vacuumed'] = True
+            report['bytes_reclaimed'] = size_before - os.path.getsize(connection.settings_dict['NAME'])
+        # Gộp WAL về file chính và cắt WAL về 0 (WAL không tự co lại)
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        cursor.execute('PRAGMA optimize')
+
+
+def compact():
+    report = {
+        'tasks_deleted': 0, 'batches_deleted': 0, 'results_deleted': 0,
+        'vacuumed': False, 'bytes_reclaimed': 0,
+    }
+    compact_tasks(report)
+    compact_results(report)
+    vacuum(report)
+    return report
@@ -0,0 +1,112 @@
+import uuid
+import datetime
+import redis
+from django.conf import settings
+from django.utils import timezone
+from .models import DownloadTask
+from .redis_client import get_redis, key
+from . import resume
+
+# --- LÀN ƯU TIÊN THEO CHI PHÍ ƯỚC TÍNH (JOB NGẮN KHÔNG PHẢI CHỜ PHIM 4K) ---
+# Mỗi task được ước tính chi phí (giây worker: tải + hậu xử lý) từ thời lượng, dung lượng format
+# đã chọn, loại tải và độ phân giải, rồi gửi vào Celery với priority của làn tương ứng
+# (settings.PRIORITY_LANES). Broker Redis tách mỗi queue thành các list theo priority, worker
+# luôn lấy list priority nhỏ trước. Job chờ lâu được đẩy lại với priority cao hơn (aging),
+# message cũ bị bỏ qua nhờ "dispatch id" lưu trên Redis.
+
+# Bitrate danh nghĩa (kbps) khi chưa biết dung lượng format: theo độ phân giải, audio riêng
+NOMINAL_KBPS = {'2160': 20000, '1440': 10000, '1080': 5000, '720': 2500, '480': 1200, '360': 700}
+AUDIO_KBPS = 160
+# Không đọc được thời lượng (probe lỗi/tắt): coi như video 10 phút
+DEFAULT_DURATION = 600
+# Giây hậu xử lý cho mỗi giây media: encode audio (mp3/flac...) / ghép video (copy stream)
+POSTPROCESS_FACTOR = {'audio': 0.02, 'video': 0.005}
+
+
+def _format_bytes(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return fmt['tbr'] * 1000 / 8 * duration
+    return 0
+
+
+def estimate_cost(task_db, info=None):
+    """
+    Chi phí ước tính (giây) của 1 task. info: kết quả extract (đã chọn format thì chính xác hơn),
+    entry "phẳng" của playlist (chỉ có thời lượng) hoặc None (ước tính theo tùy chọn).
+    """
+    info = info or {}
+    duration = info.get('duration') or DEFAULT_DURATION
+    formats = info.get('requested_formats') or ([info] if info.get('format_id') else [])
+    size = sum(_format_bytes(f, duration) for f in formats)
+    if not size:
+        kbps = AUDIO_KBPS if task_db.task_type == 'audio' else NOMINAL_KBPS.get(task_db.resolution, 5000) + AUDIO_KBPS
+        size = kbps * 1000 / 8 * duration
+    postprocess = duration * POSTPROCESS_FACTOR.get(task_db.task_type, POSTPROCESS_FACTOR['video'])
+    return round(size / settings.PRIORITY_ASSUMED_BPS + postprocess, 1)
+
+
+def lane_for(cost):
+    """(tên làn, priority Celery) theo chi phí ước tính"""
+    for name, max_cost, priority in settings.PRIORITY_LANES:
+        if max_cost is None or cost <= max_cost:
+            return name, priority
+    name, _, priority = settings.PRIORITY_LANES[-1]
+    return name, priority
+
+
+def priority_for(task_db, now=None):
+    """Priority của làn, cứ chờ thêm PRIORITY_AGING_SECONDS giây thì lên 1 bậc (nhỏ hơn = sớm hơn)"""
+    _, priority = lane_for(task_db.estimated_cost or 0)
+    if task_db.created_at and settings.PRIORITY_AGING_SECONDS:
+        waited = ((now or timezone.now()) - task_db.created_at).total_seconds()
+        priority -= int(max(waited, 0) // settings.PRIORITY_AGING_SECONDS)
+    return max(priority, 0)
+
+
+def broker_keys(queue):
+    """Các list Redis của 1 queue Celery (mỗi priority 1 list, priority 0 là chính tên queue)"""
+    options = settings.CELERY_BROKER_TRANSPORT_OPTIONS
+    sep = options.get('sep', '\x06\x16')
+    return [queue] + [f"{queue}{sep}{p}" for p in options.get('priority_steps', ()) if p]
+
+
+# --- DISPATCH ID: CHỈ MESSAGE GỬI SAU CÙNG CỦA TASK ĐƯỢC CHẠY ---
+def _dispatch_key(task_id):
+    return key('dispatch', task_id)
+
+
+def new_dispatch(task_id):
+    """Sinh id message Celery mới cho task và ghi nhận đó là message hợp lệ duy nhất"""
+    dispatch_id = str(uuid.uuid4())
+    try:
+        get_redis().set(
+            _dispatch_key(task_id), dispatch_id,
+            ex=settings.CELERY_BROKER_TRANSPORT_OPTIONS['visibility_timeout'],
+        )
+    except redis.RedisError:
+        pass
+    return dispatch_id
+
+
+def is_current(task_id, dispatch_id):
+    """Message này có phải message gửi sau cùng của task không (không biết thì coi như phải)"""
+    try:
+        current = get_redis().get(_dispatch_key(task_id))
+    except redis.RedisError:
+        return True
+    return current is None or current == dispatch_id
+
+
+def aged_tasks(now=None):
+    """Task đang chờ trong queue tải đã đủ lâu để lên làn cao hơn priority lúc được gửi đi"""
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(seconds=settings.PRIORITY_AGING_SECONDS)
+    candidates = DownloadTask.objects.filter(
+        status='PENDING', leader__isnull=True, priority__gt=0, created_at__lt=cutoff,
+    )
+    for task_db in candidates.iterator():
+        if priority_for(task_db, now) < task_db.priority and not resume.is_alive(task_db.id):
+            yield task_db
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
+import yt_dlp
+
+# --- DÙNG LẠI YOUTUBEDL GIỮA CÁC TASK CỦA 1 WORKER (KHÔNG PHỤ THUỘC DJANGO) ---
+# Tạo 1 YoutubeDL tốn ~70-100ms (nạp ~1800 extractor), chưa kể parse cookies.txt, khởi tạo
+# extractor (YouTube tải player JS) và bắt tay TLS mới. Với job ngắn đó là phần lớn độ trễ.
+# Pool giữ các instance đã "ấm" theo từng profile tùy chọn (opts giống nhau trừ phần riêng của
+# task), mỗi instance chỉ được 1 task dùng tại 1 thời điểm. Instance giữ nguyên pool kết nối
+# HTTP, cookie jar trong RAM (nạp lại khi cookies.txt đổi) và các extractor đã khởi tạo.
+
+# Tùy chọn riêng của từng task: không tính vào profile, gán lại mỗi lần lấy instance ra
+TASK_PARAMS = ('paths', 'progress_hooks')
+# Extractor nạp sẵn khi worker khởi động (import module thật thay cho lazy extractor)
+WARM_EXTRACTORS = ('Youtube', 'YoutubeTab', 'TikTok', 'Facebook', 'Instagram', 'Generic')
+
+
+class CookieFile:
+    """cookies.txt: kiểm tra tồn tại/thay đổi tối đa 1 lần mỗi check_interval giây (không stat mỗi task)"""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._checked = 0.0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        """(mtime_ns, size) của file, None nếu không có"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked >= self.check_interval:
+                try:
+                    st = os.stat(self.path)
+                    self._version = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    self._version = None
+                self._checked = now
+            return self._version
+
+    def existing(self):
+        """Đường dẫn file nếu có (dùng cho opts 'cookiefile'), không thì None"""
+        return self.path if self.version() else None
+
+
+class _Entry:
+    def __init__(self, key):
+        self.key = key
+        self.ydl = None
+        self.base_params = None
+        self.hooks = []
+        self.cookies = None
+        self.uses = 0
+        self.created = time.monotonic()
+
+    def dispatch(self, d):
+        for hook in self.hooks:
+            hook(d)
+
+
+def _profile_key(cls, opts, kwargs):
+    stable = {k: v for k, v in opts.items() if k not in TASK_PARAMS}
+    raw = json.dumps([cls.__module__, cls.__qualname__, stable, kwargs], sort_keys=True, default=repr)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _copy_params(value):
+    # postprocessor_args, external_downloader... bị sửa theo từng task (core/remux.py, adaptive_dl), kể cả
+    # list lồng bên trong -> copy mọi tầng dict/list. Không deepcopy (trong params có hook/logger không copy được)
+    if isinstance(value, dict):
+        return {k: _copy_params(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_params(v) for v in value]
+    return value
+
+
+class SessionPool:
+    """
+    with pool.session(FetchOnlyYoutubeDL, opts, tuner=...) as ydl: ...
+    Class có method reset() (VD: FetchOnlyYoutubeDL) được gọi trước mỗi task để xóa trạng thái riêng.
+    Task lỗi (exception) thì instance bị đóng, không trả về pool.
+    """
+
+    def __init__(self, cookies=None, max_idle=8, max_uses=200, max_age=3600, max_profiles=32, enabled=True):
+        self.cookies = cookies
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.max_profiles = max_profiles
+        self.enabled = enabled
+        self._idle = OrderedDict()  # profile -> [entry], profile dùng gần nhất ở cuối
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'closed': 0, 'cookie_reloads': 0}
+
+    @contextlib.contextmanager
+    def session(self, cls, opts, **kwargs):
+        if not self.enabled:
+            self.stats['created'] += 1
+            with cls(opts, **kwargs) as ydl:
+                yield ydl
+            return
+        entry = self._checkout(cls, opts, kwargs)
+        ok = False
+        try:
+            yield entry.ydl
+            ok = True
+        finally:
+            self._checkin(entry, ok)
+
+    # --- LẤY / TRẢ INSTANCE ---
+    def _checkout(self, cls, opts, kwargs):
+        key = _profile_key(cls, opts, kwargs)
+        with self._lock:
+            idle = self._idle.get(key)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            entry = self._create(key, cls, opts, kwargs)
+        else:
+            self.stats['reused'] += 1
+            entry.ydl.params.clear()
+            entry.ydl.params.update(_copy_params(entry.base_params))
+            self._refresh_cookies(entry)
+        for name in TASK_PARAMS:
+            if name != 'progress_hooks' and name in opts:
+                entry.ydl.params[name] = opts[name]
+        entry.hooks = list(opts.get('progress_hooks') or [])
+        reset = getattr(entry.ydl, 'reset', None)
+        if reset:
+            reset()
+        return entry
+
+    def _create(self, key, cls, opts, kwargs):
+        entry = _Entry(key)
+        # Hook cố định lúc tạo, chuyển tiếp tới hook của task đang dùng instance
+        params = {**opts, 'progress_hooks': [entry.dispatch]}
+        entry.ydl = cls(params, **kwargs)
+        entry.base_params = _copy_params(entry.ydl.params)
+        entry.cookies = self.cookies.version() if self.cookies else None
+        self.stats['created'] += 1
+        return entry
+
+    def _checkin(self, entry, ok):
+        entry.uses += 1
+        entry.hooks = []
+        expired = entry.uses >= self.max_uses or time.monotonic() - entry.created > self.max_age
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(entry.key, [])
+            self._idle.move_to_end(entry.key)
+            if ok and not expired and len(idle) < self.max_idle:
+                idle.append(entry)
+                entry = None
+            while len(self._idle) > self.max_profiles:
+                evicted.extend(self._idle.popitem(last=False)[1])
+        for stale in ([entry] if entry else []) + evicted:
+            self._close(stale)
+
+    def _refresh_cookies(self, entry):
+        """cookies.txt đổi (thay cookie mới) -> nạp lại cookie jar của instance"""
+        if not self.cookies or not entry.ydl.params.get('cookiefile'):
+            return
+        version = self.cookies.version()
+        if version == entry.cookies:
+            return
+        jar = entry.ydl.cookiejar
+        jar.clear()
+        if version:
+            try:
+                jar.load()
+            except Exception as e:
+                print(f"⚠️ COOKIES: nạp lại lỗi: {e}")
+        entry.cookies = version
+        self.stats['cookie_reloads'] += 1
+
+    def _close(self, entry):
+        # Không ghi đè cookies.txt khi đóng (file do người vận hành quản lý, nhiều luồng cùng dùng)
+        entry.ydl.params['cookiefile'] = None
+        try:
+            entry.ydl.close()
+        except Exception:
+            pass
+        self.stats['closed'] += 1
+
+    def close(self):
+        with self._lock:
+            entries = [e for idle in self._idle.values() for e in idle]
+            self._idle.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def warm(self, ie_keys=WARM_EXTRACTORS):
+        """Worker vừa khởi động: nạp sẵn danh sách extractor + module thật của các site hay dùng"""
+        started = time.monotonic()
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            for ie_key in ie_keys:
+                try:
+                    ydl.get_info_extractor(ie_key)
+                except Exception:
+                    pass
+        print(f"🔥 YT-DLP WARMED: {len(ie_keys)} extractor, {time.monotonic() - started:.2f}s")
@@ -0,0 +1,351 @@
+import os
+import re
+import inspect
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from yt_dlp import YoutubeDL
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError
+from yt_dlp.utils import (
+    DownloadError, determine_ext, determine_protocol, network_exceptions, replace_extension, subtitles_filename,
+)
+
+# --- THUMBNAIL / PHỤ ĐỀ: TẢI SONG SONG VỚI FILE CHÍNH + CACHE THEO ID VIDEO (KHÔNG PHỤ THUỘC DJANGO) ---
+# yt-dlp tải thumbnail rồi lần lượt từng ngôn ngữ phụ đề xong mới bắt đầu tải media. Ở đây các
+# file phụ (sidecar) được đẩy sang thread riêng, chạy cùng lúc với phần tải media và chỉ được chờ
+# lại ngay trước bước hậu xử lý. File đã tải được giữ trong cache theo <extractor>-<id video>:
+# tải lại cùng video (chất lượng/định dạng khác) thì lấy luôn từ cache, không gọi mạng.
+
+# Phụ đề dạng HLS/DASH (ít gặp) phải đi qua downloader của yt-dlp -> giữ cách tải tuần tự cũ
+DIRECT_PROTOCOLS = ('http', 'https')
+
+# Hàm nội bộ của YoutubeDL bị ParallelSidecarsMixin override (không phải API công khai, có thể đổi
+# giữa các bản yt-dlp): chữ ký lệch thì bỏ override, dùng lại hàm gốc (tải tuần tự, không cache)
+STOCK_SIGNATURES = {
+    'process_subtitles': ['self', 'video_id', 'normal_subtitles', 'automatic_captions'],
+    '_write_subtitles': ['self', 'info_dict', 'filename'],
+    '_write_thumbnails': ['self', 'label', 'info_dict', 'filename', 'thumb_filename_base'],
+    'process_info': ['self', 'info_dict'],
+}
+
+
+def _cache_dirname(info):
+    video_id = info.get('id')
+    if not video_id:
+        return None
+    return re.sub(r'[^\w.-]', '_', f"{info.get('extractor_key') or info.get('extractor') or 'generic'}-{video_id}")
+
+
+class SidecarCache:
+    """
+    <root>/<extractor>-<id>/thumb.<ext> | sub.<lang>.<ext>. File cũ hơn max_age giây coi như không có.
+    on_store(path) / on_hit(path): báo cho index dung lượng (web: core/storage.py).
+    """
+
+    def __init__(self, root, max_age=None, on_store=None, on_hit=None):
+        self.root = root
+        self.max_age = max_age
+        self.on_store = on_store
+        self.on_hit = on_hit
+
+    def _fresh(self, path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        return not self.max_age or time.time() - mtime < self.max_age
+
+    def find(self, info, prefix):
+        """File trong cache của video có tên bắt đầu bằng prefix (VD: 'thumb.', 'sub.vi.srt'), None nếu không có"""
+        dirname = _cache_dirname(info)
+        if not dirname:
+            return None
+        try:
+            names = sorted(os.listdir(os.path.join(self.root, dirname)))
+        except OSError:
+            return None
+        for name in names:
+            path = os.path.join(self.root, dirname, name)
+            if name.startswith(prefix) and self._fresh(path):
+                if self.on_hit:
+                    self.on_hit(path)
+                return path
+        return None
+
+    def store(self, info, name, src):
+        """Chép file vừa tải vào cache (ghi ra file tạm rồi rename: nhiều worker ghi cùng lúc vẫn an toàn)"""
+        dirname = _cache_dirname(info)
+        if not dirname:
+            return
+        path = os.path.join(self.root, dirname, name)
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ SIDECAR CACHE: không ghi được {name}: {e}")
+            return
+        if self.on_store:
+            self.on_store(path)
+
+    def prune(self):
+        """Xóa file quá max_age và thư mục rỗng (CLI gọi lúc khởi động; web để core/storage.py dọn)"""
+        if not self.max_age or not os.path.isdir(self.root):
+            return
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            for name in os.listdir(entry.path):
+                path = os.path.join(entry.path, name)
+                if not self._fresh(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            try:
+                os.rmdir(entry.path)
+            except OSError:
+                pass
+
+
+def _fetch(ydl, url, headers, filename):
+    with ydl.urlopen(Request(url, headers=headers or {})) as resp, open(filename, 'wb') as f:
+        shutil.copyfileobj(resp, f)
+
+
+class ParallelSidecarsMixin:
+    """
+    Đặt trước YoutubeDL trong MRO (VD: FetchOnlyYoutubeDL). sidecar_workers=0 -> tải tuần tự như yt-dlp gốc.
+    Ai override post_process() mà không gọi super (FetchOnlyYoutubeDL) phải tự gọi finish_sidecars() trước.
+    Số lần lấy từ cache/tải mới của task hiện tại nằm ở self.sidecar_stats.
+    """
+
+    def __init__(self, *args, sidecar_cache=None, sidecar_workers=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sidecar_cache = sidecar_cache
+        self.sidecar_workers = sidecar_workers
+        self.sidecar_stats = {'hit': 0, 'miss': 0}
+        self._sidecar_executor = None
+        self._sidecar_jobs = []
+
+    def reset(self):
+        super().reset()
+        self._drain_sidecars()
+        self.sidecar_stats = {'hit': 0, 'miss': 0}
+
+    def close(self):
+        self._drain_sidecars()
+        if self._sidecar_executor:
+            self._sidecar_executor.shutdown(wait=True)
+            self._sidecar_executor = None
+        super().close()
+
+    def _parallel(self):
+        return self.sidecar_workers > 0 and not self.params.get('skip_download')
+
+    def _submit(self, kind, fn, *args, **job):
+        if self._sidecar_executor is None:
+            self._sidecar_executor = ThreadPoolExecutor(
+                max_workers=self.sidecar_workers, thread_name_prefix='sidecar')
+        job.update(kind=kind, future=self._sidecar_executor.submit(fn, *args))
+        self._sidecar_jobs.append(job)
+        self.sidecar_stats['miss'] += 1
+
+    def _restore(self, cached, filename):
+        """Chép file từ cache vào thư mục tạm của task (cache vừa bị dọn thì tải như thường)"""
+        try:
+            shutil.copyfile(cached, filename)
+        except OSError:
+            return False
+        self.sidecar_stats['hit'] += 1
+        return True
+
+    # --- CHỌN NGÔN NGỮ PHỤ ĐỀ ---
+    def process_subtitles(self, video_id, normal_subtitles, automatic_captions):
+        """
+        Ngôn ngữ không có đúng mã thì lấy biến thể đầu tiên cùng gốc ('en' -> 'en-US'),
+        trùng nhau thì chỉ tải 1 lần (không cần liệt kê cả 'en' lẫn 'en-US' hay dùng 'all').
+        """
+        langs = self.params.get('subtitleslangs')
+        available = list(normal_subtitles or {})
+        if self.params.get('writeautomaticsub'):
+            available += list(automatic_captions or {})
+        if not langs or not available:
+            return super().process_subtitles(video_id, normal_subtitles, automatic_captions)
+        resolved = []
+        for lang in langs:
+            if lang not in available and re.fullmatch(r'[\w-]+', lang):
+                lang = next((a for a in available if a.startswith(f'{lang}-')), lang)
+            if lang not in resolved:
+                resolved.append(lang)
+        self.params['subtitleslangs'] = resolved
+        try:
+            return super().process_subtitles(video_id, normal_subtitles, automatic_captions)
+        finally:
+            self.params['subtitleslangs'] = langs
+
+    # --- GHI FILE PHỤ: TRẢ VỀ NGAY, TẢI Ở THREAD RIÊNG ---
+    def _write_subtitles(self, info_dict, filename):
+        subtitles = info_dict.get('requested_subtitles')
+        sub_filename_base = self.prepare_filename(info_dict, 'subtitle')
+        if not (self._parallel() and subtitles and sub_filename_base) or not (
+                self.params.get('writesubtitles') or self.params.get('writeautomaticsub')) or any(
+                s.get('data') is None and determine_protocol(s) not in DIRECT_PROTOCOLS for s in subtitles.values()):
+            return super()._write_subtitles(info_dict, filename)
+
+        ret = []
+        for sub_lang, sub_info in subtitles.items():
+            sub_format = sub_info['ext']
+            sub_filename = subtitles_filename(filename, sub_lang, sub_format, info_dict.get('ext'))
+            sub_filename_final = subtitles_filename(sub_filename_base, sub_lang, sub_format, info_dict.get('ext'))
+            existing_sub = self.existing_file((sub_filename_final, sub_filename))
+            if existing_sub:
+                sub_info['filepath'] = existing_sub
+                ret.append((existing_sub, sub_filename_final))
+                continue
+            if sub_info.get('data') is not None:
+                with open(sub_filename, 'w', encoding='utf-8', newline='') as subfile:
+                    subfile.write(sub_info['data'])
+                sub_info['filepath'] = sub_filename
+                ret.append((sub_filename, sub_filename_final))
+                continue
+
+            name = f'sub.{sub_lang}.{sub_format}'
+            cached = self.sidecar_cache and self.sidecar_cache.find(info_dict, name)
+            if cached and self._restore(cached, sub_filename):
+                self.to_screen(f'[info] Video subtitle {sub_lang}.{sub_format} restored from cache')
+                sub_info['filepath'] = sub_filename
+                ret.append((sub_filename, sub_filename_final))
+                continue
+            self.to_screen(f'[info] Writing video subtitles to: {sub_filename} (in background)')
+            headers = sub_info.get('http_headers') or info_dict.get('http_headers')
+            self._submit(
+                'subtitle', self._fetch_sidecar, info_dict, name, sub_info['url'], headers, sub_filename,
+                lang=sub_lang, filename=sub_filename, final=sub_filename_final,
+            )
+        return ret
+
+    def _write_thumbnails(self, label, info_dict, filename, thumb_filename_base=None):
+        thumbnails = info_dict.get('thumbnails')
+        if label != 'video' or not (self._parallel() and thumbnails and thumb_filename_base) \
+                or not self.params.get('writethumbnail') or self.params.get('write_all_thumbnails'):
+            return super()._write_thumbnails(label, info_dict, filename, thumb_filename_base)
+
+        # Ảnh tốt nhất ở cuối list, lỗi thì thử ảnh kế tiếp (giống yt-dlp)
+        candidates = []
+        for idx, t in list(enumerate(thumbnails))[::-1]:
+            thumb_ext = t.get('ext') or determine_ext(t['url'], 'jpg')
+            thumb_filename = replace_extension(filename, thumb_ext, info_dict.get('ext'))
+            thumb_filename_final = replace_extension(thumb_filename_base, thumb_ext, info_dict.get('ext'))
+            existing_thumb = self.existing_file((thumb_filename_final, thumb_filename))
+            if existing_thumb:
+                t['filepath'] = existing_thumb
+                return [(existing_thumb, thumb_filename_final)]
+            candidates.append((idx, thumb_ext, t['url'], t.get('http_headers'), thumb_filename, thumb_filename_final))
+
+        cached = self.sidecar_cache and self.sidecar_cache.find(info_dict, 'thumb.')
+        thumb_ext = cached and os.path.basename(cached)[len('thumb.'):]
+        thumb_filename = cached and replace_extension(filename, thumb_ext, info_dict.get('ext'))
+        if cached and self._restore(cached, thumb_filename):
+            self.to_screen('[info] Video thumbnail restored from cache')
+            thumbnails[-1]['filepath'] = thumb_filename
+            return [(thumb_filename, replace_extension(thumb_filename_base, thumb_ext, info_dict.get('ext')))]
+
+        self.to_screen('[info] Downloading video thumbnail ... (in background)')
+        self._submit('thumbnail', self._fetch_thumbnail, info_dict, candidates)
+        return []
+
+    # --- CHẠY Ở THREAD RIÊNG (không đụng tới info_dict, chỉ trả kết quả) ---
+    def _fetch_sidecar(self, info_dict, name, url, headers, filename):
+        """Trả về None nếu xong, không thì exception gặp phải"""
+        try:
+            _fetch(self, url, headers, filename)
+        except (OSError, ValueError, *network_exceptions) as err:
+            return err
+        if self.sidecar_cache:
+            self.sidecar_cache.store(info_dict, name, filename)
+        return None
+
+    def _fetch_thumbnail(self, info_dict, candidates):
+        """Trả về (ứng viên tải được hoặc None, [(idx, lỗi)] các ảnh hỏng)"""
+        failed = []
+        for candidate in candidates:
+            idx, thumb_ext, url, headers, thumb_filename, _ = candidate
+            error = self._fetch_sidecar(info_dict, f'thumb.{thumb_ext}', url, headers, thumb_filename)
+            if error is None:
+                return candidate, failed
+            failed.append((idx, error))
+        return None, failed
+
+    # --- CHỜ FILE PHỤ TRƯỚC HẬU XỬ LÝ ---
+    def finish_sidecars(self, info, files_to_move=None):
+        """Chờ các file phụ đang tải, ghi filepath vào info + files_to_move. Trả về files_to_move"""
+        files_to_move = {} if files_to_move is None else files_to_move
+        jobs, self._sidecar_jobs = self._sidecar_jobs, []
+        for job in jobs:
+            if job['kind'] == 'subtitle':
+                error = job['future'].result()
+                subtitles = info.get('requested_subtitles') or {}
+                if error is None:
+                    if job['lang'] in subtitles:
+                        subtitles[job['lang']]['filepath'] = job['filename']
+                    files_to_move[job['filename']] = job['final']
+                    continue
+                subtitles.pop(job['lang'], None)
+                msg = f"Unable to download video subtitles for {job['lang']!r}: {error}"
+                if self.params.get('ignoreerrors') is not True:
+                    if not self.params.get('ignoreerrors'):
+                        self.report_error(msg)
+                    raise DownloadError(msg)
+                self.report_warning(msg)
+            else:
+                found, failed = job['future'].result()
+                thumbnails = info.get('thumbnails') or []
+                for idx, error in failed:
+                    if not (isinstance(error, HTTPError) and error.status == 404):
+                        self.report_warning(f'Unable to download video thumbnail: {error}')
+                for idx, _ in sorted(failed, reverse=True):
+                    if idx < len(thumbnails):
+                        thumbnails.pop(idx)
+                if found:
+                    thumbnails[-1]['filepath'] = found[4]
+                    files_to_move[found[4]] = found[5]
+        return files_to_move
+
+    def _drain_sidecars(self):
+        """Video lỗi giữa chừng (không tới bước hậu xử lý): chờ nốt thread, bỏ kết quả"""
+        jobs, self._sidecar_jobs = self._sidecar_jobs, []
+        for job in jobs:
+            try:
+                job['future'].result()
+            except Exception:
+                pass
+
+    def process_info(self, info_dict):
+        try:
+            return super().process_info(info_dict)
+        finally:
+            self._drain_sidecars()
+
+
+def _incompatible_overrides(base=YoutubeDL):
+    """Tên các hàm trong STOCK_SIGNATURES mà base không có hoặc có chữ ký khác"""
+    bad = []
+    for name, params in STOCK_SIGNATURES.items():
+        try:
+            actual = list(inspect.signature(getattr(base, name)).parameters)
+        except (AttributeError, TypeError, ValueError):
+            actual = None
+        if actual != params:
+            bad.append(name)
+    return bad
+
+
+INCOMPATIBLE = _incompatible_overrides()
+if INCOMPATIBLE:
+    print(f"⚠️ SIDECARS: yt-dlp đã đổi {', '.join(INCOMPATIBLE)} -> tải thumbnail/phụ đề tuần tự như yt-dlp gốc")
+    for _name in STOCK_SIGNATURES:
+        delattr(ParallelSidecarsMixin, _name)
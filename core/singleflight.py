@@ -0,0 +1,70 @@
+import redis
+from .models import DownloadTask
+from .redis_client import get_redis, key
+
+# --- SINGLE-FLIGHT: GỘP CÁC YÊU CẦU TRÙNG ĐANG CHẠY ---
+# Mỗi fingerprint chỉ có 1 task "leader" được tải thật, giữ bằng lease trên Redis
+# (SET NX) nên có hiệu lực giữa nhiều worker/host. Các task trùng đến sau
+# trở thành "follower" và đọc tiến trình/kết quả của leader.
+# Lease không có TTL: sống đúng bằng vòng đời của leader (kể cả lúc chờ lâu trong queue),
+# được nhả khi leader FINISHED/FAILED. Lease trỏ tới task đã kết thúc/bị xóa thì bị giành lại.
+
+ACTIVE_STATUSES = ('PENDING', 'DOWNLOADING', 'DOWNLOADED', 'PROCESSING')
+
+# Chỉ nhả lease nếu mình vẫn là chủ (tránh xóa nhầm lease của task khác)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _lease_key(fingerprint):
+    return key('inflight', fingerprint)
+
+
+def acquire(fingerprint, task_id):
+    """Thử giành lease. Trả về id của task đang giữ lease (chính mình nếu thành công)"""
+    task_id = str(task_id)
+    r = get_redis()
+    lease = _lease_key(fingerprint)
+    if r.set(lease, task_id, nx=True):
+        return task_id
+    return r.get(lease) or task_id
+
+
+def release(fingerprint, task_id):
+    if not fingerprint:
+        return
+    try:
+        get_redis().eval(_RELEASE_SCRIPT, 1, _lease_key(fingerprint), str(task_id))
+    except redis.RedisError:
+        pass
+
+
+def join(task):
+    """
+    Gắn task vào job đang chạy có cùng fingerprint.
+    Trả về task leader nếu đã có job khác đang chạy, None nếu task này phải tự tải.
+    """
+    if not task.fingerprint:
+        return None
+    try:
+        leader_id = acquire(task.fingerprint, task.id)
+        if leader_id == str(task.id):
+            return None
+
+        leader = DownloadTask.objects.filter(id=leader_id, status__in=ACTIVE_STATUSES).first()
+        if leader:
+            return leader
+
+        # Leader đã kết thúc/bị xóa mà lease còn (VD: Redis lỗi đúng lúc nhả) -> giành lại lease
+        release(task.fingerprint, leader_id)
+        leader_id = acquire(task.fingerprint, task.id)
+        if leader_id == str(task.id):
+            return None
+        return DownloadTask.objects.filter(id=leader_id, status__in=ACTIVE_STATUSES).first()
+    except redis.RedisError:
+        # Redis lỗi -> không gộp được, cứ tải như bình thường
+        return None
@@ -0,0 +1,117 @@
+import time
+import random
+from urllib.parse import urlparse
+import redis
+from django.conf import settings
+from .redis_client import get_redis, key
+
+# --- CHÍNH SÁCH THEO TỪNG SITE: QUEUE RIÊNG + GIỚI HẠN SONG SONG + TOKEN BUCKET ---
+# Bảng chính sách nằm ở settings.SITE_POLICIES. Mỗi site có queue tải riêng nên một đợt
+# link Instagram bị chặn không làm kẹt các job YouTube phía sau. Giới hạn song song và
+# tốc độ được đếm trên Redis nên có hiệu lực chung cho mọi worker/host.
+
+# Semaphore: sorted set member = task_id, score = thời điểm slot hết hạn (worker chết thì tự nhả)
+_ACQUIRE_SLOT_SCRIPT = """
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[1])
+if redis.call('zscore', KEYS[1], ARGV[3]) or redis.call('zcard', KEYS[1]) < tonumber(ARGV[4]) then
+    redis.call('zadd', KEYS[1], ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Token bucket: trả về số giây phải chờ (0 nếu lấy được token)
+_TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('hset', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+def site_for(url):
+    """Tên site trong bảng chính sách theo hostname của link ('default' nếu không khớp)"""
+    host = (urlparse(url).hostname or '').lower()
+    for name, policy in settings.SITE_POLICIES.items():
+        for domain in policy.get('domains', ()):
+            if host == domain or host.endswith('.' + domain):
+                return name
+    return 'default'
+
+
+def policy_for(url):
+    """Chính sách của site (các khóa không khai báo lấy từ 'default')"""
+    site = site_for(url)
+    return {**settings.SITE_POLICIES['default'], **settings.SITE_POLICIES[site], 'site': site}
+
+
+def queue_for(url):
+    site = site_for(url)
+    return 'fetch' if site == 'default' else f'fetch.{site}'
+
+
+def fetch_queues():
+    """Tên mọi queue tải (để đo độ dài hàng đợi)"""
+    return ['fetch'] + [f'fetch.{site}' for site in settings.SITE_POLICIES if site != 'default']
+
+
+def _slots_key(site):
+    return key('slots', site)
+
+
+def admit(task_db):
+    """
+    Xin 1 slot tải + 1 token của site. Trả về 0 nếu được tải ngay,
+    ngược lại là số giây nên chờ trước khi thử lại.
+    """
+    policy = policy_for(task_db.url)
+    slots = _slots_key(policy['site'])
+    now = time.time()
+    try:
+        r = get_redis()
+        got_slot = r.eval(
+            _ACQUIRE_SLOT_SCRIPT, 1, slots,
+            now, now + settings.HEARTBEAT_TTL, str(task_db.id), policy['concurrency'],
+        )
+        if not got_slot:
+            return settings.SITE_THROTTLE_RETRY + random.uniform(0, settings.SITE_THROTTLE_RETRY)
+
+        wait = float(r.eval(
+            _TAKE_TOKEN_SCRIPT, 1, key('bucket', policy['site']), policy['rate'], policy['burst'], now,
+        ))
+        if wait > 0:
+            r.zrem(slots, str(task_db.id))
+            return max(wait, 1) + random.uniform(0, 1)
+    except redis.RedisError:
+        # Redis lỗi -> không giới hạn được, cứ cho tải
+        return 0
+    return 0
+
+
+def renew(task_db):
+    """Gia hạn slot (chỉ khi task đang giữ slot), gọi từ thread heartbeat"""
+    try:
+        get_redis().zadd(
+            _slots_key(site_for(task_db.url)), {str(task_db.id): time.time() + settings.HEARTBEAT_TTL}, xx=True
+        )
+    except redis.RedisError:
+        pass
+
+
+def release(task_db):
+    try:
+        get_redis().zrem(_slots_key(site_for(task_db.url)), str(task_db.id))
+    except redis.RedisError:
+        pass
@@ -0,0 +1,407 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import redis
+from django.conf import settings
+from .redis_client import get_redis, key
+from . import resume
+
+# --- QUẢN LÝ DUNG LƯỢNG ĐĨA: NGÂN SÁCH + WATERMARK + XÓA THEO LẦN DÙNG CUỐI (LRU) ---
+# Mọi file trong media/downloads (và thư mục tải dở .parts/<task_id>) được ghi vào 1 index
+# trên Redis: dung lượng + thời điểm dùng cuối. Tổng dung lượng là 1 bộ đếm -> kiểm tra
+# watermark không cần quét thư mục. Vượt high watermark thì xóa file lâu không dùng nhất
+# tới khi xuống low watermark; file đang được gửi cho client (pin) không bị xóa.
+# Thỉnh thoảng index được đối chiếu lại với đĩa để tính cả file không đi qua register().
+DOWNLOAD_DIR = os.path.join(settings.MEDIA_ROOT, 'downloads')
+# Tên trong index của thư mục tải dở: '.parts/<task_id>'
+PARTS_PREFIX = '.parts/'
+# Cache thumbnail/phụ đề theo video (core/sidecars.py): mỗi file 1 mục '.sidecars/<extractor>-<id>/<file>'
+SIDECARS_PREFIX = '.sidecars/'
+SIDECARS_DIR = os.path.join(DOWNLOAD_DIR, '.sidecars')
+
+# Cập nhật dung lượng 1 mục + bộ đếm tổng trong 1 lệnh (nhiều worker cùng ghi)
+_REGISTER_SCRIPT = """
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or '0')
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('zadd', KEYS[2], ARGV[3], ARGV[1])
+return redis.call('incrby', KEYS[3], tonumber(ARGV[2]) - old)
+"""
+_FORGET_SCRIPT = """
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[1]) or '0')
+redis.call('hdel', KEYS[1], ARGV[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+return redis.call('incrby', KEYS[3], -old)
+"""
+
+
+def _keys():
+    return key('storage', 'size'), key('storage', 'atime'), key('storage', 'bytes')
+
+
+def parts_name(task_id):
+    return f"{PARTS_PREFIX}{task_id}"
+
+
+def _path(name):
+    if name.startswith(PARTS_PREFIX):
+        return resume.work_dir(name[len(PARTS_PREFIX):])
+    return os.path.join(DOWNLOAD_DIR, name)
+
+
+def _disk_size(path):
+    """Dung lượng file, hoặc tổng các file trong thư mục (thư mục tải dở)"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+# --- INDEX ---
+def register(name, atime=None):
+    """Ghi nhận (hoặc cập nhật dung lượng) 1 file/thư mục tải dở vào index"""
+    if not name:
+        return
+    size = _disk_size(_path(name))
+    try:
+        get_redis().eval(_REGISTER_SCRIPT, 3, *_keys(), name, size, atime or time.time())
+    except redis.RedisError:
+        pass
+
+
+def forget(name):
+    try:
+        get_redis().eval(_FORGET_SCRIPT, 3, *_keys(), name)
+    except redis.RedisError:
+        pass
+
+
+def touch(name):
+    """Cập nhật lần dùng cuối (file được tải về / được dùng lại qua cache)"""
+    if not name:
+        return
+    try:
+        get_redis().zadd(key('storage', 'atime'), {name: time.time()}, xx=True)
+    except redis.RedisError:
+        pass
+
+
+def purge_parts(task_id):
+    """Xóa thư mục tải dở của task và bỏ nó khỏi index"""
+    resume.purge(task_id)
+    forget(parts_name(task_id))
+
+
+def _scan():
+    """Quét đĩa: ({tên mục: dung lượng}, {tên mục: mtime}) của file, thư mục tải dở và file cache sidecar"""
+    sizes, atimes = {}, {}
+
+    def add(name, path, size=None):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return  # Vừa bị xóa trong lúc quét
+        sizes[name] = st.st_size if size is None else size
+        atimes[name] = st.st_mtime
+
+    if os.path.isdir(DOWNLOAD_DIR):
+        for entry in os.scandir(DOWNLOAD_DIR):
+            if entry.is_file():
+                add(entry.name, entry.path)
+    if os.path.isdir(resume.PARTS_DIR):
+        for entry in os.scandir(resume.PARTS_DIR):
+            if entry.is_dir():
+                add(parts_name(entry.name), entry.path, _disk_size(entry.path))
+    if os.path.isdir(SIDECARS_DIR):
+        for root, _, files in os.walk(SIDECARS_DIR):
+            for filename in files:
+                path = os.path.join(root, filename)
+                add(os.path.relpath(path, DOWNLOAD_DIR), path)
+    return sizes, atimes
+
+
+def reindex():
+    """
+    Dựng lại index từ đĩa (chỉ khi index bị mất: lần đầu triển khai, Redis bị xóa...).
+    Lần dùng cuối lấy theo mtime.
+    """
+    r = get_redis()
+    size_key, atime_key, bytes_key = _keys()
+    sizes, atimes = _scan()
+    pipe = r.pipeline()
+    pipe.delete(size_key, atime_key)
+    if sizes:
+        pipe.hset(size_key, mapping=sizes)
+        pipe.zadd(atime_key, atimes)
+    pipe.set(bytes_key, sum(sizes.values()))
+    pipe.set(key('storage', 'indexed'), int(time.time()))
+    pipe.execute()
+    print(f"🗂️ STORAGE REINDEXED: {len(sizes)} mục, {sum(sizes.values())} bytes")
+
+
+def reconcile():
+    """
+    Đối chiếu index với đĩa (thưa, mỗi STORAGE_RECONCILE_INTERVAL giây): file không đi qua register()
+    (sidecar sót lại, file format trung gian, file của lượt hậu xử lý lỗi...) được thêm vào với lần dùng
+    cuối = mtime, mục không còn trên đĩa bị bỏ, dung lượng lệch (thư mục tải dở) được cập nhật.
+    Lần dùng cuối của mục đã có giữ nguyên. Chạy trong khóa dọn dẹp (không đua với _evict).
+    Trả về (số mục thêm, số mục bỏ).
+    """
+    r = get_redis()
+    size_key, atime_key, _ = _keys()
+    sizes, atimes = _scan()
+    indexed = r.hgetall(size_key)
+    added = removed = 0
+    for name, size in sizes.items():
+        if name not in indexed:
+            added += 1
+        elif int(indexed[name]) == size:
+            continue
+        atime = r.zscore(atime_key, name) or atimes[name]
+        r.eval(_REGISTER_SCRIPT, 3, *_keys(), name, size, atime)
+    for name in indexed:
+        # Mục mới register sau lúc quét thì vẫn còn trên đĩa
+        if name not in sizes and not os.path.exists(_path(name)):
+            forget(name)
+            removed += 1
+    r.set(key('storage', 'indexed'), int(time.time()))
+    if added or removed:
+        print(f"🗂️ STORAGE RECONCILED: +{added} / -{removed} mục")
+    return added, removed
+
+
+# --- PIN: FILE ĐANG ĐƯỢC GỬI CHO CLIENT ---
+def pin(names, ttl=None):
+    """Giữ các file không bị xóa trong ttl giây. Trả về token để unpin/gia hạn"""
+    token = uuid.uuid4().hex
+    expires = time.time() + (ttl or settings.STORAGE_PIN_TTL)
+    try:
+        get_redis().zadd(key('storage', 'pins'), {f"{name}\0{token}": expires for name in names})
+    except redis.RedisError:
+        pass
+    return token
+
+
+def unpin(names, token):
+    try:
+        get_redis().zrem(key('storage', 'pins'), *[f"{name}\0{token}" for name in names])
+    except redis.RedisError:
+        pass
+
+
+def pinned():
+    """Tên các file đang bị pin (bỏ các pin đã hết hạn)"""
+    r = get_redis()
+    now = time.time()
+    r.zremrangebyscore(key('storage', 'pins'), '-inf', now)
+    return {member.split('\0', 1)[0] for member in r.zrangebyscore(key('storage', 'pins'), now, '+inf')}
+
+
+def pin_iter(names, iterator):
+    """Bọc iterator gửi file: pin trong lúc gửi (gia hạn theo từng chunk), xong thì nhả"""
+    ttl = settings.STORAGE_PIN_TTL
+    token = pin(names, ttl)
+    renewed = time.monotonic()
+    try:
+        for chunk in iterator:
+            if time.monotonic() - renewed > ttl / 3:
+                _renew(names, token, ttl)
+                renewed = time.monotonic()
+            yield chunk
+    finally:
+        unpin(names, token)
+
+
+def _renew(names, token, ttl):
+    try:
+        get_redis().zadd(
+            key('storage', 'pins'), {f"{name}\0{token}": time.time() + ttl for name in names}, xx=True
+        )
+    except redis.RedisError:
+        pass
+
+
+# --- DỌN DẸP ---
+def usage():
+    """Dung lượng đang dùng theo index so với ngân sách + dung lượng trống thật của ổ đĩa"""
+    try:
+        used = int(get_redis().get(key('storage', 'bytes')) or 0)
+    except redis.RedisError:
+        used = None
+    try:
+        free = shutil.disk_usage(DOWNLOAD_DIR).free
+    except OSError:
+        free = None
+    budget = settings.STORAGE_BUDGET_BYTES
+    return {
+        'used_bytes': used,
+        'budget_bytes': budget,
+        'high_bytes': int(budget * settings.STORAGE_HIGH_WATERMARK),
+        'low_bytes': int(budget * settings.STORAGE_LOW_WATERMARK),
+        'disk_free_bytes': free,
+    }
+
+
+def _over(state, threshold):
+    low_disk = state['disk_free_bytes'] is not None and state['disk_free_bytes'] < settings.STORAGE_MIN_FREE_BYTES
+    return low_disk or (state['used_bytes'] or 0) > state[threshold]
+
+
+def _evictable(name, atime, pins):
+    if name in pins:
+        return False
+    if name.startswith(PARTS_PREFIX):
+        # Thư mục tải dở: chỉ xóa khi task đã chết (không còn heartbeat) và bị bỏ dở đủ lâu
+        return atime < time.time() - settings.FILE_EXPIRATION and not resume.is_alive(name[len(PARTS_PREFIX):])
+    return True
+
+
+def _delete(name):
+    if name.startswith(PARTS_PREFIX):
+        resume.purge(name[len(PARTS_PREFIX):])
+        return
+    try:
+        os.remove(_path(name))
+    except FileNotFoundError:
+        pass
+    if name.startswith(SIDECARS_PREFIX):
+        # Xóa nốt thư mục của video khi không còn file nào
+        try:
+            os.rmdir(os.path.dirname(_path(name)))
+        except OSError:
+            pass
+
+
+def _evict(report, pins, stop, max_atime='+inf'):
+    """Xóa theo lần dùng cuối, cũ nhất trước, tới khi stop() == True hoặc hết mục xóa được"""
+    size_key, atime_key, _ = _keys()
+    r = get_redis()
+    start = 0
+    while not stop():
+        page = r.zrangebyscore(atime_key, '-inf', max_atime, start=start, num=100, withscores=True)
+        if not page:
+            return
+        kept = 0
+        for name, atime in page:
+            if stop():
+                return
+            if not _evictable(name, atime, pins):
+                kept += 1
+                report['skipped_pinned'] += name in pins
+                continue
+            size = int(r.hget(size_key, name) or 0)
+            try:
+                _delete(name)
+            except OSError as e:
+                print(f"❌ Cannot delete {name}: {e}")
+                kept += 1
+                continue
+            forget(name)
+            report['evicted'] += 1
+            report['bytes_reclaimed'] += size
+            if len(report['files']) < 50:
+                report['files'].append(name)
+        # Mục bị giữ lại vẫn nằm đầu index -> trang sau bắt đầu sau chúng
+        start += kept
+
+
+def _save_report(report):
+    report['finished_at'] = time.time()
+    report.update({f"after_{k}": v for k, v in usage().items()})
+    try:
+        pipe = get_redis().pipeline()
+        pipe.set(key('storage', 'report'), json.dumps(report))
+        pipe.incrby(key('storage', 'reclaimed_total'), report['bytes_reclaimed'])
+        pipe.incrby(key('storage', 'evicted_total'), report['evicted'])
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    if report['evicted']:
+        print(f"🧹 STORAGE ({report['reason']}): xóa {report['evicted']} mục, "
+              f"thu hồi {report['bytes_reclaimed'] / 1024 ** 2:.1f} MB")
+    return report
+
+
+def enforce(reason='watermark', idle=False):
+    """
+    Vượt high watermark (hoặc ổ đĩa sắp đầy) -> xóa LRU tới khi xuống low watermark.
+    idle=True: xóa thêm mọi mục không được dùng trong FILE_EXPIRATION giây.
+    Trả về báo cáo, None nếu không cần làm gì, worker khác đang dọn hoặc Redis lỗi.
+    """
+    try:
+        return _enforce(reason, idle)
+    except redis.RedisError as e:
+        print(f"❌ STORAGE: Redis lỗi, bỏ qua lượt dọn: {e}")
+        return None
+
+
+def _enforce(reason, idle):
+    state = usage()
+    if state['used_bytes'] is None or (not idle and not _over(state, 'high_bytes')):
+        return None
+    r = get_redis()
+    lock = r.lock(key('storage', 'lock'), timeout=600)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        report = {
+            'reason': reason, 'started_at': time.time(), 'evicted': 0, 'bytes_reclaimed': 0,
+            'skipped_pinned': 0, 'files': [],
+            **{f"before_{k}": v for k, v in state.items()},
+        }
+        pins = pinned()
+        if idle:
+            _evict(report, pins, stop=lambda: False, max_atime=time.time() - settings.FILE_EXPIRATION)
+        if _over(usage(), 'high_bytes'):
+            _evict(report, pins, stop=lambda: not _over(usage(), 'low_bytes'))
+        return _save_report(report)
+    finally:
+        try:
+            lock.release()
+        except redis.RedisError:
+            pass
+
+
+def _reconcile_locked():
+    lock = get_redis().lock(key('storage', 'lock'), timeout=600)
+    if not lock.acquire(blocking=False):
+        return  # Worker khác đang dọn, lượt sau đối chiếu
+    try:
+        reconcile()
+    finally:
+        try:
+            lock.release()
+        except redis.RedisError:
+            pass
+
+
+def sweep():
+    """
+    Chạy định kỳ: dựng index nếu chưa có, đối chiếu lại với đĩa nếu lần quét trước đã lâu,
+    rồi xóa mục hết hạn + ép về watermark
+    """
+    try:
+        indexed_at = get_redis().get(key('storage', 'indexed'))
+        if not indexed_at:
+            reindex()
+        elif time.time() - float(indexed_at) > settings.STORAGE_RECONCILE_INTERVAL:
+            _reconcile_locked()
+    except redis.RedisError as e:
+        print(f"❌ STORAGE SWEEP: Redis lỗi: {e}")
+        return None
+    return enforce(reason='sweep', idle=True)
+
+
+def last_report():
+    try:
+        raw = get_redis().get(key('storage', 'report'))
+    except redis.RedisError:
+        return None
+    return json.loads(raw) if raw else None
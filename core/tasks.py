@@ -1,11 +1,16 @@
 import os
 import datetime
 import time
-import shutil
+import redis
 import yt_dlp
 from celery import shared_task
+from celery.signals import worker_ready, worker_process_init
 from django.conf import settings
-from .models import DownloadTask
+from django.utils import timezone
+from .models import DownloadTask, DownloadBatch
+from .fingerprint import normalize_url, task_fingerprint
+from .redis_client import get_redis, key
+from . import binaries, result_cache, singleflight, progress, resume, extract_cache, pipeline, site_policy, adaptive_dl, remux, storage, retention, metrics, sessions, scheduling, admission, sidecars
 
 BASE_DIR = settings.BASE_DIR
 # Thư mục chứa các file thực thi (cho Windows)
@@ -14,96 +19,314 @@ LOCAL_BIN_DIR = os.path.join(BASE_DIR, 'bin')
 COOKIES_FILE = os.path.join(BASE_DIR, 'cookies.txt')
 # Thư mục lưu file tải về
 DOWNLOAD_DIR = os.path.join(settings.MEDIA_ROOT, 'downloads')
+# Trạng thái mà message của từng stage còn phải chạy (giao lại/thử lại sau đó thì bỏ qua)
+FETCH_STATUSES = ('PENDING', 'DOWNLOADING')
+POSTPROCESS_STATUSES = ('DOWNLOADED', 'PROCESSING')
 
 # --- HÀM HỖ TRỢ TÌM KIẾM TOOL (CROSS-PLATFORM) ---
 def get_binary_path(name):
-    """
-    Tìm đường dẫn file thực thi (ffmpeg, aria2c)
-    Ưu tiên tìm trong System Path (Linux/Docker) trước, sau đó mới tìm trong folder bin (Windows)
-    """
-    # 1. Tìm trong môi trường hệ thống (Linux/Docker)
-    path = shutil.which(name)
-    if path:
-        return path
-    
-    # 2. Tìm trong thư mục bin của dự án (Windows dev)
-    # Lưu ý: Windows cần đuôi .exe
-    exe_name = f"{name}.exe"
-    local_path = os.path.join(LOCAL_BIN_DIR, exe_name)
-    if os.path.exists(local_path):
-        return local_path
-    
-    return None
+    """Tìm ffmpeg/aria2c trong PATH rồi tới thư mục bin của dự án (xem core/binaries.py)"""
+    return binaries.find_binary(name, LOCAL_BIN_DIR)
 
 # Tìm đường dẫn ngay khi load file để tối ưu hiệu năng
 FFMPEG_PATH = get_binary_path('ffmpeg')
 ARIA2C_PATH = get_binary_path('aria2c')
+FFPROBE_PATH = get_binary_path('ffprobe')
 
-@shared_task(bind=True)
-def process_download_task(self, db_task_id):
-    # [LOGGING] Ghi log để debug nếu cần
-    print(f"🕒 START TASK ID: {db_task_id} | TIME: {datetime.datetime.now()}")
-    print(f"🔧 TOOLS: FFmpeg={'FOUND' if FFMPEG_PATH else 'MISSING'} | Aria2c={'FOUND' if ARIA2C_PATH else 'MISSING'}")
-    print(f"🍪 COOKIE FILE: {'FOUND' if os.path.exists(COOKIES_FILE) else 'MISSING (Youtube may fail)'}")
+# Cache kết quả extract (dùng chung Redis với CLI nếu CLI trỏ cùng REDIS_URL)
+EXTRACT_CACHE = extract_cache.ExtractCache(redis_url=settings.REDIS_URL, default_ttl=settings.EXTRACT_CACHE_TTL)
+# Lịch sử tốc độ theo CDN để chọn số kết nối aria2c (dùng chung mọi worker qua Redis)
+DOWNLOADER_TUNER = adaptive_dl.DownloaderTuner(redis_url=settings.REDIS_URL)
+# cookies.txt chỉ stat lại sau mỗi vài giây; đổi file thì các YoutubeDL trong pool tự nạp lại
+COOKIES = sessions.CookieFile(COOKIES_FILE, check_interval=settings.COOKIES_CHECK_INTERVAL)
+# YoutubeDL dùng lại giữa các task của worker (không tạo mới + parse cookie + bắt tay TLS mỗi task)
+YDL_SESSIONS = sessions.SessionPool(
+    cookies=COOKIES,
+    max_idle=settings.YDL_POOL_MAX_IDLE,
+    max_uses=settings.YDL_POOL_MAX_USES,
+    max_age=settings.YDL_POOL_MAX_AGE,
+    enabled=settings.YDL_SESSION_POOL,
+)
+# Thumbnail/phụ đề đã tải, theo id video (media/downloads/.sidecars/<extractor>-<id>/), tính vào ngân sách đĩa
+SIDECAR_CACHE = sidecars.SidecarCache(
+    storage.SIDECARS_DIR,
+    max_age=settings.SIDECAR_CACHE_TTL,
+    on_store=lambda path: storage.register(os.path.relpath(path, DOWNLOAD_DIR)),
+    on_hit=lambda path: storage.touch(os.path.relpath(path, DOWNLOAD_DIR)),
+)
 
-    try:
-        task_db = DownloadTask.objects.get(id=db_task_id)
-    except DownloadTask.DoesNotExist:
-        return "Task not found"
+def _extractor(task_db, info=None):
+    """Nhãn extractor cho metrics: theo yt-dlp nếu đã extract, chưa thì theo site của link"""
+    if info and info.get('extractor_key'):
+        return info['extractor_key'].lower()
+    return site_policy.site_for(task_db.url)
 
-    # [XỬ LÝ URL THREADS/INSTAGRAM]
-    original_url = task_db.url
-    if 'threads.com' in original_url: 
-        original_url = original_url.replace('threads.com', 'threads.net')
-    
-    # Cắt bỏ các tham số tracking (?si=...) để URL sạch đẹp
-    if '?' in original_url: 
-        task_db.url = original_url.split('?')[0]
-    else:
-        task_db.url = original_url
 
-    # Cập nhật trạng thái: Đang tải
-    task_db.status = 'DOWNLOADING'
+def _observe_done(task_db, extractor):
+    extractor = extractor or _extractor(task_db)
+    metrics.inc('hust_tasks_total', status=task_db.status, extractor=extractor)
+    if task_db.created_at:
+        metrics.observe(
+            'hust_task_latency_seconds', (timezone.now() - task_db.created_at).total_seconds(),
+            status=task_db.status, extractor=extractor,
+        )
+
+
+def _mark_finished(task_db, filename, extractor=None):
+    """Đánh dấu hoàn tất cho task và toàn bộ follower đang bám theo nó"""
+    # Task đã thật sự tải/xử lý (không phải cache hit lúc vừa nhận) -> tính vào tốc độ xử lý
+    if task_db.status != 'PENDING':
+        admission.record_done(task_db)
+    task_db.filename = filename
+    task_db.status = 'FINISHED'
+    task_db.progress = 100.0
     task_db.save()
+    progress.publish(task_db)
+    # Lease single-flight sống đúng bằng vòng đời leader: kết thúc thì nhả (yêu cầu trùng sau đó dùng cache)
+    singleflight.release(task_db.fingerprint, task_db.id)
+    _settle_followers(task_db, status='FINISHED', progress=100.0, filename=filename)
+    _observe_done(task_db, extractor)
+    # Ghi vào index dung lượng, vượt ngân sách thì dọn file ít dùng ngay (không chờ lượt dọn định kỳ)
+    storage.register(filename)
+    storage.enforce()
 
-    # Tạo thư mục nếu chưa có
-    if not os.path.exists(DOWNLOAD_DIR):
-        os.makedirs(DOWNLOAD_DIR)
 
-    # Hàm cập nhật tiến trình (Hook)
-    def progress_hook(d):
-        if d['status'] == 'downloading':
+def _mark_failed(task_db, error='', extractor=None, stage=''):
+    if task_db.status != 'PENDING':
+        admission.record_done(task_db)
+    task_db.status = 'FAILED'
+    task_db.error = str(error)[:255]
+    task_db.save()
+    progress.publish(task_db)
+    singleflight.release(task_db.fingerprint, task_db.id)
+    _settle_followers(task_db, status='FAILED', error=task_db.error)
+    _observe_done(task_db, extractor)
+    metrics.inc('hust_task_failures_total', stage=stage, reason=metrics.failure_class(error))
+
+
+def _settle_followers(task_db, **fields):
+    """Kết thúc các follower theo leader, trả slot nhận job, rồi cho batch chứa chúng chạy tiếp task đang chờ"""
+    followers = task_db.followers.filter(status__in=singleflight.ACTIVE_STATUSES)
+    batch_ids = set(followers.filter(batch__isnull=False).values_list('batch_id', flat=True))
+    follower_ids = list(followers.values_list('id', flat=True))
+    followers.update(**fields)
+    admission.release(task_db.id, *follower_ids)
+    if task_db.batch_id:
+        batch_ids.add(task_db.batch_id)
+    for batch_id in batch_ids:
+        advance_batch(batch_id)
+
+
+def _attach_follower(task_db, leader, *fields):
+    """
+    Lưu liên kết follower -> leader. Leader có thể kết thúc ngay sau singleflight.join, trước khi liên kết
+    được lưu: _settle_followers của leader đã chạy và bỏ sót follower này -> đọc lại leader, kết thúc luôn.
+    Trả về True nếu follower đã kết thúc theo leader.
+    """
+    task_db.leader = leader
+    task_db.save(update_fields=['leader', *fields])
+    progress.follow(task_db.id, leader.id)
+    metrics.inc('hust_singleflight_joins_total')
+
+    leader.refresh_from_db(fields=['status', 'filename', 'error'])
+    if leader.status == 'FINISHED':
+        done = {'status': 'FINISHED', 'progress': 100.0, 'filename': leader.filename}
+    elif leader.status == 'FAILED':
+        done = {'status': 'FAILED', 'error': leader.error}
+    else:
+        return False
+    # Đổi trạng thái có điều kiện: _settle_followers chạy cùng lúc đã kết thúc follower thì thôi
+    if DownloadTask.objects.filter(id=task_db.id, status__in=singleflight.ACTIVE_STATUSES).update(**done):
+        admission.release(task_db.id)
+    task_db.refresh_from_db(fields=list(done))
+    return True
+
+
+def enqueue_fetch(task_db):
+    """
+    Đưa task vào queue tải riêng của site (xem settings.SITE_POLICIES), đúng làn ưu tiên theo
+    chi phí ước tính (xem core/scheduling.py). Gửi lại thì message cũ của task tự bỏ qua.
+    """
+    if task_db.estimated_cost is None:
+        task_db.estimated_cost = scheduling.estimate_cost(task_db)
+    task_db.priority = scheduling.priority_for(task_db)
+    task_db.save(update_fields=['estimated_cost', 'priority'])
+    process_download_task.apply_async(
+        (task_db.id,),
+        queue=site_policy.queue_for(task_db.url),
+        priority=task_db.priority,
+        task_id=scheduling.new_dispatch(task_db.id),
+    )
+
+
+def enqueue_postprocess(task_db):
+    """Stage 2 giữ nguyên làn của stage tải (file 4K ghép/convert lâu hơn file audio ngắn)"""
+    postprocess_download_task.apply_async((task_db.id,), priority=task_db.priority)
+
+
+def probe_cost(task_db):
+    """
+    [ƯU TIÊN] Đọc nhanh thông tin video (thời lượng, dung lượng format sẽ chọn) để ước tính chi phí.
+    Kết quả extract vào cache nên worker không phải extract lại. Lỗi/tắt probe thì ước tính theo tùy chọn.
+    Chạy trong worker (probe_task_cost), không chạy trong request HTTP.
+    """
+    info = None
+    if settings.PRIORITY_PROBE:
+        opts = {
+            **build_opts(task_db),
+            'quiet': True,
+            'socket_timeout': settings.PRIORITY_PROBE_TIMEOUT,
+        }
+        try:
+            with YDL_SESSIONS.session(yt_dlp.YoutubeDL, opts) as ydl:
+                info, _ = extract_cache.extract_with_source(ydl, normalize_url(task_db.url), EXTRACT_CACHE)
+                # Chọn format như lúc tải (không tải) để biết dung lượng thật; playlist/link chuyển tiếp thì thôi
+                if info and info.get('_type', 'video') == 'video':
+                    info = ydl.process_ie_result(info, download=False) or info
+        except Exception as e:
+            print(f"⚠️ PROBE FAILED: {task_db.url} ({e})")
+    task_db.estimated_cost = scheduling.estimate_cost(task_db, info)
+    return task_db.estimated_cost
+
+
+def submit_task(task, probe=False):
+    """
+    Gửi 1 task (đã có fingerprint) đi xử lý:
+    cache có file y hệt -> xong ngay; link y hệt đang tải -> bám theo; còn lại -> đẩy vào Celery.
+    probe=True: xếp làn theo tùy chọn tải ngay, rồi 1 task nhẹ đọc thông tin video và chuyển làn nếu cần.
+    """
+    # [CACHE KẾT QUẢ] Đã có file y hệt -> trả về ngay, không cần đẩy vào Celery
+    cached_file = result_cache.lookup(task.fingerprint)
+    if cached_file:
+        storage.touch(cached_file)
+        task.filename = cached_file
+        task.status = 'FINISHED'
+        task.progress = 100.0
+        task.save()
+        progress.publish(task)
+        return task
+
+    task.save()
+
+    # [SINGLE-FLIGHT] Link y hệt đang được tải -> bám theo job đó thay vì tải song song
+    leader = singleflight.join(task)
+    if leader:
+        task.status = leader.status
+        # Task con của batch: vòng lặp advance_batch đang chạy tự xếp lượt tiếp nếu follower kết thúc luôn
+        _attach_follower(task, leader, 'status')
+        return task
+
+    progress.publish(task)
+
+    # Đẩy vào Celery
+    enqueue_fetch(task)
+    if probe and settings.PRIORITY_PROBE:
+        probe_task_cost.apply_async((task.id,), priority=0)
+    return task
+
+
+@shared_task
+def probe_task_cost(db_task_id):
+    """
+    [ƯU TIÊN] Ước tính lại chi phí của task vừa nhận từ thông tin video thật; khác làn thì gửi lại
+    với priority mới (message cũ tự bỏ qua). Task đã được worker nhận thì thôi.
+    """
+    task_db = DownloadTask.objects.filter(id=db_task_id, status='PENDING', leader__isnull=True).first()
+    if not task_db:
+        return "Not pending"
+    probe_cost(task_db)
+    if not DownloadTask.objects.filter(id=task_db.id, status='PENDING').exists():
+        return "Started"
+    if scheduling.priority_for(task_db) != task_db.priority:
+        old_priority = task_db.priority
+        enqueue_fetch(task_db)
+        print(f"🔀 PROBE: {task_db.id} priority {old_priority} -> {task_db.priority}")
+    else:
+        task_db.save(update_fields=['estimated_cost'])
+    return task_db.estimated_cost
+
+
+# --- BATCH / PLAYLIST: CHẠY SONG SONG TỐI ĐA max_parallel TASK CON ---
+def create_batch_tasks(batch, urls, entries=None):
+    """
+    Tạo task con ở trạng thái WAITING (chưa đẩy vào Celery), chung tùy chọn của batch.
+    entries: entry "phẳng" của playlist theo thứ tự urls (có thời lượng -> ước tính chi phí không cần probe)
+    """
+    tasks = []
+    for index, url in enumerate(urls):
+        task = DownloadTask(url=url, status='WAITING', batch=batch, batch_index=index, **batch.options)
+        task.fingerprint = task_fingerprint(task)
+        task.estimated_cost = scheduling.estimate_cost(task, entries[index] if entries else None)
+        tasks.append(task)
+    DownloadTask.objects.bulk_create(tasks)
+    return tasks
+
+
+def advance_batch(batch_id):
+    """Đẩy thêm task con WAITING vào hàng đợi cho tới khi batch có đủ max_parallel task đang chạy"""
+    batch = DownloadBatch.objects.filter(id=batch_id).first()
+    if not batch:
+        return
+    try:
+        # Nhiều task con kết thúc cùng lúc -> chỉ 1 worker được xếp lượt tại 1 thời điểm
+        lock = get_redis().lock(key('batch', batch_id), timeout=60, blocking_timeout=10)
+        locked = lock.acquire()
+    except redis.RedisError:
+        lock, locked = None, False
+    try:
+        while True:
+            running = batch.tasks.filter(status__in=singleflight.ACTIVE_STATUSES).count()
+            if running >= batch.max_parallel:
+                break
+            task = batch.tasks.filter(status='WAITING').order_by('batch_index').first()
+            if not task:
+                break
+            # Đổi trạng thái có điều kiện: task đã được nơi khác đẩy đi thì bỏ qua
+            if not DownloadTask.objects.filter(id=task.id, status='WAITING').update(status='PENDING'):
+                continue
+            task.status = 'PENDING'
+            submit_task(task)
+        # [NHẬN JOB] Còn ít task con hơn số slot batch đang giữ -> trả bớt slot cho client
+        remaining = batch.tasks.filter(status__in=('WAITING',) + singleflight.ACTIVE_STATUSES).count()
+        admission.release(*admission.batch_slots(batch.id, batch.max_parallel, start=remaining))
+    finally:
+        if locked:
             try:
-                # Lấy % tải về và cập nhật vào DB
-                p = d.get('_percent_str', '0%').replace('%', '')
-                task_db.progress = float(p)
-                task_db.save(update_fields=['progress'])
-            except: pass
-        elif d['status'] == 'finished':
-            task_db.status = 'PROCESSING'
-            task_db.progress = 99.0
-            task_db.save()
+                lock.release()
+            except redis.RedisError:
+                pass
+
+
+def build_opts(task_db, progress_hooks=None):
+    """
+    [CẤU HÌNH YT-DLP] Dùng chung cho cả 2 stage: stage tải cần format/downloader,
+    stage hậu xử lý cần đúng danh sách postprocessor + postprocessor_args.
+    """
+    policy = site_policy.policy_for(task_db.url)
 
     # Định dạng tên file lưu trên ổ cứng (Giữ nguyên tên gốc + ID để tránh trùng)
-    path_template = os.path.join(DOWNLOAD_DIR, '%(title).200s [%(id)s].%(ext)s')
+    path_template = '%(title).200s [%(id)s].%(ext)s'
 
     # [CẤU HÌNH YT-DLP CORE]
     opts = {
         'outtmpl': path_template,
+        # File hoàn chỉnh ở media/downloads, file tạm (.part/.aria2/fragment) ở thư mục riêng của task
+        'paths': {'home': DOWNLOAD_DIR, 'temp': resume.work_dir(task_db.id)},
         'ffmpeg_location': os.path.dirname(FFMPEG_PATH) if FFMPEG_PATH else None,
         
         # === CHÌA KHÓA VÀNG: COOKIE ===
         # Tự động nạp cookie nếu file tồn tại
-        'cookiefile': COOKIES_FILE if os.path.exists(COOKIES_FILE) else None,
+        'cookiefile': COOKIES.existing(),
         # ==============================
 
         'quiet': False, # Bật log để xem lỗi trên Render
         'no_warnings': True,
         'ignoreerrors': True,
-        'progress_hooks': [progress_hook],
-        'overwrites': True,       # Ghi đè file cũ
-        'force_overwrite': True,
-        'no_continue': True,      # Không resume (để tránh lỗi file corrupt)
+        # Link video nằm trong playlist (watch?v=...&list=...) chỉ tải đúng video đó, playlist đi qua API batch
+        'noplaylist': True,
+        'progress_hooks': progress_hooks or [],
+        'overwrites': True,       # Ghi đè file hoàn chỉnh cũ
+        'continuedl': True,       # Tải tiếp file .part (an toàn nhờ thư mục tạm riêng + kiểm tra ffprobe)
         
         # Bypass SSL Errors (Fix lỗi Youtube hay gặp trên Cloud)
         'nocheckcertificate': True, 
@@ -125,24 +348,30 @@ def process_download_task(self, db_task_id):
         'writesubtitles': task_db.use_subtitle,
         'embedthumbnail': task_db.use_thumbnail,
         'embedsubtitles': task_db.use_subtitle,
-        'subtitleslangs': ['vi', 'en', 'en-US', 'all'] if task_db.use_subtitle else None,
+        'subtitleslangs': settings.SUBTITLE_LANGS if task_db.use_subtitle else None,
         
         # Tự động thử lại 10 lần nếu mạng lag
         'retries': 10,
         'fragment_retries': 10,
+        # Số fragment HLS/DASH tải song song (theo chính sách của site)
+        'concurrent_fragment_downloads': policy['fragments'],
     }
 
     # [CẤU HÌNH ARIA2C - TĂNG TỐC ĐỘ TẢI]
-    # Chỉ bật Aria2c nếu không phải Threads/Instagram (vì bọn này chặn đa luồng)
-    if ARIA2C_PATH and 'threads.net' not in task_db.url and 'instagram.com' not in task_db.url:
+    # Bật/tắt và tham số theo bảng chính sách site (Threads/Instagram chặn đa luồng).
+    # Với file HTTP liền, số kết nối/chunk được chọn lại theo từng CDN lúc tải (core/adaptive_dl.py)
+    if ARIA2C_PATH and policy['aria2c']:
         opts['external_downloader'] = {'default': ARIA2C_PATH}
-        opts['external_downloader_args'] = {'aria2c': ['-x', '16', '-k', '1M', '-s', '16']}
+        # --auto-save-interval: ghi file điều khiển .aria2 mỗi 10s để resume mất ít dữ liệu nhất
+        opts['external_downloader_args'] = {'aria2c': policy['aria2c_args']}
     
     # [LOGIC XỬ LÝ FORMAT (VIDEO vs AUDIO)]
     if task_db.task_type == 'audio':
-        bitrate = '320' if task_db.audio_quality == 'best' else '128'
+        # Bitrate tối đa theo lựa chọn, stage 2 hạ xuống bằng bitrate nguồn hoặc copy thẳng (core/remux.py)
+        bitrate = str(remux.target_bitrate(task_db.audio_quality))
         opts.update({
-            'format': 'bestaudio/best',
+            # Ưu tiên nguồn cùng codec với đích (VD: m4a -> AAC) để không phải encode lại
+            'format': remux.audio_format_selector(task_db.audio_format),
             'postprocessors': [
                 {'key': 'FFmpegExtractAudio', 'preferredcodec': task_db.audio_format, 'preferredquality': bitrate},
                 {'key': 'EmbedThumbnail'}, 
@@ -154,8 +383,8 @@ def process_download_task(self, db_task_id):
         # Xử lý Video
         res = task_db.resolution
         container = task_db.container
-        # Logic chọn chất lượng thông minh
-        fmt_str = f"bestvideo[height<={res}][ext={container}]+bestaudio/best[height<={res}][ext={container}]/best"
+        # Logic chọn chất lượng thông minh: ưu tiên audio hợp container để ghép không phải encode
+        fmt_str = remux.format_selector(res, container)
         
         opts.update({
             'format': fmt_str,
@@ -163,74 +392,386 @@ def process_download_task(self, db_task_id):
             # Nếu là MP4 thì dùng Subtitle dạng SRT (tương thích cao)
             'subtitlesformat': 'srt' if container == 'mp4' else 'ass/srt/best',
         })
-        
-        # Nếu container là MP4, ép FFmpeg convert audio sang AAC để chạy được trên iPhone/Windows
-        if container == 'mp4':
-            opts['postprocessor_args'] = {'ffmpeg': ['-c:v', 'copy', '-c:a', 'aac']}
+        # Audio không hợp container (VD: Opus trong MP4) mới encode lại, quyết định ở stage 2 (core/remux.py)
         
         # Bỏ qua quảng cáo trong video Youtube (SponsorBlock)
-        if 'youtube' in task_db.url:
+        if policy['site'] == 'youtube':
             opts['sponsorblock_remove'] = ['sponsor', 'intro', 'outro', 'selfpromo']
 
-    # [THỰC THI DOWNLOAD]
+    return opts
+
+
+# acks_late + reject_on_worker_lost: worker chết giữa chừng thì message được giao lại,
+# lần chạy sau tải tiếp từ file tạm của task (xem core/resume.py)
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_download_task(self, db_task_id):
+    # [LOGGING] Ghi log để debug nếu cần
+    print(f"🕒 START TASK ID: {db_task_id} | TIME: {datetime.datetime.now()}")
+    print(f"🔧 TOOLS: FFmpeg={'FOUND' if FFMPEG_PATH else 'MISSING'} | Aria2c={'FOUND' if ARIA2C_PATH else 'MISSING'}")
+    print(f"🍪 COOKIE FILE: {'FOUND' if COOKIES.existing() else 'MISSING (Youtube may fail)'}")
+
+    # [LÀN ƯU TIÊN] Task đã được gửi lại với priority cao hơn (age_pending_tasks) -> message này thừa
+    if not scheduling.is_current(db_task_id, self.request.id):
+        print(f"⏭️ MESSAGE CŨ (ĐÃ LÊN LÀN ƯU TIÊN CAO HƠN): {db_task_id}")
+        return "Superseded"
+
     try:
-        with yt_dlp.YoutubeDL(opts) as ydl:
+        task_db = DownloadTask.objects.get(id=db_task_id)
+    except DownloadTask.DoesNotExist:
+        return "Task not found"
+
+    # Message giao lại/thử lại khi task đã qua stage tải hoặc đã kết thúc -> không tải lại
+    if task_db.status not in FETCH_STATUSES:
+        print(f"⏭️ TASK ĐÃ QUA STAGE TẢI ({task_db.status}): {task_db.id}")
+        return "Already fetched"
+
+    # [CACHE KẾT QUẢ] Link + tùy chọn y hệt đã tải xong gần đây -> dùng lại file cũ
+    cached_file = result_cache.lookup(task_db.fingerprint)
+    if cached_file:
+        _mark_finished(task_db, cached_file)
+        print(f"⚡ CACHE HIT: {cached_file}")
+        return
+
+    # [SINGLE-FLIGHT] Đã có worker khác đang tải đúng file này -> bám theo, không tải lại
+    leader = singleflight.join(task_db)
+    if leader:
+        print(f"🔗 ATTACHED TO RUNNING TASK: {leader.id}")
+        if _attach_follower(task_db, leader) and task_db.batch_id:
+            advance_batch(task_db.batch_id)
+        return
+
+    # [HEARTBEAT] Task đang có heartbeat: worker khác đang chạy, hoặc worker cũ vừa chết và khởi động
+    # lại trước khi heartbeat hết hạn -> thử lại sau HEARTBEAT_TTL giây (không ack bỏ message)
+    heartbeat = resume.TaskHeartbeat(task_db)
+    if not heartbeat.start():
+        print(f"⏭️ TASK ĐANG CÓ HEARTBEAT, THỬ LẠI SAU {settings.HEARTBEAT_TTL}s: {task_db.id}")
+        raise self.retry(
+            countdown=settings.HEARTBEAT_TTL, max_retries=None,
+            queue=site_policy.queue_for(task_db.url), priority=scheduling.priority_for(task_db),
+        )
+
+    # [GIỚI HẠN THEO SITE] Hết slot/token -> trả task về queue của site, không giữ luồng worker để chờ
+    wait = site_policy.admit(task_db)
+    if wait:
+        heartbeat.stop()
+        metrics.inc('hust_site_throttled_total', site=site_policy.site_for(task_db.url))
+        print(f"🚦 SITE THROTTLED ({site_policy.site_for(task_db.url)}), THỬ LẠI SAU {wait:.1f}s: {task_db.id}")
+        raise self.retry(
+            countdown=wait, max_retries=None,
+            queue=site_policy.queue_for(task_db.url), priority=scheduling.priority_for(task_db),
+        )
+
+    # [XỬ LÝ URL THREADS/INSTAGRAM] + cắt bỏ tham số tracking (?si=...)
+    task_db.url = normalize_url(task_db.url)
+
+    # Cập nhật trạng thái: Đang tải
+    task_db.status = 'DOWNLOADING'
+    task_db.save()
+    progress.publish(task_db)
+
+    # Tạo thư mục nếu chưa có
+    if not os.path.exists(DOWNLOAD_DIR):
+        os.makedirs(DOWNLOAD_DIR)
+
+    # [RESUME] Thư mục tạm riêng của task: còn file dở từ lần chạy trước thì tải tiếp
+    resumed = resume.prepare_resume(task_db.id)
+    storage.register(storage.parts_name(task_db.id))
+    if resumed:
+        print(f"♻️ RESUME: Tìm thấy dữ liệu tải dở của task {task_db.id}")
+
+    # Hàm cập nhật tiến trình (Hook)
+    # Tiến trình chi tiết đi qua Redis (có throttle), DB chỉ ghi khi đổi trạng thái
+    reporter = progress.ProgressReporter(task_db)
+    opts = build_opts(task_db, progress_hooks=[reporter.hook])
+    policy = site_policy.policy_for(task_db.url)
+
+    # [STAGE 1 - TẢI] Chỉ tải, phần ghép/convert để cho queue 'postprocess'
+    download_params = None
+    extractor = None
+    try:
+        with YDL_SESSIONS.session(
+            pipeline.FetchOnlyYoutubeDL,
+            opts,
+            tuner=DOWNLOADER_TUNER,
+            aria2c_path=ARIA2C_PATH,
+            aria2c_args=policy['aria2c_args'],
+            allow_parallel=policy['aria2c'],
+            sidecar_cache=SIDECAR_CACHE,
+            sidecar_workers=settings.SIDECAR_WORKERS,
+        ) as ydl:
+            # Giữ list của riêng task này: ra khỏi with, ydl về pool và có thể đã phục vụ task khác
+            download_params = ydl.download_params
+            sidecar_stats = ydl.sidecar_stats
             print(f"🔗 Processing URL: {task_db.url}")
             
-            info = ydl.extract_info(task_db.url, download=True)
+            # Extract (hoặc lấy từ cache) rồi mới chọn format + tải
+            started = time.monotonic()
+            info, from_cache = extract_cache.extract_with_source(ydl, task_db.url, EXTRACT_CACHE)
+            extractor = _extractor(task_db, info)
+            metrics.observe('hust_extract_seconds', time.monotonic() - started, extractor=extractor)
+            metrics.inc('hust_extract_cache_total', result='hit' if from_cache else 'miss')
+            if info:
+                with metrics.Timer('hust_download_seconds', extractor=extractor):
+                    info = ydl.process_ie_result(info, download=True)
             
-            if not info:
+            if not info or not ydl.deferred_jobs:
                  raise Exception("Khong lay duoc thong tin video (Info is None)")
 
-            # Xác định tên file cuối cùng
-            if 'requested_downloads' in info:
-                final_file = info['requested_downloads'][0]['filepath']
-            else:
-                final_file = ydl.prepare_filename(info)
-                # Fix lỗi đuôi file sau khi convert (đôi khi yt-dlp trả về .webm nhưng đã convert sang .mp3)
-                base, _ = os.path.splitext(final_file)
-                if task_db.task_type == 'audio': 
-                    final_file = f"{base}.{task_db.audio_format}"
-                elif task_db.container == 'mp4' and not final_file.endswith('.mp4'):
-                    final_file = f"{base}.mp4"
-
-            # [QUAN TRỌNG] Chỉ lưu tên file (filename) vào DB, không lưu đường dẫn tuyệt đối
-            # Để urls.py có thể ghép với MEDIA_URL
-            task_db.filename = os.path.basename(final_file)
-            
-            task_db.status = 'FINISHED'
-            task_db.progress = 100.0
-            task_db.save()
-            print(f"✅ DONE: {task_db.filename}")
+            pipeline.save_jobs(resume.work_dir(task_db.id), ydl.deferred_jobs, resumed=resumed)
+
+        # Dữ liệu đã tải nằm chờ stage 2 cũng tính vào ngân sách đĩa
+        storage.register(storage.parts_name(task_db.id))
+        storage.enforce()
+
+        # Tải xong -> chờ slot CPU ở queue hậu xử lý
+        task_db.status = 'DOWNLOADED'
+        task_db.download_params = download_params
+        task_db.save(update_fields=['status', 'download_params'])
+        progress.publish(task_db)
+        metrics.record_download_params(download_params, extractor)
+        for result, count in sidecar_stats.items():
+            if count:
+                metrics.inc('hust_sidecar_cache_total', count, result=result)
+        heartbeat.stop()  # Nhả heartbeat trước để stage 2 giành được
+        enqueue_postprocess(task_db)
+        print(f"📦 FETCHED, QUEUED FOR POST-PROCESSING: {task_db.id}")
 
     except Exception as e:
-        task_db.status = 'FAILED'
-        task_db.save()
+        if download_params is not None:
+            task_db.download_params = download_params
+        _mark_failed(task_db, e, extractor=extractor, stage='download')
+        storage.purge_parts(task_db.id)
         print(f"❌ ERROR DOWNLOAD: {str(e)}")
+    finally:
+        heartbeat.stop()
+        site_policy.release(task_db)
+
+
+# Stage 2: giới hạn theo số core (xem supervisord.conf), CPU-bound nên không cần nhiều slot
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def postprocess_download_task(self, db_task_id):
+    try:
+        task_db = DownloadTask.objects.get(id=db_task_id)
+    except DownloadTask.DoesNotExist:
+        return "Task not found"
+
+    if task_db.status not in POSTPROCESS_STATUSES:
+        print(f"⏭️ TASK KHÔNG CHỜ HẬU XỬ LÝ ({task_db.status}): {task_db.id}")
+        return "Not downloaded"
+
+    # Giống stage tải: heartbeat còn (worker khác đang chạy / worker cũ vừa chết) -> thử lại sau
+    heartbeat = resume.TaskHeartbeat(task_db)
+    if not heartbeat.start():
+        print(f"⏭️ TASK ĐANG CÓ HEARTBEAT, THỬ LẠI SAU {settings.HEARTBEAT_TTL}s: {task_db.id}")
+        raise self.retry(countdown=settings.HEARTBEAT_TTL, max_retries=None, priority=task_db.priority)
+
+    task_db.status = 'PROCESSING'
+    task_db.progress = 99.0
+    task_db.save(update_fields=['status', 'progress'])
+    progress.publish(task_db)
+
+    # [STAGE 2 - HẬU XỬ LÝ] Merge / FFmpegExtractAudio / EmbedThumbnail / SponsorBlock...
+    extractor = None
+    try:
+        jobs, resumed = pipeline.load_jobs(resume.work_dir(task_db.id))
+        if not jobs:
+            raise Exception("Khong tim thay du lieu da tai (postprocess.json)")
+        extractor = _extractor(task_db, jobs[0]['info'])
+
+        # [REMUX/TRANSCODE] Xem codec thật của stream đã tải rồi mới chọn copy hay encode.
+        # Nhiều file (playlist) thì convert song song, mỗi file 1 process ffmpeg
+        target = task_db.audio_format if task_db.task_type == 'audio' else task_db.container
+        started = time.monotonic()
+        results = pipeline.run_postprocess_batch(
+            build_opts(task_db),
+            jobs,
+            prepare=lambda ydl, job: remux.plan_postprocess(
+                ydl, job, task_db.task_type, target, task_db.audio_quality, FFPROBE_PATH
+            ),
+            max_workers=settings.POSTPROCESS_POOL_SIZE,
+            sessions=YDL_SESSIONS,
+        )
+        final_file = results[0][0]['filepath']
+        modes = {mode for _, mode in results if mode}
+        task_db.postprocess_mode = 'transcode' if 'transcode' in modes else (modes.pop() if modes else '')
+        task_db.postprocess_seconds = round(time.monotonic() - started, 2)
+        metrics.observe(
+            'hust_postprocess_seconds', task_db.postprocess_seconds,
+            extractor=extractor, mode=task_db.postprocess_mode or 'none',
+        )
+        print(f"🎞️ POST-PROCESS: {task_db.postprocess_mode or 'no merge'} in {task_db.postprocess_seconds}s")
+
+        # [KIỂM TRA TOÀN VẸN] File hỏng -> xóa sạch dữ liệu tạm
+        if not resume.verify_media(final_file, FFPROBE_PATH):
+            if os.path.exists(final_file):
+                os.remove(final_file)
+            storage.purge_parts(task_db.id)
+            if resumed:
+                # Hỏng do dữ liệu resume -> tải lại từ đầu 1 lần
+                print(f"⚠️ CORRUPT AFTER RESUME, RESTARTING: {task_db.id}")
+                # Đổi trạng thái trước rồi mới nhả heartbeat (lượt dọn task treo không gửi trùng),
+                # nhả trước khi gửi để lần chạy mới không phải chờ heartbeat hết hạn
+                task_db.status = 'PENDING'
+                task_db.save(update_fields=['status'])
+                heartbeat.stop()
+                progress.publish(task_db)
+                enqueue_fetch(task_db)
+                return
+            raise Exception("File tai ve bi loi (ffprobe khong doc duoc)")
+
+        # [QUAN TRỌNG] Chỉ lưu tên file (filename) vào DB, không lưu đường dẫn tuyệt đối
+        # Để urls.py có thể ghép với MEDIA_URL
+        _mark_finished(task_db, os.path.basename(final_file), extractor=extractor)
+        result_cache.store(task_db.fingerprint, task_db.filename)
+        storage.purge_parts(task_db.id)
+        print(f"✅ DONE: {task_db.filename}")
+
+    except Exception as e:
+        _mark_failed(task_db, e, extractor=extractor, stage='postprocess')
+        storage.purge_parts(task_db.id)
+        print(f"❌ ERROR POST-PROCESS: {str(e)}")
+    finally:
+        heartbeat.stop()
+
+
+@shared_task
+def expand_batch_task(batch_id):
+    """Bung link playlist/kênh thành danh sách video bằng extract "phẳng" (chỉ đọc danh sách, không đọc từng video)"""
+    batch = DownloadBatch.objects.filter(id=batch_id).first()
+    if not batch:
+        return "Batch not found"
+
+    opts = {
+        'extract_flat': 'in_playlist',
+        'playlistend': settings.BATCH_MAX_ITEMS,
+        'cookiefile': COOKIES.existing(),
+        'quiet': True,
+        'no_warnings': True,
+        'ignoreerrors': True,
+    }
+    try:
+        with YDL_SESSIONS.session(yt_dlp.YoutubeDL, opts) as ydl:
+            info = ydl.extract_info(normalize_url(batch.source_url), download=False)
+        if not info:
+            raise Exception("Khong lay duoc danh sach playlist")
+
+        if info.get('_type') in ('playlist', 'multi_video'):
+            urls, entries = [], []
+            for entry in info.get('entries') or []:
+                # Bỏ qua playlist lồng nhau (tab của kênh...), chỉ lấy video
+                if not entry or entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab':
+                    continue
+                url = entry.get('webpage_url') or entry.get('url')
+                if url:
+                    urls.append(url)
+                    entries.append(entry)
+        else:
+            urls, entries = [info.get('webpage_url') or batch.source_url], [info]
+
+        create_batch_tasks(batch, urls[:settings.BATCH_MAX_ITEMS], entries[:settings.BATCH_MAX_ITEMS])
+        batch.title = (info.get('title') or '')[:255]
+        batch.status = 'READY'
+        batch.save(update_fields=['title', 'status'])
+        print(f"📚 BATCH EXPANDED: {batch.id} -> {len(urls)} video")
+    except Exception as e:
+        batch.status = 'FAILED'
+        batch.save(update_fields=['status'])
+        admission.release(*admission.batch_slots(batch.id, batch.max_parallel))
+        print(f"❌ ERROR EXPAND BATCH: {str(e)}")
+        return
+
+    advance_batch(batch.id)
+
+
+@worker_ready.connect
+def announce_worker(sender=None, **kwargs):
+    """Báo danh worker cho /metrics (số worker đang sống theo nhóm fetch/postprocess)"""
+    metrics.announce_worker(getattr(sender, 'hostname', None))
+
+
+@worker_process_init.connect
+def warm_ytdlp_process(**kwargs):
+    """Worker prefork (postprocess): mỗi process con nạp sẵn extractor trước khi nhận task"""
+    YDL_SESSIONS.warm()
+
+
+@worker_ready.connect
+def warm_ytdlp(sender=None, **kwargs):
+    """Worker threads (fetch) không có process con: nạp sẵn ngay trong process chính"""
+    if not type(getattr(sender, 'pool', None)).__module__.endswith('prefork'):
+        YDL_SESSIONS.warm()
+
+
+@worker_ready.connect
+def recover_on_worker_ready(**kwargs):
+    """Worker vừa khởi động (restart/deploy/OOM): dọn ngay các task của worker cũ đã chết"""
+    recover_interrupted_tasks()
+
+
+# --- TASK TREO: WORKER CHẾT GIỮA CHỪNG (Chạy định kỳ bởi Celery Beat + lúc worker khởi động) ---
+@shared_task
+def recover_interrupted_tasks():
+    """
+    Các task đang DOWNLOADING/PROCESSING mà không còn heartbeat nghĩa là worker chạy nó đã chết
+    -> đẩy lại vào hàng đợi để tải tiếp. Task chết ở stage hậu xử lý mà file đã tải đủ thì chỉ
+    cần chạy lại stage 2. Chạy định kỳ vì heartbeat của worker chết có thể còn hạn đúng lúc
+    worker khởi động lại. (PENDING/DOWNLOADED đang nằm trong broker nên không cần đụng tới)
+    """
+    recovered = 0
+    stale = DownloadTask.objects.filter(status__in=('DOWNLOADING', 'PROCESSING'), leader__isnull=True)
+    for task_db in stale.iterator():
+        if resume.is_alive(task_db.id):
+            continue
+        jobs, _ = pipeline.load_jobs(resume.work_dir(task_db.id))
+        task_db.status = 'DOWNLOADED' if jobs else 'PENDING'
+        task_db.save(update_fields=['status'])
+        progress.publish(task_db)
+        if jobs:
+            enqueue_postprocess(task_db)
+        else:
+            enqueue_fetch(task_db)
+        recovered += 1
+        print(f"♻️ RE-ENQUEUED INTERRUPTED TASK: {task_db.id}")
+    return recovered
+
+
+# --- LÀN ƯU TIÊN: JOB CHỜ LÂU ĐƯỢC LÊN LÀN CAO HƠN (Chạy mỗi phút bởi Celery Beat) ---
+@shared_task
+def age_pending_tasks():
+    """Gửi lại job đã chờ quá lâu với priority mới, message cũ tự bỏ qua (xem core/scheduling.py)"""
+    promoted = 0
+    for task_db in scheduling.aged_tasks():
+        old_priority = task_db.priority
+        enqueue_fetch(task_db)
+        promoted += 1
+        print(f"⏫ AGING: {task_db.id} priority {old_priority} -> {task_db.priority}")
+    return promoted
 
 
 # --- TASK DỌN DẸP FILE RÁC (Chạy định kỳ bởi Celery Beat) ---
 @shared_task
 def clean_expired_files():
     """
-    Dọn dẹp các file cũ hơn 1 tiếng đồng hồ để giải phóng ổ cứng server.
+    Dọn dẹp theo index dung lượng (core/storage.py), chỉ quét thư mục mỗi STORAGE_RECONCILE_INTERVAL giây:
+    xóa file/thư mục tải dở không được dùng trong FILE_EXPIRATION giây,
+    rồi ép tổng dung lượng về dưới low watermark nếu đang vượt ngân sách.
+    File đang được gửi cho client (pin) được giữ lại.
     """
     print("🧹 STARTING CLEANUP TASK...")
-    now = time.time()
-    expiration_time = 3600  # 3600 giây = 1 tiếng
-    
-    if os.path.exists(DOWNLOAD_DIR):
-        for filename in os.listdir(DOWNLOAD_DIR):
-            filepath = os.path.join(DOWNLOAD_DIR, filename)
-            
-            if os.path.isfile(filepath):
-                file_age = now - os.path.getmtime(filepath)
-                
-                if file_age > expiration_time:
-                    try:
-                        os.remove(filepath)
-                        print(f"✅ Deleted old file: {filename}")
-                    except Exception as e:
-                        print(f"❌ Cannot delete {filename}: {e}")
-    
-    return "Cleanup Completed"
\ No newline at end of file
+    report = storage.sweep()
+    if report:
+        print(f"✅ Cleanup: {report['evicted']} mục, {report['bytes_reclaimed']} bytes")
+    return report or "Cleanup Completed"
+
+
+# --- TASK DỌN LỊCH SỬ TRONG DB (Chạy mỗi đêm bởi Celery Beat) ---
+@shared_task
+def compact_task_history():
+    """Xóa task/kết quả Celery cũ theo lô, gộp số liệu theo ngày, VACUUM SQLite khi rảnh"""
+    print("🗜️ STARTING DB COMPACTION...")
+    report = retention.compact()
+    print(
+        f"✅ Compaction: {report['tasks_deleted']} task, {report['results_deleted']} kết quả Celery, "
+        f"VACUUM: {'có' if report['vacuumed'] else 'không'} ({report['bytes_reclaimed']} bytes)"
+    )
+    return report
@@ -1,3 +1,1132 @@
-from django.test import TestCase
+import io
+import os
+import gzip
+import zlib
+import random
+import zipfile
+import json
+import time
+import unittest
+import shutil
+import datetime
+import tempfile
+import threading
+import http.server
+import socketserver
+import yt_dlp
+from unittest import mock
+from celery.exceptions import Retry
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from . import pipeline, sidecars, retention, fingerprint, delivery, remux, scheduling, admission, redis_client, singleflight, tasks, resume, site_policy, storage, zipstream, adaptive_dl, sessions, progress
+from .models import DownloadTask, DownloadBatch, DailyTaskSummary
 
-# Create your tests here.
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+# Các test đụng tới Redis (script Lua) chạy trên fakeredis[lua] (requirements-dev.txt), không cần Redis thật
+needs_fakeredis = unittest.skipUnless(fakeredis, 'cần fakeredis[lua]')
+
+
+class FakeRedisMixin:
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(redis_client, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+# --- NHẬN DIỆN NỘI DUNG (core/fingerprint.py) ---
+class FingerprintTests(SimpleTestCase):
+    def test_normalize_url_drops_tracking_params(self):
+        self.assertEqual(fingerprint.normalize_url('https://youtu.be/abc?si=XYZ&t=10#x'), 'https://youtu.be/abc?t=10')
+        self.assertEqual(
+            fingerprint.normalize_url('https://www.youtube.com/watch?v=abc&utm_source=x&feature=share'),
+            'https://www.youtube.com/watch?v=abc',
+        )
+        self.assertEqual(fingerprint.normalize_url('https://www.tiktok.com/@a/video/1?_r=1&_t=2'), 'https://www.tiktok.com/@a/video/1')
+
+    def test_normalize_url_maps_threads_domain(self):
+        self.assertEqual(
+            fingerprint.normalize_url('https://www.threads.com/@a/post/1?igshid=1'), 'https://www.threads.net/@a/post/1'
+        )
+
+    def test_same_video_and_options_share_fingerprint(self):
+        a = DownloadTask(url='https://youtu.be/dQw4w9WgXcQ?si=1', resolution='720', container='mp4')
+        b = DownloadTask(url='https://www.youtube.com/watch?v=dQw4w9WgXcQ', resolution='720', container='mp4')
+        self.assertEqual(fingerprint.task_fingerprint(a), fingerprint.task_fingerprint(b))
+
+    def test_output_options_change_fingerprint(self):
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        base = fingerprint.task_fingerprint(DownloadTask(url=url, resolution='720'))
+        self.assertNotEqual(base, fingerprint.task_fingerprint(DownloadTask(url=url, resolution='1080')))
+        self.assertNotEqual(base, fingerprint.task_fingerprint(DownloadTask(url=url, resolution='720', use_subtitle=True)))
+        # Tải audio không phụ thuộc độ phân giải
+        self.assertEqual(
+            fingerprint.task_fingerprint(DownloadTask(url=url, task_type='audio', resolution='720')),
+            fingerprint.task_fingerprint(DownloadTask(url=url, task_type='audio', resolution='1080')),
+        )
+
+
+# --- PHÁT FILE TẢI VỀ (core/delivery.py) ---
+class ParseRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(delivery._parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(delivery._parse_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(delivery._parse_range('bytes=-100', 1000), (900, 999))
+        # Khoảng vượt cuối file bị cắt, N byte cuối lớn hơn file thì lấy cả file
+        self.assertEqual(delivery._parse_range('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(delivery._parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=1000-', 'bytes=5-2', 'bytes=-', 'bytes=a-b', 'bytes=0-1,5-6'):
+            self.assertIsNone(delivery._parse_range(header, 1000), header)
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        with open(os.path.join(self.dir, 'a.mp4'), 'wb') as f:
+            f.write(bytes(range(256)) * 4)
+        patcher = mock.patch.object(delivery, 'DOWNLOAD_DIR', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ('touch', 'pin'):
+            patcher = mock.patch.object(delivery.storage, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _get(self, **headers):
+        with override_settings(MEDIA_DELIVERY='django'):
+            response = delivery.serve_file(RequestFactory().get('/', **headers), 'a.mp4')
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        if hasattr(response, 'close'):
+            response.close()
+        return response, body
+
+    def test_single_range_is_partial(self):
+        response, body = self._get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(body, bytes(range(10, 20)))
+
+    def test_unsatisfiable_range_is_416(self):
+        response, _ = self._get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_multi_range_and_other_units_get_full_body(self):
+        for header in ('bytes=0-9,20-29', 'items=0-5'):
+            response, body = self._get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(len(body), 1024)
+
+    def test_stale_if_range_gets_full_body(self):
+        response, body = self._get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body), 1024)
+
+
+# --- ZIP NHIỀU FILE (core/zipstream.py) ---
+class StoreZipTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        rng = random.Random(14)
+        self.contents = {'a.mp4': rng.randbytes(3000), 'Bài hát.mp3': rng.randbytes(1500), 'empty.txt': b''}
+        self.files = []
+        for name, data in self.contents.items():
+            path = os.path.join(self.dir, name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.files.append((name, path))
+
+    def _check(self, archive):
+        data = b''.join(archive.iter_range())
+        self.assertEqual(len(data), archive.size)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), list(self.contents))
+            for name, content in self.contents.items():
+                self.assertEqual(zf.read(name), content)
+                self.assertEqual(zf.getinfo(name).CRC, zlib.crc32(content))
+                self.assertEqual(zf.getinfo(name).compress_type, zipfile.ZIP_STORED)
+        return data
+
+    def test_archive_reads_back(self):
+        self._check(zipstream.StoreZip(self.files + [('a.mp4', self.files[0][1])]))
+
+    def test_zip64_path(self):
+        with mock.patch.object(zipstream, 'ZIP64_LIMIT', 1000):
+            archive = zipstream.StoreZip(self.files)
+            self.assertTrue(archive.entries[0].zip64)
+            self.assertTrue(archive.zip64_end)
+            self._check(archive)
+
+    def test_random_ranges_match_full_stream(self):
+        full = b''.join(zipstream.StoreZip(self.files).iter_range())
+        rng = random.Random(0)
+        for _ in range(200):
+            start = rng.randrange(len(full))
+            end = rng.randrange(start, len(full))
+            # Archive mới (chưa biết CRC): Range bắt đầu sau phần dữ liệu vẫn phải ra đúng descriptor/central
+            archive = zipstream.StoreZip(self.files)
+            self.assertEqual(b''.join(archive.iter_range(start, end)), full[start:end + 1], (start, end))
+
+    def test_crc_cache_is_used(self):
+        cache = {}
+        archive = zipstream.StoreZip(self.files, crc_set=lambda e, crc: cache.__setitem__(e.path, crc))
+        full = b''.join(archive.iter_range())
+        self.assertEqual(cache[self.files[0][1]], zlib.crc32(self.contents['a.mp4']))
+        with mock.patch.object(zipstream, 'file_crc32', side_effect=AssertionError('đọc lại file')):
+            archive = zipstream.StoreZip(self.files, crc_get=lambda e: cache.get(e.path))
+            tail = b''.join(archive.iter_range(archive.cd_offset))
+        self.assertEqual(tail, full[archive.cd_offset:])
+
+
+# --- CHỌN SỐ KẾT NỐI ARIA2C (core/adaptive_dl.py) ---
+class DownloaderTunerTests(SimpleTestCase):
+    MB = 1024 * 1024
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.tuner = adaptive_dl.DownloaderTuner(cache_dir=self.dir)
+
+    def _seed(self, **bps):
+        for profile, value in bps.items():
+            self.tuner.record('cdn.com', profile, True, 10 * self.MB, 10 * self.MB / value)
+
+    def test_host_group(self):
+        self.assertEqual(adaptive_dl.host_group('https://rr3---sn-abc.googlevideo.com/videoplayback'), 'googlevideo.com')
+        self.assertEqual(adaptive_dl.host_group('http://10.0.0.1:8080/a.mp4'), '10.0.0.1')
+
+    def test_policy_and_small_files_use_native(self):
+        self.assertEqual(self.tuner.choose('cdn.com', 100 * self.MB, allow_parallel=False), ('native', 'policy'))
+        self.assertEqual(self.tuner.choose('cdn.com', 1 * self.MB), ('native', 'small-file'))
+
+    def test_new_host_explores_profiles_in_order(self):
+        self.assertEqual(self.tuner.choose('cdn.com', 100 * self.MB), ('aria2c-16', 'explore'))
+        self._seed(**{'aria2c-16': 5 * self.MB})
+        self.assertEqual(self.tuner.choose('cdn.com'), ('aria2c-8', 'explore'))
+
+    def test_exploits_best_throughput(self):
+        self._seed(**{'aria2c-16': 5 * self.MB, 'aria2c-8': 9 * self.MB, 'aria2c-4': 7 * self.MB, 'native': 2 * self.MB})
+        with mock.patch.object(adaptive_dl.random, 'random', return_value=0.99):
+            self.assertEqual(self.tuner.choose('cdn.com'), ('aria2c-8', 'history'))
+        with mock.patch.object(adaptive_dl.random, 'random', return_value=0.0), \
+                mock.patch.object(adaptive_dl.random, 'choice', side_effect=lambda names: names[-1]):
+            self.assertEqual(self.tuner.choose('cdn.com'), ('native', 'explore'))
+
+    def test_failing_profiles_are_dropped(self):
+        self._seed(**{'aria2c-16': 5 * self.MB, 'aria2c-8': 9 * self.MB, 'aria2c-4': 7 * self.MB, 'native': 2 * self.MB})
+        for _ in range(3):
+            self.tuner.record('cdn.com', 'aria2c-8', False)
+        with mock.patch.object(adaptive_dl.random, 'random', return_value=0.99):
+            self.assertEqual(self.tuner.choose('cdn.com'), ('aria2c-4', 'history'))
+        for profile in ('aria2c-16', 'aria2c-4', 'native'):
+            for _ in range(3):
+                self.tuner.record('cdn.com', profile, False)
+        self.assertEqual(self.tuner.choose('cdn.com'), ('native', 'errors'))
+
+    def test_ewma_update(self):
+        self.tuner.record('cdn.com', 'native', True, 10 * self.MB, 10)
+        self.tuner.record('cdn.com', 'native', True, 20 * self.MB, 10)
+        stats = self.tuner.stats('cdn.com')['native']
+        self.assertAlmostEqual(stats['bps'], 0.3 * 2 * self.MB + 0.7 * self.MB)
+        # Mẫu quá nhỏ không tính tốc độ, lỗi chỉ đổi tỉ lệ lỗi
+        self.tuner.record('cdn.com', 'native', True, 1000, 0.001)
+        self.tuner.record('cdn.com', 'native', False)
+        stats = self.tuner.stats('cdn.com')['native']
+        self.assertAlmostEqual(stats['bps'], 0.3 * 2 * self.MB + 0.7 * self.MB)
+        self.assertAlmostEqual(stats['err'], 0.3)
+        self.assertEqual(stats['n'], 4)
+
+    def test_json_file_fallback_persists_and_expires(self):
+        self.tuner.record('cdn.com', 'native', True, 10 * self.MB, 10)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, adaptive_dl.STATS_FILE)))
+        self.assertIn('native', adaptive_dl.DownloaderTuner(cache_dir=self.dir).stats('cdn.com'))
+        with mock.patch.object(adaptive_dl.time, 'time', return_value=time.time() + adaptive_dl.STATS_TTL + 1):
+            self.assertEqual(adaptive_dl.DownloaderTuner(cache_dir=self.dir).stats('cdn.com'), {})
+        # Không có Redis lẫn thư mục: không lưu gì, không lỗi
+        adaptive_dl.DownloaderTuner().record('cdn.com', 'native', True, 10 * self.MB, 10)
+        self.assertEqual(adaptive_dl.DownloaderTuner().stats('cdn.com'), {})
+
+    def test_aria2c_failure_falls_back_to_native(self):
+        calls = []
+
+        def stock_dl(ydl, name, info, subtitle=False, test=False):
+            aria2c = bool(ydl.params.get('external_downloader'))
+            calls.append(aria2c)
+            if aria2c:
+                raise yt_dlp.utils.DownloadError('HTTP Error 403')
+            return True, True
+
+        name = os.path.join(self.dir, 'v.mp4')
+        with open(name + '.part.aria2', 'w'):
+            pass
+        info = {'url': 'https://rr1---sn-x.googlevideo.com/videoplayback', 'protocol': 'https',
+                'format_id': '137', 'filesize': 100 * self.MB}
+        with mock.patch.object(yt_dlp.YoutubeDL, 'dl', stock_dl):
+            ydl = adaptive_dl.AdaptiveYoutubeDL({'quiet': True}, tuner=self.tuner, aria2c_path='/usr/bin/aria2c')
+            self.assertEqual(ydl.dl(name, info), (True, True))
+        self.assertEqual(calls, [True, False])
+        self.assertEqual([(p['profile'], p['ok']) for p in ydl.download_params], [('aria2c-16', False), ('native', True)])
+        self.assertFalse(os.path.exists(name + '.part.aria2'))
+        self.assertEqual(self.tuner.stats('googlevideo.com')['aria2c-16']['err'], 0.3)
+        # Tham số downloader của instance được trả lại như cũ
+        self.assertIsNone(ydl.params.get('external_downloader'))
+
+
+# --- DÙNG LẠI YOUTUBEDL (core/sessions.py) ---
+class _ResetYoutubeDL(yt_dlp.YoutubeDL):
+    resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+
+class SessionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.pool = sessions.SessionPool()
+        self.addCleanup(self.pool.close)
+
+    def _opts(self, **extra):
+        return {'quiet': True, 'postprocessor_args': {'ffmpeg': ['-v', 'error']}, **extra}
+
+    def test_params_reset_from_base_on_checkout(self):
+        with self.pool.session(_ResetYoutubeDL, self._opts(paths={'home': 'a'})) as ydl:
+            first = ydl
+            # Task trước sửa params tại chỗ (core/remux.py, adaptive_dl)
+            ydl.params['postprocessor_args']['merger+ffmpeg'] = ['-c', 'copy']
+            ydl.params['postprocessor_args']['ffmpeg'].append('-y')
+            ydl.params['external_downloader'] = {'default': 'aria2c'}
+            ydl.params['format'] = 'worst'
+        with self.pool.session(_ResetYoutubeDL, self._opts(paths={'home': 'b'})) as ydl:
+            self.assertIs(ydl, first)
+            self.assertEqual(ydl.params['postprocessor_args'], {'ffmpeg': ['-v', 'error']})
+            self.assertNotIn('external_downloader', ydl.params)
+            self.assertNotIn('format', ydl.params)
+            self.assertEqual(ydl.params['paths'], {'home': 'b'})
+            self.assertEqual(ydl.resets, 2)
+        self.assertEqual((self.pool.stats['created'], self.pool.stats['reused']), (1, 1))
+
+    def test_progress_hooks_follow_current_task(self):
+        seen_a, seen_b = [], []
+        with self.pool.session(yt_dlp.YoutubeDL, self._opts(progress_hooks=[seen_a.append])) as ydl:
+            for hook in ydl._progress_hooks:
+                hook({'status': 'a'})
+        with self.pool.session(yt_dlp.YoutubeDL, self._opts(progress_hooks=[seen_b.append])) as ydl:
+            for hook in ydl._progress_hooks:
+                hook({'status': 'b'})
+        self.assertEqual([d['status'] for d in seen_a], ['a'])
+        self.assertEqual([d['status'] for d in seen_b], ['b'])
+
+    def test_failed_task_instance_is_not_reused(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.session(yt_dlp.YoutubeDL, self._opts()) as ydl:
+                first = ydl
+                raise RuntimeError('boom')
+        with self.pool.session(yt_dlp.YoutubeDL, self._opts()) as ydl:
+            self.assertIsNot(ydl, first)
+        self.assertEqual(self.pool.stats['closed'], 1)
+
+    def test_cookie_file_recheck_interval(self):
+        path = os.path.join(self.dir, 'cookies.txt')
+        cookies = sessions.CookieFile(path, check_interval=5.0)
+        with mock.patch.object(sessions.time, 'monotonic', return_value=100.0):
+            self.assertIsNone(cookies.version())
+            with open(path, 'w') as f:
+                f.write('# Netscape HTTP Cookie File\n')
+            # Chưa tới lượt kiểm tra lại: vẫn là kết quả cũ
+            self.assertIsNone(cookies.existing())
+        with mock.patch.object(sessions.time, 'monotonic', return_value=104.9):
+            self.assertIsNone(cookies.version())
+        with mock.patch.object(sessions.time, 'monotonic', return_value=105.0):
+            self.assertIsNotNone(cookies.version())
+            self.assertEqual(cookies.existing(), path)
+
+    def test_changed_cookie_file_is_reloaded(self):
+        path = os.path.join(self.dir, 'cookies.txt')
+        with open(path, 'w') as f:
+            f.write('# Netscape HTTP Cookie File\n')
+        pool = sessions.SessionPool(cookies=sessions.CookieFile(path, check_interval=0))
+        self.addCleanup(pool.close)
+        with pool.session(yt_dlp.YoutubeDL, self._opts(cookiefile=path)) as ydl:
+            self.assertEqual(len(ydl.cookiejar), 0)
+        with open(path, 'a') as f:
+            f.write('.example.com\tTRUE\t/\tFALSE\t4102444800\tsid\tabc\n')
+        os.utime(path, ns=(time.time_ns() + 10 ** 9,) * 2)
+        with pool.session(yt_dlp.YoutubeDL, self._opts(cookiefile=path)) as ydl:
+            self.assertEqual([c.value for c in ydl.cookiejar], ['abc'])
+        self.assertEqual(pool.stats['cookie_reloads'], 1)
+
+
+# --- GHÉP THEO CODEC (core/remux.py) ---
+class MergePlanTests(SimpleTestCase):
+    TRANSCODE_MP4 = ('transcode', ['-c:v', 'copy', '-c:a', 'aac'])
+    TRANSCODE_WEBM = ('transcode', ['-c:v', 'copy', '-c:a', 'libopus'])
+
+    @staticmethod
+    def _info(*acodecs):
+        # Video (không audio) + các stream audio, giống requested_formats của yt-dlp
+        formats = [{'vcodec': 'avc1.640028', 'acodec': 'none'}]
+        formats += [{'vcodec': 'none', 'acodec': acodec} for acodec in acodecs]
+        return {'requested_formats': formats}
+
+    def test_copy_or_transcode_per_container_and_codec(self):
+        cases = [
+            ('mp4', ('mp4a.40.2',), ('remux', [])),
+            ('mp4', ('mp3',), ('remux', [])),
+            ('mp4', ('ac-3',), ('remux', [])),
+            ('mp4', ('ec-3',), ('remux', [])),
+            ('mp4', ('opus',), self.TRANSCODE_MP4),
+            ('mp4', ('vorbis',), self.TRANSCODE_MP4),
+            ('mp4', ('mp4a.40.2', 'opus'), self.TRANSCODE_MP4),
+            ('webm', ('opus',), ('remux', [])),
+            ('webm', ('vorbis',), ('remux', [])),
+            ('webm', ('mp4a.40.2',), self.TRANSCODE_WEBM),
+            ('mkv', ('opus',), ('remux', [])),
+            ('mkv', ('mp4a.40.2', 'dtse'), ('remux', [])),
+        ]
+        for container, acodecs, expected in cases:
+            with self.subTest(container=container, acodecs=acodecs):
+                self.assertEqual(remux.merge_plan(self._info(*acodecs), container), expected)
+
+    def test_single_file_and_video_only(self):
+        self.assertEqual(remux.merge_plan({'acodec': 'opus'}, 'mp4'), self.TRANSCODE_MP4)
+        self.assertEqual(remux.merge_plan(self._info(), 'mp4'), ('remux', []))
+
+    def test_probed_codec_wins_over_metadata(self):
+        # Metadata ghi "mp4a" nhưng file tải về thực ra là opus -> phải encode
+        info = {'requested_formats': [{'acodec': 'mp4a.40.2', 'filepath': '/tmp/a.m4a'}]}
+        with mock.patch.object(remux, 'probe_audio_codecs', return_value=['opus']) as probe:
+            self.assertEqual(remux.merge_plan(info, 'mp4', '/usr/bin/ffprobe'), self.TRANSCODE_MP4)
+        probe.assert_called_once_with('/tmp/a.m4a', '/usr/bin/ffprobe')
+
+    def test_format_selector_prefers_matching_pair(self):
+        cases = [
+            ('720', 'mp4', 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/'
+                           'bestvideo[height<=720][ext=mp4]+bestaudio/best[height<=720][ext=mp4]/best'),
+            ('1080', 'webm', 'bestvideo[height<=1080][ext=webm]+bestaudio[ext=webm]/'
+                             'bestvideo[height<=1080][ext=webm]+bestaudio/best[height<=1080][ext=webm]/best'),
+            ('480', 'mkv', 'bestvideo[height<=480]+bestaudio/best[height<=480][ext=mkv]/best'),
+        ]
+        for resolution, container, expected in cases:
+            with self.subTest(container=container):
+                self.assertEqual(remux.format_selector(resolution, container), expected)
+
+
+# --- HẬU XỬ LÝ AUDIO (core/remux.py) ---
+class AudioPlanTests(SimpleTestCase):
+    def test_matching_codec_is_copied(self):
+        self.assertEqual(remux.audio_plan({'acodec': 'mp4a.40.2', 'abr': 129}, None, 'm4a', 'best'), ('copy', None))
+        self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 160}, None, 'opus', 'best'), ('copy', None))
+
+    def test_bitrate_capped_at_source(self):
+        self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 129.5}, None, 'mp3', 'best'), ('transcode', 130))
+        self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 160}, None, 'mp3', 'medium'), ('transcode', 128))
+        self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 12}, None, 'mp3', 'best'), ('transcode', 32))
+        # Không biết bitrate nguồn: dùng đúng mức người dùng chọn
+        self.assertEqual(remux.audio_plan({'acodec': 'opus'}, None, 'mp3', 'best'), ('transcode', 320))
+
+    def test_lossless_target_has_no_bitrate(self):
+        self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 160}, None, 'flac', 'best'), ('transcode', None))
+
+    def test_probed_stream_wins_over_info(self):
+        streams = [{'codec_name': 'aac', 'bit_rate': '96000'}]
+        with mock.patch.object(remux, '_probe_audio_streams', return_value=streams):
+            self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 160}, 'a.m4a', 'm4a', 'best', 'ffprobe'), ('copy', None))
+            self.assertEqual(remux.audio_plan({'acodec': 'opus', 'abr': 160}, 'a.m4a', 'mp3', 'best', 'ffprobe'), ('transcode', 96))
+
+
+# --- LÀN ƯU TIÊN (core/scheduling.py) ---
+@override_settings(PRIORITY_LANES=[('short', 30, 0), ('medium', 180, 3), ('long', 900, 6), ('huge', None, 9)],
+                   PRIORITY_AGING_SECONDS=120, PRIORITY_ASSUMED_BPS=1000000)
+class SchedulingTests(SimpleTestCase):
+    def test_lane_for(self):
+        self.assertEqual(scheduling.lane_for(0), ('short', 0))
+        self.assertEqual(scheduling.lane_for(30), ('short', 0))
+        self.assertEqual(scheduling.lane_for(30.1), ('medium', 3))
+        self.assertEqual(scheduling.lane_for(900), ('long', 6))
+        self.assertEqual(scheduling.lane_for(10 ** 6), ('huge', 9))
+
+    def test_priority_ages_with_wait(self):
+        now = timezone.now()
+        task = DownloadTask(estimated_cost=1000, created_at=now)
+        self.assertEqual(scheduling.priority_for(task, now), 9)
+        self.assertEqual(scheduling.priority_for(task, now + datetime.timedelta(seconds=119)), 9)
+        self.assertEqual(scheduling.priority_for(task, now + datetime.timedelta(seconds=250)), 7)
+        # Không xuống dưới 0
+        self.assertEqual(scheduling.priority_for(task, now + datetime.timedelta(hours=1)), 0)
+
+    def test_estimate_cost_uses_format_size(self):
+        task = DownloadTask(task_type='video', resolution='1080')
+        info = {'duration': 100, 'requested_formats': [{'filesize': 4000000}, {'filesize_approx': 1000000}]}
+        self.assertEqual(scheduling.estimate_cost(task, info), 5.5)
+        # Không biết format: bitrate danh nghĩa theo độ phân giải
+        no_format = scheduling.estimate_cost(task, {'duration': 100})
+        self.assertEqual(no_format, round((5000 + 160) * 1000 / 8 * 100 / 1000000 + 0.5, 1))
+        self.assertLess(
+            scheduling.estimate_cost(DownloadTask(task_type='audio'), {'duration': 100}), no_format
+        )
+
+
+# --- THUMBNAIL / PHỤ ĐỀ SONG SONG (core/sidecars.py) ---
+class _SidecarHandler(http.server.BaseHTTPRequestHandler):
+    BODIES = {'/v.mp4': b'\0' * 50000, '/t.jpg': b'JPEGDATA', '/en.vtt': b'WEBVTT\n\nen', '/vi.vtt': b'WEBVTT\n\nvi'}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        body = self.BODIES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _SidecarServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class ParallelSidecarsTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.server = _SidecarServer(('127.0.0.1', 0), _SidecarHandler)
+        self.server.hits = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.cache = sidecars.SidecarCache(os.path.join(self.tmp, 'cache'), max_age=60)
+
+    def _info(self):
+        return {
+            'id': 'abc123', 'title': 'Test', 'extractor': 'fake', 'extractor_key': 'Fake', 'webpage_url': self.base,
+            'url': self.base + '/v.mp4', 'ext': 'mp4', 'format_id': '0',
+            'thumbnails': [{'url': self.base + '/t.jpg', 'id': '0'}, {'url': self.base + '/missing.jpg', 'id': '1'}],
+            'subtitles': {
+                'en-US': [{'url': self.base + '/en.vtt', 'ext': 'vtt'}],
+                'vi': [{'url': self.base + '/vi.vtt', 'ext': 'vtt'}],
+            },
+        }
+
+    def _download(self):
+        opts = {
+            'paths': {'home': os.path.join(self.tmp, 'home'), 'temp': os.path.join(self.tmp, 'work')},
+            'outtmpl': '%(title)s [%(id)s].%(ext)s', 'quiet': True, 'noprogress': True, 'no_warnings': True, 'overwrites': True,
+            'writethumbnail': True, 'writesubtitles': True, 'subtitleslangs': ['vi', 'en'],
+        }
+        self.server.hits.clear()
+        with pipeline.FetchOnlyYoutubeDL(opts, sidecar_cache=self.cache, sidecar_workers=4) as ydl:
+            ydl.process_ie_result(self._info(), download=True)
+            return ydl.deferred_jobs[0], dict(ydl.sidecar_stats)
+
+    def test_stock_signatures_match_installed_yt_dlp(self):
+        self.assertEqual(sidecars.INCOMPATIBLE, [])
+
+    def test_detects_changed_signatures(self):
+        class Changed:
+            def process_subtitles(self, video_id, normal_subtitles, automatic_captions):
+                pass
+
+            def _write_subtitles(self, info_dict, filename, extra):
+                pass
+
+            def process_info(self, info_dict):
+                pass
+
+        self.assertEqual(sidecars._incompatible_overrides(Changed), ['_write_subtitles', '_write_thumbnails'])
+
+    def test_writes_sidecars_then_hits_cache(self):
+        job, stats = self._download()
+        self.assertEqual(stats, {'hit': 0, 'miss': 3})
+        self.assertIn('/t.jpg', self.server.hits)
+        self.assertIn('/en.vtt', self.server.hits)
+        subs = job['info']['requested_subtitles']
+        self.assertEqual(sorted(subs), ['en-US', 'vi'])
+        moved = sorted(os.path.basename(f) for f in job['files_to_move'])
+        self.assertEqual(moved, ['Test [abc123].en-US.vtt', 'Test [abc123].jpg', 'Test [abc123].vi.vtt'])
+        self.assertTrue(all(os.path.exists(f) for f in job['files_to_move']))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmp, 'cache', 'Fake-abc123'))),
+            ['sub.en-US.vtt', 'sub.vi.vtt', 'thumb.jpg'],
+        )
+
+        # Lần 2 (cùng video): file phụ lấy từ cache, chỉ còn tải file chính
+        job, stats = self._download()
+        self.assertEqual(stats, {'hit': 3, 'miss': 0})
+        self.assertEqual(self.server.hits, ['/v.mp4'])
+        self.assertEqual(len(job['files_to_move']), 3)
+        self.assertTrue(all(os.path.exists(f) for f in job['files_to_move']))
+
+
+# --- DỌN LỊCH SỬ TASK (core/retention.py) ---
+class CompactTasksTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+        for i in range(5):
+            DownloadTask.objects.create(
+                url=f'https://www.youtube.com/watch?v={i}', status='FAILED' if i == 0 else 'FINISHED',
+                error='ERROR: [youtube] abc: Video unavailable. This video is private' if i == 0 else '',
+                download_params=[{'bytes': 100}], postprocess_seconds=1.0,
+            )
+        DownloadTask.objects.update(created_at=timezone.now() - datetime.timedelta(days=30))
+        DownloadTask.objects.create(url='https://www.youtube.com/watch?v=new', status='FINISHED')
+
+    def _archived_lines(self):
+        lines = []
+        for name in os.listdir(self.archive_dir):
+            with gzip.open(os.path.join(self.archive_dir, name), 'rt', encoding='utf-8') as f:
+                lines += f.readlines()
+        return lines
+
+    def _compact(self):
+        report = {'tasks_deleted': 0, 'batches_deleted': 0}
+        with override_settings(TASK_RETENTION_DAYS=7, COMPACTION_BATCH_SIZE=2, TASK_ARCHIVE_DIR=self.archive_dir):
+            retention.compact_tasks(report)
+        return report
+
+    def test_summarizes_archives_and_deletes_old_tasks(self):
+        self.assertEqual(self._compact()['tasks_deleted'], 5)
+        self.assertEqual(DownloadTask.objects.count(), 1)
+        summary = DailyTaskSummary.objects.get()
+        self.assertEqual((summary.total, summary.finished, summary.failed), (5, 4, 1))
+        self.assertEqual(summary.bytes_downloaded, 500)
+        self.assertEqual(summary.sites, {'youtube': 5})
+        self.assertEqual(summary.failure_reasons, {'[youtube] Video unavailable': 1})
+        self.assertEqual(len(self._archived_lines()), 5)
+
+    def test_rolled_back_batch_is_not_archived(self):
+        with mock.patch.object(retention, '_merge_summary', side_effect=RuntimeError('db error')):
+            with self.assertRaises(RuntimeError):
+                self._compact()
+        self.assertEqual(DownloadTask.objects.count(), 6)
+        self.assertEqual(self._archived_lines(), [])
+
+        # Chạy lại: mỗi task chỉ có đúng 1 bản trong archive
+        self._compact()
+        self.assertEqual(len(self._archived_lines()), 5)
+
+
+# --- HEARTBEAT + KHÔI PHỤC TASK BỊ NGẮT (core/resume.py, core/tasks.py) ---
+@needs_fakeredis
+@override_settings(HEARTBEAT_TTL=90)
+class HeartbeatTests(FakeRedisMixin, TestCase):
+    def _task(self, **fields):
+        return DownloadTask.objects.create(url='https://www.youtube.com/watch?v=a', **fields)
+
+    def test_only_one_heartbeat_per_task(self):
+        task = self._task()
+        first = resume.TaskHeartbeat(task)
+        self.assertTrue(first.start())
+        self.addCleanup(first.stop)
+        self.assertTrue(resume.is_alive(task.id))
+        self.assertLessEqual(self.redis.ttl(resume._heartbeat_key(task.id)), 90)
+        self.assertFalse(resume.TaskHeartbeat(task).start())
+        first.stop()
+        self.assertFalse(resume.is_alive(task.id))
+
+    def test_second_stop_keeps_next_stage_heartbeat(self):
+        task = self._task()
+        fetch = resume.TaskHeartbeat(task)
+        self.assertTrue(fetch.start())
+        fetch.stop()
+        # Stage 2 giành heartbeat giữa 2 lần stop() của stage tải (stop trước enqueue + stop trong finally)
+        postprocess = resume.TaskHeartbeat(task)
+        self.assertTrue(postprocess.start())
+        self.addCleanup(postprocess.stop)
+        fetch.stop()
+        self.assertTrue(resume.is_alive(task.id))
+        self.assertEqual(self.redis.get(resume._heartbeat_key(task.id)), postprocess.owner)
+
+    def test_stop_never_deletes_foreign_heartbeat(self):
+        task = self._task()
+        mine = resume.TaskHeartbeat(task)
+        self.assertTrue(mine.start())
+        # Heartbeat hết hạn (worker treo lâu), lượt chạy khác đã giành key
+        self.redis.set(resume._heartbeat_key(task.id), 'other-host:1:abc', ex=90)
+        mine.stop()
+        self.assertEqual(self.redis.get(resume._heartbeat_key(task.id)), 'other-host:1:abc')
+
+    def test_redelivered_message_retries_while_heartbeat_held(self):
+        task = self._task()
+        self.redis.set(resume._heartbeat_key(task.id), 'other-worker', ex=90)
+        with mock.patch.object(tasks.process_download_task, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                tasks.process_download_task(task.id)
+        self.assertEqual(retry.call_args.kwargs['countdown'], 90)
+        self.assertIsNone(retry.call_args.kwargs['max_retries'])
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'PENDING')
+
+    def test_finished_task_is_not_fetched_again(self):
+        task = self._task(status='FINISHED')
+        self.assertEqual(tasks.process_download_task(task.id), 'Already fetched')
+
+    def test_recover_skips_live_tasks_and_requeues_dead_ones(self):
+        fetching = self._task(status='DOWNLOADING')
+        processing = self._task(status='PROCESSING')
+        self.redis.set(resume._heartbeat_key(fetching.id), 'worker', ex=90)
+
+        def jobs(work_dir):
+            # Chỉ task hậu xử lý có việc stage 2 còn nợ trong thư mục tạm
+            return ([{}], False) if work_dir == resume.work_dir(processing.id) else (None, False)
+
+        with mock.patch.object(tasks, 'enqueue_fetch') as enqueue_fetch, \
+                mock.patch.object(tasks, 'enqueue_postprocess') as enqueue_postprocess, \
+                mock.patch.object(tasks.pipeline, 'load_jobs', side_effect=jobs):
+            self.assertEqual(tasks.recover_interrupted_tasks(), 1)
+            enqueue_postprocess.assert_called_once()
+            self.redis.delete(resume._heartbeat_key(fetching.id))
+            self.assertEqual(tasks.recover_interrupted_tasks(), 1)
+            enqueue_fetch.assert_called_once()
+        fetching.refresh_from_db()
+        processing.refresh_from_db()
+        self.assertEqual((fetching.status, processing.status), ('PENDING', 'DOWNLOADED'))
+
+
+# --- TIẾN TRÌNH QUA REDIS (core/progress.py) ---
+@needs_fakeredis
+@override_settings(PROGRESS_MIN_INTERVAL=1.0, PROGRESS_MIN_DELTA=1.0, PROGRESS_HEARTBEAT=5.0)
+class ProgressReporterTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = 1000.0
+        patcher = mock.patch.object(progress.time, 'monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hooks_are_throttled_and_status_saved_once(self):
+        task = DownloadTask.objects.create(url='https://www.youtube.com/watch?v=a')
+        reporter = progress.ProgressReporter(task)
+        total = 100 * 1024 * 1024
+        with mock.patch.object(progress, 'publish', wraps=progress.publish) as publish:
+            # Lần gọi đầu đổi trạng thái -> lưu DB 1 lần, sau đó chỉ ghi Redis
+            with self.assertNumQueries(1):
+                # 1000 callback trong 10 giây, % tăng đều
+                for i in range(1, 1001):
+                    self.clock += 0.01
+                    reporter.hook({'status': 'downloading', 'downloaded_bytes': total * i // 1000,
+                                   'total_bytes': total, 'speed': 1e7, 'eta': 1})
+            self.assertLessEqual(publish.call_count, 12)
+            self.assertGreaterEqual(publish.call_count, 10)
+
+            # % đứng yên: chỉ đẩy lại mỗi PROGRESS_HEARTBEAT giây
+            publish.reset_mock()
+            for _ in range(100):
+                self.clock += 0.1
+                reporter.hook({'status': 'downloading', 'downloaded_bytes': total, 'total_bytes': total})
+            self.assertEqual(publish.call_count, 2)
+
+            reporter.hook({'status': 'finished'})
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'DOWNLOADING')
+        self.assertEqual(progress.read(task.id)['progress'], 100.0)
+        self.assertEqual(progress.read(task.id)['status'], 'DOWNLOADING')
+
+    def test_follower_reads_leader_state(self):
+        leader = DownloadTask.objects.create(url='https://x.com/1', status='PROCESSING', progress=99.0)
+        progress.publish(leader)
+        progress.follow('follower', leader.id)
+        self.assertEqual(progress.read('follower')['status'], 'PROCESSING')
+        self.assertEqual(progress.read_many(['follower', leader.id, 'missing']), {
+            'follower': progress.read(leader.id), str(leader.id): progress.read(leader.id),
+        })
+
+
+# --- NGÂN SÁCH ĐĨA + LRU (core/storage.py) ---
+@needs_fakeredis
+@override_settings(
+    STORAGE_BUDGET_BYTES=1000, STORAGE_HIGH_WATERMARK=0.9, STORAGE_LOW_WATERMARK=0.5, STORAGE_MIN_FREE_BYTES=0,
+    FILE_EXPIRATION=3600, STORAGE_RECONCILE_INTERVAL=600,
+)
+class StorageTests(FakeRedisMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        for module, name, value in (
+            (storage, 'DOWNLOAD_DIR', self.dir),
+            (storage, 'SIDECARS_DIR', os.path.join(self.dir, '.sidecars')),
+            (resume, 'PARTS_DIR', os.path.join(self.dir, '.parts')),
+        ):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.now = time.time()
+
+    def _write(self, name, size=250):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def _add(self, *names, age=0):
+        for i, name in enumerate(names):
+            self._write(name)
+            storage.register(name, atime=self.now - age - len(names) + i)
+
+    def _left(self):
+        return sorted(n for n in os.listdir(self.dir) if not n.startswith('.'))
+
+    def test_under_high_watermark_keeps_everything(self):
+        self._add('a', 'b', 'c')
+        self.assertIsNone(storage.enforce())
+        self.assertEqual(storage.usage()['used_bytes'], 750)
+
+    def test_evicts_least_recently_used_down_to_low_watermark(self):
+        self._add('a', 'b', 'c', 'd')
+        storage.touch('a')
+        report = storage.enforce()
+        self.assertEqual(report['files'], ['b', 'c'])
+        self.assertEqual(self._left(), ['a', 'd'])
+        self.assertEqual(storage.usage()['used_bytes'], 500)
+
+    def test_pinned_files_are_skipped(self):
+        self._add('a', 'b', 'c', 'd')
+        token = storage.pin(['a'])
+        report = storage.enforce()
+        self.assertEqual((report['files'], report['skipped_pinned']), (['b', 'c'], 1))
+        storage.unpin(['a'], token)
+        self.assertEqual(storage.pinned(), set())
+
+    def test_idle_sweep_removes_expired_only(self):
+        self._add('old', age=7200)
+        self._add('new')
+        report = storage.enforce(reason='sweep', idle=True)
+        self.assertEqual(report['files'], ['old'])
+        self.assertEqual(self._left(), ['new'])
+
+    def test_parts_of_live_task_are_kept(self):
+        self._write('.parts/t1/video.part', 2000)
+        storage.register(storage.parts_name('t1'), atime=self.now - 7200)
+        self.redis.set(resume._heartbeat_key('t1'), 'worker', ex=90)
+        storage.enforce()
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, '.parts', 't1')))
+        self.redis.delete(resume._heartbeat_key('t1'))
+        storage.enforce()
+        self.assertFalse(os.path.exists(os.path.join(self.dir, '.parts', 't1')))
+        self.assertEqual(storage.usage()['used_bytes'], 0)
+
+    def test_sweep_reconciles_unregistered_files(self):
+        self._add('a')
+        storage.sweep()  # Chưa có index -> dựng từ đĩa
+        # File không đi qua register() (sidecar sót, file trung gian...) và file đã bị xóa ngoài index
+        self._write('.sidecars/Fake-1/thumb.jpg', 100)
+        self._write('stray.mp4', 300)
+        os.remove(os.path.join(self.dir, 'a'))
+        storage.sweep()
+        self.assertEqual(storage.usage()['used_bytes'], 250)  # Chưa tới lượt đối chiếu
+
+        self.redis.set(redis_client.key('storage', 'indexed'), int(self.now - 601))
+        self._write('b')
+        storage.register('b')
+        storage.sweep()
+        sizes = self.redis.hgetall(storage._keys()[0])
+        self.assertEqual(sizes, {'.sidecars/Fake-1/thumb.jpg': '100', 'stray.mp4': '300', 'b': '250'})
+        self.assertEqual(storage.usage()['used_bytes'], 650)
+        # Mục đã có giữ nguyên lần dùng cuối, mục mới lấy theo mtime
+        self.assertGreaterEqual(self.redis.zscore(storage._keys()[1], 'b'), self.now)
+
+
+# --- CHÍNH SÁCH THEO SITE (core/site_policy.py) ---
+@needs_fakeredis
+@override_settings(
+    SITE_POLICIES={
+        'default': {'concurrency': 10, 'rate': 100, 'burst': 100},
+        'youtube': {'domains': ['youtube.com', 'youtu.be'], 'concurrency': 1},
+        'tiktok': {'domains': ['tiktok.com'], 'rate': 0.5, 'burst': 2},
+    },
+    HEARTBEAT_TTL=90, SITE_THROTTLE_RETRY=5,
+)
+class SitePolicyTests(FakeRedisMixin, SimpleTestCase):
+    def _task(self, url):
+        return DownloadTask(url=url)
+
+    def test_site_and_queue(self):
+        self.assertEqual(site_policy.site_for('https://m.youtube.com/watch?v=a'), 'youtube')
+        self.assertEqual(site_policy.site_for('https://notyoutube.com/a'), 'default')
+        self.assertEqual(site_policy.queue_for('https://youtu.be/a'), 'fetch.youtube')
+        self.assertEqual(site_policy.queue_for('https://example.com/a'), 'fetch')
+        self.assertEqual(site_policy.policy_for('https://youtu.be/a')['rate'], 100)
+
+    def test_concurrency_semaphore(self):
+        a, b = self._task('https://youtu.be/a'), self._task('https://youtu.be/b')
+        self.assertEqual(site_policy.admit(a), 0)
+        self.assertGreaterEqual(site_policy.admit(b), 5)
+        # Task đang giữ slot xin lại (message giao lại) vẫn được
+        self.assertEqual(site_policy.admit(a), 0)
+        site_policy.release(a)
+        self.assertEqual(site_policy.admit(b), 0)
+
+    def test_slot_of_dead_worker_expires(self):
+        self.assertEqual(site_policy.admit(self._task('https://youtu.be/a')), 0)
+        with mock.patch.object(site_policy.time, 'time', return_value=time.time() + 91):
+            self.assertEqual(site_policy.admit(self._task('https://youtu.be/b')), 0)
+
+    def test_token_bucket(self):
+        now = time.time()
+        jobs = [self._task(f'https://www.tiktok.com/@a/video/{i}') for i in range(3)]
+        with mock.patch.object(site_policy.time, 'time', return_value=now):
+            self.assertEqual(site_policy.admit(jobs[0]), 0)
+            self.assertEqual(site_policy.admit(jobs[1]), 0)
+            # Hết burst: chờ ~2s cho token kế tiếp, slot vừa giữ được trả lại
+            self.assertGreaterEqual(site_policy.admit(jobs[2]), 2)
+        self.assertEqual(self.redis.zcard(site_policy._slots_key('tiktok')), 2)
+        with mock.patch.object(site_policy.time, 'time', return_value=now + 2):
+            self.assertEqual(site_policy.admit(jobs[2]), 0)
+
+
+# --- GỘP YÊU CẦU TRÙNG (core/singleflight.py) ---
+@needs_fakeredis
+class SingleflightTests(FakeRedisMixin, TestCase):
+    def _task(self, **fields):
+        return DownloadTask.objects.create(url='https://www.youtube.com/watch?v=a', fingerprint='fp', **fields)
+
+    def test_duplicate_follows_leader(self):
+        leader = self._task()
+        self.assertIsNone(singleflight.join(leader))
+        self.assertEqual(singleflight.join(self._task()), leader)
+
+    def test_lease_lives_until_leader_finishes(self):
+        leader = self._task()
+        singleflight.join(leader)
+        # Không có TTL: leader chờ lâu trong queue vẫn giữ lease
+        self.assertEqual(self.redis.ttl(singleflight._lease_key('fp')), -1)
+        follower = self._task()
+        follower.leader = singleflight.join(follower)
+        follower.save()
+
+        tasks._mark_failed(leader, 'boom')
+        self.assertIsNone(self.redis.get(singleflight._lease_key('fp')))
+        follower.refresh_from_db()
+        self.assertEqual(follower.status, 'FAILED')
+        self.assertIsNone(singleflight.join(self._task()))
+
+    def _join_then_finish(self, leader, status, **fields):
+        """singleflight.join trả về leader, rồi leader kết thúc (và settle xong) trước khi follower kịp lưu liên kết"""
+        def join(task):
+            DownloadTask.objects.filter(id=leader.id).update(status=status, **fields)
+            return leader
+        return mock.patch.object(tasks.singleflight, 'join', side_effect=join)
+
+    def test_follower_of_leader_finished_during_attach_is_settled(self):
+        leader = self._task(status='DOWNLOADING')
+        follower = DownloadTask(url=leader.url, fingerprint='fp')
+        admission.admit('alice', follower)
+        with self._join_then_finish(leader, 'FINISHED', filename='a.mp4', progress=100.0):
+            tasks.submit_task(follower)
+        self.assertEqual((follower.status, follower.filename), ('FINISHED', 'a.mp4'))
+        follower.refresh_from_db()
+        self.assertEqual((follower.status, follower.leader_id), ('FINISHED', leader.id))
+        self.assertEqual(admission.client_tasks('alice'), [])
+
+    def test_worker_follower_of_failed_leader_is_settled(self):
+        leader = self._task(status='DOWNLOADING')
+        follower = self._task()
+        with self._join_then_finish(leader, 'FAILED', error='boom'):
+            tasks.process_download_task(follower.id)
+        follower.refresh_from_db()
+        self.assertEqual((follower.status, follower.error), ('FAILED', 'boom'))
+
+    def test_lease_of_finished_leader_is_reclaimed(self):
+        stale = self._task(status='FINISHED')
+        singleflight.acquire('fp', stale.id)
+        task = self._task()
+        self.assertIsNone(singleflight.join(task))
+        self.assertEqual(self.redis.get(singleflight._lease_key('fp')), str(task.id))
+
+    def test_release_only_by_owner(self):
+        singleflight.acquire('fp', 'a')
+        singleflight.release('fp', 'b')
+        self.assertEqual(self.redis.get(singleflight._lease_key('fp')), 'a')
+        singleflight.release('fp', 'a')
+        self.assertIsNone(self.redis.get(singleflight._lease_key('fp')))
+
+
+# --- NHẬN JOB CÓ GIỚI HẠN (core/admission.py) ---
+@needs_fakeredis
+@override_settings(ADMISSION_CLIENT_LIMIT=2, ADMISSION_GLOBAL_LIMIT=3, ADMISSION_SLOT_TTL=3600)
+class AdmissionTests(FakeRedisMixin, TestCase):
+    def _task(self, url='https://www.youtube.com/watch?v=a'):
+        task = DownloadTask(url=url)
+        task.fingerprint = fingerprint.task_fingerprint(task)
+        return task
+
+    def test_client_and_global_limits(self):
+        a, b, c = (self._task(f'https://x.com/{i}') for i in range(3))
+        self.assertEqual(admission.admit('alice', a), ('ok', None))
+        self.assertEqual(admission.admit('alice', b), ('ok', None))
+        self.assertEqual(admission.admit('alice', c), ('client', None))
+        self.assertEqual(admission.admit('bob', c), ('ok', None))
+        self.assertEqual(admission.admit('bob', self._task('https://x.com/9')), ('global', None))
+        admission.release(a.id)
+        self.assertEqual(admission.admit('bob', self._task('https://x.com/9')), ('ok', None))
+
+    def test_duplicate_returns_existing_task(self):
+        first = self._task()
+        admission.admit('alice', first)
+        self.assertEqual(admission.admit('alice', self._task()), ('duplicate', str(first.id)))
+        # Client khác gửi cùng link vẫn là job riêng
+        self.assertEqual(admission.admit('bob', self._task()), ('ok', None))
+
+    def test_expired_slots_are_reclaimed(self):
+        admission.admit('alice', self._task('https://x.com/1'))
+        admission.admit('alice', self._task('https://x.com/2'))
+        with mock.patch.object(admission.time, 'time', return_value=time.time() + 3601):
+            self.assertEqual(admission.admit('alice', self._task('https://x.com/3')), ('ok', None))
+
+    def test_batch_takes_all_slots_or_none(self):
+        batch = DownloadBatch()
+        admission.admit('alice', self._task())
+        self.assertEqual(admission.admit_batch('alice', batch, 2), 'client')
+        self.assertEqual(len(admission.client_tasks('alice')), 1)
+        self.assertEqual(admission.admit_batch('alice', batch, 1), 'ok')
+        self.assertEqual(admission.admit('alice', self._task('https://x.com/1'))[0], 'client')
+        admission.release(*admission.batch_slots(batch.id, 1))
+        self.assertEqual(admission.admit('alice', self._task('https://x.com/1'))[0], 'ok')
+
+    def test_api_rejects_with_retry_after(self):
+        with mock.patch('core.views.submit_task'):
+            for i in range(2):
+                response = self.client.post('/api/start/', json.dumps({'url': f'https://x.com/{i}'}), content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post('/api/start/', json.dumps({'url': 'https://x.com/2'}), content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['reason'], 'client')
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        response = self.client.post('/api/batch/', json.dumps({'urls': ['https://x.com/3']}), content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(DownloadBatch.objects.exists())
+
+    def test_failed_submit_releases_slot(self):
+        with mock.patch('core.views.submit_task', side_effect=RuntimeError('broker down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/api/start/', json.dumps({'url': 'https://x.com/1'}), content_type='application/json')
+        self.assertEqual(self.redis.zcard(redis_client.key('admission', 'all')), 0)
+
+
+# --- BATCH: GIỚI HẠN SỐ TASK CON CHẠY CÙNG LÚC (core/tasks.py, core/views.py) ---
+@needs_fakeredis
+class BatchTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(tasks, 'enqueue_fetch')
+        self.enqueue_fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _batch(self, count, max_parallel):
+        batch = DownloadBatch.objects.create(status='READY', max_parallel=max_parallel)
+        tasks.create_batch_tasks(batch, [f'https://x.com/{i}' for i in range(count)])
+        return batch
+
+    def _statuses(self, batch):
+        return list(batch.tasks.order_by('batch_index').values_list('status', flat=True))
+
+    def test_at_most_max_parallel_leave_waiting(self):
+        batch = self._batch(5, max_parallel=2)
+        tasks.advance_batch(batch.id)
+        self.assertEqual(self._statuses(batch), ['PENDING', 'PENDING', 'WAITING', 'WAITING', 'WAITING'])
+        self.assertEqual(self.enqueue_fetch.call_count, 2)
+        # Gọi lại khi chưa có task nào xong: không đẩy thêm
+        tasks.advance_batch(batch.id)
+        self.assertEqual(self.enqueue_fetch.call_count, 2)
+
+    def test_finishing_one_promotes_next(self):
+        batch = self._batch(4, max_parallel=2)
+        tasks.advance_batch(batch.id)
+        first = batch.tasks.get(batch_index=0)
+        tasks._mark_failed(first, 'boom')
+        self.assertEqual(self._statuses(batch), ['FAILED', 'PENDING', 'PENDING', 'WAITING'])
+        self.assertEqual(self.enqueue_fetch.call_count, 3)
+
+        for task in batch.tasks.filter(status='PENDING'):
+            tasks._mark_failed(task, 'boom')
+        self.assertEqual(self._statuses(batch), ['FAILED', 'FAILED', 'FAILED', 'PENDING'])
+        self.assertEqual(self.enqueue_fetch.call_count, 4)
+
+    def test_api_starts_batch_and_reports_counts(self):
+        response = self.client.post('/api/batch/', json.dumps({
+            'urls': [f'https://x.com/{i}' for i in range(4)], 'max_parallel': 2,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        batch_id = response.json()['batch_id']
+
+        data = self.client.get(f'/api/batch/{batch_id}/').json()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(data['counts'], {'PENDING': 2, 'WAITING': 2})
+        self.assertFalse(data['finished'])
+        self.assertEqual([t['status'] for t in data['tasks']], ['PENDING', 'PENDING', 'WAITING', 'WAITING'])
+
+        # Chạy hết batch -> finished
+        batch = DownloadBatch.objects.get(id=batch_id)
+        while batch.tasks.filter(status='PENDING').exists():
+            for task in batch.tasks.filter(status='PENDING'):
+                tasks._mark_failed(task, 'boom')
+        data = self.client.get(f'/api/batch/{batch_id}/').json()
+        self.assertEqual(data['counts'], {'FAILED': 4})
+        self.assertTrue(data['finished'])
+
+    def test_missing_batch_is_404(self):
+        response = self.client.get('/api/batch/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, 404)
+
+
+# --- TRẠNG THÁI NHIỀU TASK (core/views.py bulk_status_api) ---
+@needs_fakeredis
+@override_settings(BULK_STATUS_MAX_IDS=4)
+class BulkStatusTests(FakeRedisMixin, TestCase):
+    def test_mixed_known_and_unknown_ids(self):
+        live = DownloadTask.objects.create(url='https://x.com/1', status='DOWNLOADING', progress=40.0)
+        progress.publish(live)
+        # Không có trên Redis (hết hạn) -> đọc DB; follower hiển thị tiến trình của leader
+        stored = DownloadTask.objects.create(url='https://x.com/2', status='FAILED')
+        leader = DownloadTask.objects.create(url='https://x.com/3', status='PROCESSING', progress=99.0)
+        follower = DownloadTask.objects.create(url='https://x.com/3', status='PENDING', leader=leader)
+        unknown = '00000000-0000-0000-0000-000000000000'
+
+        ids = [str(live.id), str(stored.id), str(follower.id), unknown]
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/status/', {'ids': ','.join(ids)})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['not_found'], [unknown])
+        self.assertEqual(list(data['tasks']), ids[:3])
+        self.assertEqual(data['tasks'][str(live.id)]['progress'], 40.0)
+        self.assertEqual(data['tasks'][str(stored.id)]['status'], 'FAILED')
+        self.assertEqual(data['tasks'][str(follower.id)]['status'], 'PROCESSING')
+        self.assertEqual(data['tasks'][str(follower.id)]['progress'], 99.0)
+
+    def test_post_dedupes_ids(self):
+        task = DownloadTask.objects.create(url='https://x.com/1', status='PENDING')
+        response = self.client.post('/api/status/', json.dumps({'task_ids': [str(task.id), str(task.id).upper()]}),
+                                    content_type='application/json')
+        self.assertEqual(list(response.json()['tasks']), [str(task.id)])
+
+    def test_id_limit_and_invalid_ids(self):
+        ids = [f'00000000-0000-0000-0000-00000000000{i}' for i in range(5)]
+        response = self.client.get('/api/status/', {'ids': ','.join(ids[:4])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['not_found'], ids[:4])
+        response = self.client.post('/api/status/', json.dumps({'task_ids': ids}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/status/', {'ids': 'abc'})
+        self.assertEqual(response.status_code, 400)
@@ -1,42 +1,343 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .models import DownloadTask
-from .tasks import process_download_task
+from django.utils.text import slugify
+from django.db.models import Count
+from asgiref.sync import sync_to_async
+from .models import DownloadTask, DownloadBatch
+from .tasks import submit_task, create_batch_tasks, advance_batch, expand_batch_task
+from .fingerprint import task_fingerprint
+from . import singleflight, progress, delivery, metrics, result_cache, site_policy, storage, scheduling, admission
 import json
+import time
+import uuid
+import redis
+import redis.asyncio as aioredis
 
 def index(request):
     return render(request, 'index.html')
 
+def _task_options(data):
+    """Tùy chọn tải từ request (dùng chung cho task lẻ và task con của batch)"""
+    return {
+        'task_type': data.get('task_type', 'video'),
+        'resolution': data.get('resolution', '1080'),
+        'container': data.get('container', 'mp4'),
+        'audio_format': data.get('audio_format', 'mp3'),
+        'audio_quality': data.get('audio_quality', 'best'),
+        'use_subtitle': data.get('use_subtitle', False),
+        'use_thumbnail': data.get('use_thumbnail', False),
+    }
+
+def _rejected(verdict, client):
+    """429 + Retry-After khi client/hệ thống đã hết slot nhận job (xem core/admission.py)"""
+    seconds = admission.retry_after(verdict, client)
+    metrics.inc('hust_admission_rejected_total', reason=verdict)
+    response = JsonResponse({
+        'error': 'Bạn đang có quá nhiều link chờ tải' if verdict == 'client' else 'Hệ thống đang quá tải',
+        'reason': verdict,
+        'retry_after': seconds,
+    }, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
+
 @csrf_exempt
 def start_download_api(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         
         # Tạo Task với đầy đủ tùy chọn
-        task = DownloadTask.objects.create(
-            url=data.get('url'),
-            task_type=data.get('task_type', 'video'),
-            resolution=data.get('resolution', '1080'),
-            container=data.get('container', 'mp4'),
-            audio_format=data.get('audio_format', 'mp3'),
-            audio_quality=data.get('audio_quality', 'best'),
-            use_subtitle=data.get('use_subtitle', False),
-            use_thumbnail=data.get('use_thumbnail', False),
-        )
-        
-        # Đẩy vào Celery
-        process_download_task.delay(task.id)
+        task = DownloadTask(url=data.get('url'), **_task_options(data))
+        task.fingerprint = task_fingerprint(task)
+
+        # [NHẬN JOB] Giới hạn job đang chờ/chạy theo client và toàn hệ thống, gửi lại job cũ -> trả task cũ
+        client = admission.client_id(request)
+        verdict, existing = admission.admit(client, task)
+        if verdict == 'duplicate':
+            return JsonResponse({'task_id': existing, 'duplicate': True})
+        if verdict != 'ok':
+            return _rejected(verdict, client)
+
+        # Cache hit -> xong ngay, trùng job đang chạy -> bám theo, còn lại -> đẩy vào làn ưu tiên theo
+        # tùy chọn tải, worker đọc thông tin video sau và chuyển làn nếu cần (không chờ mạng trong request)
+        try:
+            submit_task(task, probe=True)
+        except Exception:
+            # Không gửi được (DB/broker lỗi) -> trả slot ngay, không chờ slot hết hạn
+            admission.release(task.id)
+            raise
+        if task.status == 'FINISHED':
+            admission.release(task.id)
         return JsonResponse({'task_id': task.id})
 
+@csrf_exempt
+def start_batch_api(request):
+    """
+    Gửi nhiều video 1 lần:
+    - {"urls": [...]}  : danh sách link
+    - {"url": "..."}   : link playlist/kênh, worker bung ra danh sách video
+    Kèm tùy chọn tải như /api/start/ và "max_parallel" (số video tải cùng lúc).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    data = json.loads(request.body)
+
+    urls = [u.strip() for u in (data.get('urls') or []) if u and u.strip()]
+    source_url = (data.get('url') or '').strip()
+    if not urls and not source_url:
+        return JsonResponse({'error': 'Cần "urls" hoặc "url"'}, status=400)
+
+    try:
+        max_parallel = int(data.get('max_parallel') or settings.BATCH_MAX_PARALLEL)
+    except (TypeError, ValueError):
+        max_parallel = settings.BATCH_MAX_PARALLEL
+    # Batch chiếm tối đa ngần ấy slot nhận job của client (không vượt hạn mức của 1 client)
+    max_parallel = min(max(max_parallel, 1), settings.BATCH_MAX_PARALLEL_LIMIT, settings.ADMISSION_CLIENT_LIMIT)
+    urls = urls[:settings.BATCH_MAX_ITEMS]
+
+    # [NHẬN JOB] Batch giữ 1 slot cho mỗi task con chạy cùng lúc, tới khi chạy hết danh sách
+    batch = DownloadBatch(
+        source_url='' if urls else source_url,
+        status='READY' if urls else 'EXPANDING',
+        max_parallel=max_parallel,
+        options=_task_options(data),
+    )
+    client = admission.client_id(request)
+    verdict = admission.admit_batch(client, batch, min(max_parallel, len(urls)) if urls else max_parallel)
+    if verdict != 'ok':
+        return _rejected(verdict, client)
+
+    try:
+        batch.save()
+        if urls:
+            create_batch_tasks(batch, urls)
+            advance_batch(batch.id)
+        else:
+            expand_batch_task.delay(batch.id)
+    except Exception:
+        admission.release(*admission.batch_slots(batch.id, max_parallel))
+        raise
+    return JsonResponse({'batch_id': batch.id})
+
+def _status_payload(state):
+    return {
+        'status': state['status'],
+        'progress': state['progress'],
+        'downloaded_bytes': state.get('downloaded_bytes'),
+        'total_bytes': state.get('total_bytes'),
+        'speed': state.get('speed'),
+        'eta': state.get('eta'),
+        # Trả về link download file
+        'download_url': delivery.signed_url(state['filename']) if state['status'] == 'FINISHED' else None
+    }
+
+def _db_state(task):
+    # Task bám theo job khác -> hiển thị tiến trình của job đó
+    if task.leader and task.status in singleflight.ACTIVE_STATUSES:
+        task = task.leader
+    return {'status': task.status, 'progress': task.progress, 'filename': task.filename}
+
+def _queue_fields(task_id):
+    """Task đang xếp hàng: vị trí trong hàng đợi + thời gian chờ/ETA dự kiến (xem core/admission.py)"""
+    task = DownloadTask.objects.select_related('leader').filter(id=task_id).first()
+    if task is None:
+        return {}
+    if task.leader and task.status in singleflight.ACTIVE_STATUSES:
+        task = task.leader
+    return admission.queue_info(task) or {}
+
 def check_status_api(request, task_id):
+    # [ĐƯỜNG NHANH] Đọc tiến trình từ Redis, không chạm tới DB (trừ task đang xếp hàng: cần vị trí/ETA)
+    state = progress.read(task_id)
+    if state is None:
+        try:
+            state = _db_state(DownloadTask.objects.select_related('leader').get(id=task_id))
+        except:
+            return JsonResponse({'error': 'Not found'}, status=404)
+
+    payload = _status_payload(state)
+    if state['status'] == 'PENDING':
+        payload.update(_queue_fields(task_id))
+    return JsonResponse(payload)
+
+@csrf_exempt
+def bulk_status_api(request):
+    """
+    Trạng thái nhiều task trong 1 request: GET ?ids=a,b,c hoặc POST {"task_ids": [...]}.
+    1-2 lượt MGET Redis, task không có trên Redis đọc từ DB bằng đúng 1 query.
+    """
+    if request.method == 'POST':
+        raw_ids = json.loads(request.body).get('task_ids') or []
+    else:
+        raw_ids = [i for i in request.GET.get('ids', '').split(',') if i]
+    if len(raw_ids) > settings.BULK_STATUS_MAX_IDS:
+        return JsonResponse({'error': f'Tối đa {settings.BULK_STATUS_MAX_IDS} task mỗi lần'}, status=400)
     try:
-        task = DownloadTask.objects.get(id=task_id)
-        return JsonResponse({
-            'status': task.status,
-            'progress': task.progress,
-            # Trả về link download file
-            'download_url': f"/media/downloads/{task.filename}" if task.status == 'FINISHED' else None
-        })
-    except:
-        return JsonResponse({'error': 'Not found'}, status=404)
\ No newline at end of file
+        task_ids = list(dict.fromkeys(str(uuid.UUID(str(i))) for i in raw_ids))
+    except ValueError:
+        return JsonResponse({'error': 'task_id không hợp lệ'}, status=400)
+
+    states = progress.read_many(task_ids)
+    missing = [t for t in task_ids if t not in states]
+    if missing:
+        for task in DownloadTask.objects.select_related('leader').filter(id__in=missing):
+            states[str(task.id)] = _db_state(task)
+
+    return JsonResponse({
+        'tasks': {t: _status_payload(states[t]) for t in task_ids if t in states},
+        'not_found': [t for t in task_ids if t not in states],
+    })
+
+def batch_status_api(request, batch_id):
+    """Tiến trình của mọi task con trong 1 lần gọi: 1 query DB + 1-2 lượt MGET Redis"""
+    batch = DownloadBatch.objects.filter(id=batch_id).first()
+    if not batch:
+        return JsonResponse({'error': 'Not found'}, status=404)
+
+    children = list(
+        batch.tasks.order_by('batch_index').values('id', 'url', 'status', 'progress', 'filename')
+    )
+    live = progress.read_many([child['id'] for child in children])
+
+    tasks = []
+    counts = {}
+    finished_files = []
+    for child in children:
+        # Task WAITING chưa có trạng thái trên Redis -> dùng DB
+        state = live.get(str(child['id'])) or child
+        payload = _status_payload(state)
+        payload.update({'task_id': child['id'], 'url': child['url']})
+        tasks.append(payload)
+        counts[payload['status']] = counts.get(payload['status'], 0) + 1
+        if payload['status'] == 'FINISHED' and state.get('filename'):
+            finished_files.append(state['filename'])
+
+    total = len(tasks)
+    done = counts.get('FINISHED', 0) + counts.get('FAILED', 0)
+    # Tải cả batch 1 lần: ZIP các file đã xong (link ký số như file lẻ)
+    zip_url = delivery.signed_zip_url(
+        finished_files, slugify(batch.title) or f"batch-{str(batch.id)[:8]}"
+    ) if finished_files else None
+    return JsonResponse({
+        'batch_id': batch.id,
+        'status': batch.status,
+        'title': batch.title,
+        'total': total,
+        'counts': counts,
+        'progress': round(sum(t['progress'] or 0 for t in tasks) / total, 1) if total else 0.0,
+        'finished': batch.status == 'FAILED' or (batch.status == 'READY' and done == total),
+        'zip_url': zip_url,
+        'tasks': tasks,
+    })
+
+@csrf_exempt
+def zip_api(request):
+    """Gộp nhiều task đã xong thành 1 link ZIP: {"task_ids": [...], "name": "..."}"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    data = json.loads(request.body)
+    task_ids = data.get('task_ids') or []
+    try:
+        tasks = DownloadTask.objects.filter(id__in=task_ids, status='FINISHED').exclude(filename__isnull=True)
+        filenames = [t.filename for t in tasks if t.filename]
+    except Exception:
+        return JsonResponse({'error': 'task_ids không hợp lệ'}, status=400)
+    if not filenames:
+        return JsonResponse({'error': 'Chưa có task nào tải xong'}, status=404)
+    name = slugify(data.get('name') or '') or 'hust-download'
+    return JsonResponse({'zip_url': delivery.signed_zip_url(filenames, name), 'files': len(filenames)})
+
+def media_download(request, token, filename):
+    # Link ký số: tên file thật nằm trong token, phần filename trên URL chỉ để hiển thị
+    real_filename = delivery.unsign(token)
+    if real_filename is None:
+        return HttpResponse('Link đã hết hạn hoặc không hợp lệ', status=403)
+    return delivery.serve_file(request, real_filename)
+
+def media_zip(request, token, filename):
+    # Giống media_download: danh sách file nằm trong token, ZIP được ghép khi đang gửi
+    data = delivery.unsign_zip(token)
+    if data is None:
+        return HttpResponse('Link đã hết hạn hoặc không hợp lệ', status=403)
+    filenames, archive_name = data
+    return delivery.serve_zip(request, filenames, archive_name)
+
+async def _aload_state(task_id):
+    """Đọc trạng thái từ DB (khi Redis không có) cho endpoint stream"""
+    task = await DownloadTask.objects.select_related('leader').filter(id=task_id).afirst()
+    if task is None:
+        return None
+    if task.leader and task.status in singleflight.ACTIVE_STATUSES:
+        task = task.leader
+    return {'status': task.status, 'progress': task.progress, 'filename': task.filename}
+
+async def stream_status_api(request, task_id):
+    """
+    [SSE] Đẩy trạng thái/tiến trình về trình duyệt mỗi khi có thay đổi (chạy qua ASGI).
+    Worker publish lên Redis pub/sub -> endpoint này mới đọc lại state và gửi đi.
+    """
+    async def event_stream():
+        client = aioredis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        pubsub = client.pubsub()
+        last_payload = None
+        try:
+            source_id, _ = await progress.aread(client, task_id)
+            await pubsub.subscribe(progress.channel(source_id))
+            deadline = time.monotonic() + settings.PROGRESS_STREAM_MAX_AGE
+
+            while time.monotonic() < deadline:
+                _, state = await progress.aread(client, task_id)
+                if state is None:
+                    state = await _aload_state(task_id)
+                if state is None:
+                    yield 'event: error\ndata: {"error": "Not found"}\n\n'
+                    return
+
+                payload = _status_payload(state)
+                if state['status'] == 'PENDING':
+                    # Vị trí/ETA đổi theo hàng đợi (không có sự kiện riêng): cập nhật mỗi lượt keepalive
+                    payload.update(await sync_to_async(_queue_fields)(task_id))
+                payload = json.dumps(payload)
+                if payload != last_payload:
+                    last_payload = payload
+                    yield f"data: {payload}\n\n"
+                if state['status'] in ('FINISHED', 'FAILED'):
+                    return
+
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=settings.PROGRESS_STREAM_KEEPALIVE
+                )
+                if message is None:
+                    yield ': keepalive\n\n'
+        except aioredis.RedisError:
+            # Redis lỗi -> báo client chuyển sang polling
+            yield 'event: error\ndata: {"error": "Stream unavailable"}\n\n'
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Không cho Nginx buffer stream
+    return response
+
+def metrics_view(request):
+    """
+    [PROMETHEUS] /metrics: histogram thời gian từng stage theo extractor, dung lượng/tốc độ tải,
+    cache hit, độ dài queue Celery, số worker đang sống, lỗi theo nhóm.
+    Có METRICS_TOKEN thì bắt buộc header "Authorization: Bearer <token>".
+    """
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse(status=401)
+    task_counts = DownloadTask.objects.values_list('status').annotate(n=Count('id')).order_by()
+    try:
+        body = metrics.render(
+            {q: scheduling.broker_keys(q) for q in site_policy.fetch_queues() + ['postprocess', 'celery']},
+            list(task_counts),
+            result_cache.stats(),
+            storage.usage(),
+        )
+    except redis.RedisError:
+        return HttpResponse('Redis unavailable', status=503, content_type='text/plain')
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,196 @@
+import os
+import time
+import zlib
+import struct
+
+# --- ZIP STORE-MODE TẠO KHI ĐANG GỬI (KHÔNG PHỤ THUỘC DJANGO) ---
+# Không nén (video/audio đã nén sẵn), không ghi file tạm: biết trước kích thước từng file
+# nên tính được bố cục cả archive (offset từng phần + tổng dung lượng) ngay từ đầu.
+# CRC32 chỉ xuất hiện ở data descriptor (sau dữ liệu) và central directory (cuối file)
+# nên vừa đọc vừa tính là đủ -> byte đầu tiên được gửi ngay, bộ nhớ không đổi.
+# Bố cục cố định còn cho phép trả về 1 đoạn bất kỳ (HTTP Range / tải tiếp).
+
+CHUNK_SIZE = 1024 * 1024
+# Vượt ngưỡng này (4 GiB) thì dùng trường ZIP64
+ZIP64_LIMIT = 0xFFFFFFFF
+# Giá trị đánh dấu "xem trường ZIP64" trong header 32-bit
+_ZIP64_MARK = 0xFFFFFFFF
+
+_FLAGS = 0x0808  # bit 3: CRC/kích thước nằm ở data descriptor; bit 11: tên file UTF-8
+_MADE_BY = (3 << 8) | 45  # Unix, ZIP 4.5
+_EXTERNAL_ATTR = (0o100644 & 0xFFFF) << 16
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # ZIP không biểu diễn được trước năm 1980
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+class _Entry:
+    def __init__(self, arcname, path, st, offset):
+        self.name = arcname.encode('utf-8')
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.dos_time, self.dos_date = _dos_datetime(st.st_mtime)
+        self.offset = offset
+        self.zip64 = self.size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+        self.crc = None
+
+    def local_header(self):
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            version, sizes = 45, _ZIP64_MARK
+        else:
+            extra, version, sizes = b'', 20, 0
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, _FLAGS, 0, self.dos_time, self.dos_date,
+            0, sizes, sizes, len(self.name), len(extra),
+        ) + self.name + extra
+
+    def descriptor_size(self):
+        return 24 if self.zip64 else 16
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.size, self.size)
+
+    def central_size(self):
+        return 46 + len(self.name) + (28 if self.zip64 else 0)
+
+    def central_header(self):
+        if self.zip64:
+            extra = struct.pack('<HHQQQ', 0x0001, 24, self.size, self.size, self.offset)
+            version, size, offset = 45, _ZIP64_MARK, _ZIP64_MARK
+        else:
+            extra, version, size, offset = b'', 20, self.size, self.offset
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, _MADE_BY, version, _FLAGS, 0,
+            self.dos_time, self.dos_date, self.crc, size, size,
+            len(self.name), len(extra), 0, 0, 0, _EXTERNAL_ATTR, offset,
+        ) + self.name + extra
+
+
+class StoreZip:
+    """
+    ZIP (store) của 1 danh sách (tên trong archive, đường dẫn file).
+    crc_get(entry)/crc_set(entry, crc): cache CRC tùy chọn, để trả Range phía sau dữ liệu
+    mà không phải đọc lại cả file.
+    """
+
+    def __init__(self, files, crc_get=None, crc_set=None):
+        self.crc_get = crc_get
+        self.crc_set = crc_set
+        self.entries = []
+        # Mỗi segment: (offset bắt đầu, độ dài, loại, entry)
+        self.segments = []
+        offset = 0
+        seen = set()
+        for arcname, path in files:
+            if arcname in seen:
+                continue
+            seen.add(arcname)
+            entry = _Entry(arcname, path, os.stat(path), offset)
+            self.entries.append(entry)
+            for kind, length in (
+                ('local', len(entry.local_header())),
+                ('data', entry.size),
+                ('descriptor', entry.descriptor_size()),
+            ):
+                self.segments.append((offset, length, kind, entry))
+                offset += length
+
+        self.cd_offset = offset
+        self.cd_size = sum(e.central_size() for e in self.entries)
+        count = len(self.entries)
+        self.zip64_end = count >= 0xFFFF or self.cd_offset >= ZIP64_LIMIT or self.cd_size >= ZIP64_LIMIT
+        end_size = self.cd_size + (56 + 20 if self.zip64_end else 0) + 22
+        self.segments.append((offset, end_size, 'central', None))
+        self.size = offset + end_size
+
+    # --- CRC ---
+    def _ensure_crc(self, entry):
+        if entry.crc is None and self.crc_get:
+            entry.crc = self.crc_get(entry)
+        if entry.crc is None:
+            entry.crc = file_crc32(entry.path)
+            if self.crc_set:
+                self.crc_set(entry, entry.crc)
+        return entry.crc
+
+    # --- Nội dung từng segment ---
+    def _central(self):
+        parts = []
+        for entry in self.entries:
+            self._ensure_crc(entry)
+            parts.append(entry.central_header())
+        count = len(self.entries)
+        if self.zip64_end:
+            zip64_end_offset = self.cd_offset + self.cd_size
+            parts.append(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, _MADE_BY, 45, 0, 0,
+                count, count, self.cd_size, self.cd_offset,
+            ))
+            parts.append(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+        parts.append(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            _ZIP64_MARK if self.zip64_end else self.cd_size,
+            _ZIP64_MARK if self.zip64_end else self.cd_offset, 0,
+        ))
+        return b''.join(parts)
+
+    def _data(self, entry, start, length):
+        """Đọc dữ liệu file; đọc trọn từ đầu tới cuối thì tính luôn CRC"""
+        whole = start == 0 and length == entry.size and entry.crc is None
+        crc = 0
+        with open(entry.path, 'rb') as f:
+            f.seek(start)
+            while length > 0:
+                chunk = f.read(min(CHUNK_SIZE, length))
+                if not chunk:
+                    raise IOError(f"File bị thay đổi khi đang gửi: {entry.path}")
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                length -= len(chunk)
+                yield chunk
+        if whole:
+            entry.crc = crc
+            if self.crc_set:
+                self.crc_set(entry, crc)
+
+    def iter_range(self, start=0, end=None):
+        """Sinh các byte [start, end] của archive (end tính cả, mặc định tới cuối)"""
+        end = self.size - 1 if end is None else end
+        for seg_start, length, kind, entry in self.segments:
+            seg_end = seg_start + length - 1
+            if length == 0 or seg_end < start:
+                continue
+            if seg_start > end:
+                break
+            lo = max(start, seg_start) - seg_start
+            hi = min(end, seg_end) - seg_start + 1
+            if kind == 'data':
+                yield from self._data(entry, lo, hi - lo)
+                continue
+            if kind == 'local':
+                blob = entry.local_header()
+            elif kind == 'descriptor':
+                self._ensure_crc(entry)
+                blob = entry.descriptor()
+            else:
+                blob = self._central()
+            yield blob[lo:hi]
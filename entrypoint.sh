@@ -18,6 +18,16 @@ python manage.py collectstatic --noinput
 echo "🔄 Dang chay Migrate Database..."
 python manage.py migrate
 
-# --- BƯỚC 4: KHỞI ĐỘNG SERVER ---
+# --- BƯỚC 4: CẤU HÌNH WORKER ---
+# Số luồng tải song song của worker fetch (I/O-bound nên có thể lớn hơn số core)
+export FETCH_CONCURRENCY=${FETCH_CONCURRENCY:-8}
+
+# Phát file tải về: mặc định Django tự stream (mọi byte đi qua Python). Có Nginx phía trước thì đặt
+# MEDIA_DELIVERY=x-accel (xem hust_web/settings.py) để Nginx gửi file.
+if [ -z "$MEDIA_DELIVERY" ] || [ "$MEDIA_DELIVERY" = "django" ]; then
+    echo "⚠️ Canh bao: MEDIA_DELIVERY=django, file tai ve di qua Python. Dat MEDIA_DELIVERY=x-accel neu co Nginx."
+fi
+
+# --- BƯỚC 5: KHỞI ĐỘNG SERVER ---
 echo "🚀 Dang khoi dong Supervisor..."
 /usr/bin/supervisord
\ No newline at end of file
@@ -9,11 +9,29 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('api/start/', views.start_download_api),
     path('api/status/<uuid:task_id>/', views.check_status_api),
+    # Trạng thái nhiều task 1 lần (?ids=a,b,c hoặc POST {"task_ids": [...]})
+    path('api/status/', views.bulk_status_api),
+    path('api/stream/<uuid:task_id>/', views.stream_status_api),
+    # Gửi nhiều link / playlist 1 lần + xem tiến trình cả batch
+    path('api/batch/', views.start_batch_api),
+    path('api/batch/<uuid:batch_id>/', views.batch_status_api),
+    # Gộp nhiều task đã xong thành 1 link ZIP
+    path('api/zip/', views.zip_api),
+
+    # Metrics cho Prometheus
+    path('metrics', views.metrics_view),
+
+    # Link tải file có chữ ký (hỗ trợ Range/resume, X-Accel-Redirect/X-Sendfile)
+    path('dl/<str:token>/<path:filename>', views.media_download),
+    # ZIP nhiều file tạo khi đang gửi (không nén, không file tạm, có Range)
+    path('zip/<str:token>/<path:filename>', views.media_zip),
 
     # === [QUAN TRỌNG] FIX LỖI 404 MEDIA TRÊN RENDER ===
-    # Ép Django phục vụ file Media (Video tải về) và Static (CSS/JS)
-    # ngay cả khi chạy ở chế độ Production (DEBUG=False)
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    # Ép Django phục vụ file Static (CSS/JS) ngay cả khi chạy ở chế độ Production (DEBUG=False)
     re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
     # ==================================================
-]
\ No newline at end of file
+]
+
+# Media (Video tải về) mặc định chỉ phát qua link ký số ở trên
+if settings.MEDIA_PUBLIC:
+    urlpatterns.append(re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}))
\ No newline at end of file
@@ -1,13 +1,15 @@
 import os
 import sys
+import json
 import time
-import yt_dlp
-import pyperclip
-import questionary
-from rich.console import Console
-from rich.panel import Panel
-from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeRemainingColumn
-from rich import print as rprint
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from core.binaries import find_binary
+from core.remux import format_selector, audio_format_selector, target_bitrate
+
+# yt_dlp, rich, questionary, pyperclip được import khi cần tới (chế độ batch/--help khởi động tức thì)
 
 # --- CẤU HÌNH HỆ THỐNG ---
 # Tự động lấy đường dẫn gốc của dự án
@@ -15,170 +17,282 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 DIRS = {
     'cookies': os.path.join(BASE_DIR, 'cookies.txt'),
-    'ffmpeg': os.path.join(BASE_DIR, 'bin', 'ffmpeg.exe'),
-    'aria2c': os.path.join(BASE_DIR, 'bin', 'aria2c.exe'),
+    # Tìm trong PATH (Linux) rồi tới thư mục bin (Windows .exe), None nếu không có
+    'ffmpeg': find_binary('ffmpeg', os.path.join(BASE_DIR, 'bin')),
+    'ffprobe': find_binary('ffprobe', os.path.join(BASE_DIR, 'bin')),
+    'aria2c': find_binary('aria2c', os.path.join(BASE_DIR, 'bin')),
     'downloads': os.path.join(BASE_DIR, 'downloads'),
+    'extract_cache': os.path.join(BASE_DIR, '.cache', 'extract'),
+    'downloader_stats': os.path.join(BASE_DIR, '.cache', 'downloader'),
+    'sidecars': os.path.join(BASE_DIR, '.cache', 'sidecars'),
 }
 
-console = Console()
+# Chế độ Auto-Clipboard: số link tải cùng lúc
+CLIPBOARD_WORKERS = int(os.getenv('HUST_CLIPBOARD_WORKERS', '3'))
+# Chế độ batch (không tương tác): số link tải cùng lúc mặc định
+BATCH_WORKERS = int(os.getenv('HUST_BATCH_WORKERS', '4'))
+# Phụ đề: ngôn ngữ cần tải theo thứ tự ưu tiên ('en' tự khớp 'en-US'... nếu video không có 'en')
+SUBTITLE_LANGS = os.getenv('HUST_SUBTITLE_LANGS', 'vi,en').split(',')
+# Thumbnail/phụ đề đã tải được dùng lại cho cùng video trong N giây (xem core/sidecars.py)
+SIDECAR_CACHE_TTL = int(os.getenv('HUST_SIDECAR_CACHE_TTL', str(7 * 86400)))
+
+# Giao diện rich, chỉ tạo khi vào chế độ tương tác (xem init_console)
+console = None
+
+
+def init_console():
+    global console
+    if console is None:
+        from rich.console import Console
+        console = Console()
+    return console
+
+
+def make_progress():
+    """Giao diện Loading 7 màu (1 dòng/link, dùng chung được cho nhiều luồng)"""
+    from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeRemainingColumn
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("[bold blue]{task.description}"),
+        BarColumn(),
+        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        TimeRemainingColumn(),
+        console=console
+    )
+
+
+def get_opts(url, settings, use_cookies=False):
+    """
+    [CORE ENGINE] Cấu hình yt-dlp theo tiêu chuẩn V7.1
+    """
+    path_template = os.path.join('%(extractor)s', '%(title).200s [%(id)s].%(ext)s')
+    
+    # Kiểm tra xem người dùng có muốn tải thêm (Extras) không
+    want_sub = 'subtitle' in settings.get('extras', [])
+    want_thumb = 'thumbnail' in settings.get('extras', [])
+
+    opts = {
+        # --- CẤU HÌNH CƠ BẢN ---
+        'outtmpl': path_template,
+        # File tạm (.part/.aria2) để riêng -> Ctrl+C hay mất mạng thì lần sau tải tiếp
+        'paths': {'home': DIRS['downloads'], 'temp': os.path.join(DIRS['downloads'], '.parts')},
+        'ffmpeg_location': os.path.dirname(DIRS['ffmpeg']) if DIRS['ffmpeg'] else None,
+        'cookiefile': DIRS['cookies'] if use_cookies else None,
+        'quiet': True,
+        'no_warnings': True,
+        'ignoreerrors': True,
+        
+        # --- GHI ĐÈ FILE HOÀN CHỈNH, TẢI TIẾP FILE DỞ ---
+        'overwrites': True,        # Ghi đè file hoàn chỉnh cũ (không hỏi)
+        'continuedl': True,        # Tải tiếp file .part còn dở thay vì tải lại từ 0%
+        
+        # --- [V7.1] CLEAN & EMBED LOGIC ---
+        'writethumbnail': want_thumb,
+        'writesubtitles': want_sub,
+        'embedthumbnail': want_thumb,   # Nhúng ảnh vào file
+        'embedsubtitles': want_sub,     # Nhúng sub vào file
+        'subtitleslangs': SUBTITLE_LANGS if want_sub else None,
+
+        # --- MẠNG & THỬ LẠI ---
+        'retries': 10,
+        'fragment_retries': 10,
+    }
+
+    # --- [ACCELERATOR] ARIA2C ---
+    # Số kết nối/chunk do AdaptiveYoutubeDL chọn theo từng CDN lúc tải
+    if DIRS['aria2c']:
+        opts['external_downloader'] = {'default': DIRS['aria2c']}
+        opts['external_downloader_args'] = {'aria2c': ['--auto-save-interval=10']}
+
+    # --- XỬ LÝ VIDEO ---
+    if settings['type'] == 'video':
+        res_limit = settings['resolution']
+        container = settings['container'] 
+        
+        # Format String: Ưu tiên độ phân giải + audio hợp container (ghép không cần encode) -> Fallback
+        format_string = format_selector(res_limit, container)
+        
+        opts.update({
+            'format': format_string,
+            'merge_output_format': container,
+            'subtitlesformat': 'srt' if container == 'mp4' else 'ass/srt/best',
+        })
+
+        # --- [WINDOWS FIX] ---
+        # Audio Opus trong MP4 được convert sang AAC lúc ghép (plan_postprocess), AAC sẵn thì chỉ copy
+
+        # --- [SPONSORBLOCK] (Youtube Only) ---
+        if 'youtube' in url:
+            opts['sponsorblock_remove'] = ['sponsor', 'intro', 'outro', 'selfpromo']
+
+    # --- XỬ LÝ AUDIO ---
+    elif settings['type'] == 'audio':
+        audio_ext = settings['audio_format']
+        # Bitrate tối đa; lúc convert tự hạ bằng bitrate nguồn hoặc copy thẳng nếu cùng codec
+        bitrate = str(target_bitrate(settings['audio_quality']))
+        
+        opts.update({
+            'format': audio_format_selector(audio_ext),
+            'postprocessors': [
+                {'key': 'FFmpegExtractAudio', 'preferredcodec': audio_ext, 'preferredquality': bitrate},
+                {'key': 'EmbedThumbnail'},
+                {'key': 'FFmpegMetadata'},
+            ],
+        })
+
+    return opts
+
+
+def make_caches():
+    """Cache extract + lịch sử tốc độ tải + thumbnail/phụ đề (dùng chung cho chế độ tương tác và batch)"""
+    from core.extract_cache import ExtractCache
+    from core.adaptive_dl import DownloaderTuner
+    from core.sidecars import SidecarCache
+    # Cache extract: dùng chung Redis với web worker nếu có REDIS_URL, không thì lưu trên đĩa
+    extract_cache = ExtractCache(redis_url=os.getenv('REDIS_URL'), cache_dir=DIRS['extract_cache'])
+    # Lịch sử tốc độ theo CDN -> tự chọn số kết nối aria2c (hoặc tải 1 luồng với file nhỏ)
+    tuner = DownloaderTuner(redis_url=os.getenv('REDIS_URL'), cache_dir=DIRS['downloader_stats'])
+    # Thumbnail/phụ đề theo id video: tải lại cùng video (chất lượng khác) không phải gọi mạng
+    sidecar_cache = SidecarCache(DIRS['sidecars'], max_age=SIDECAR_CACHE_TTL)
+    sidecar_cache.prune()
+    return extract_cache, tuner, sidecar_cache
+
+
+def run_download(url, settings, opts, extract_cache, tuner, on_info=None, sidecar_cache=None):
+    """
+    Lõi tải dùng chung (giao diện tương tác + batch): extract (hoặc lấy từ cache) -> tải -> hậu xử lý.
+    on_info(info) được gọi ngay sau extract. Trả về (info, list file cuối, list mode hậu xử lý), lỗi thì raise.
+    """
+    from core.extract_cache import extract
+    from core.pipeline import FetchOnlyYoutubeDL, run_postprocess_batch
+    from core.remux import plan_postprocess
+
+    # Tải hết trước (playlist cũng vậy), hậu xử lý để sau cho chạy song song
+    with FetchOnlyYoutubeDL(opts, tuner=tuner, aria2c_path=DIRS['aria2c'],
+                            aria2c_args=['--auto-save-interval=10'], sidecar_cache=sidecar_cache) as ydl:
+        # Extract đúng 1 lần (hoặc lấy từ cache), tải luôn từ kết quả đó
+        info = extract(ydl, url, extract_cache)
+        if not info:
+            raise Exception("Không lấy được thông tin video")
+        if on_info:
+            on_info(info)
+        ydl.process_ie_result(info, download=True)
+        jobs = ydl.deferred_jobs
+
+    results = []
+    if jobs:
+        # Ghép/convert: copy stream nếu codec đã hợp, không thì encode (mỗi file 1 process ffmpeg)
+        target = settings['container'] if settings['type'] == 'video' else settings['audio_format']
+        results = run_postprocess_batch(
+            opts, jobs,
+            prepare=lambda y, job: plan_postprocess(
+                y, job, settings['type'], target, settings.get('audio_quality'), DIRS['ffprobe']
+            ),
+        )
+    files = [result.get('filepath') for result, _ in results if result]
+    modes = sorted({mode for _, mode in results if mode})
+    return info, files, modes
+
 
 class HUSTDownloader:
     def __init__(self):
+        init_console()
         self._check_system()
 
     def _check_system(self):
         """Kiểm tra sự tồn tại của các công cụ cốt lõi"""
+        from rich.panel import Panel
         if not os.path.exists(DIRS['downloads']):
             os.makedirs(DIRS['downloads'])
         
         missing = []
-        if not os.path.exists(DIRS['ffmpeg']): missing.append("FFmpeg (ffmpeg.exe)")
-        if not os.path.exists(DIRS['aria2c']): missing.append("Aria2c (aria2c.exe)")
+        if not DIRS['ffmpeg']: missing.append("FFmpeg (ffmpeg.exe)")
+        if not DIRS['aria2c']: missing.append("Aria2c (aria2c.exe)")
         
         if missing:
-            console.print(Panel(f"[bold red]❌ THIẾU CÔNG CỤ TRONG THƯ MỤC 'bin':[/bold red]\n" + "\n".join(missing), title="Lỗi Hệ Thống"))
-            console.print("[yellow]Vui lòng tải file .exe và bỏ vào folder 'bin' cùng cấp với main.py[/yellow]")
+            console.print(Panel(f"[bold red]❌ THIẾU CÔNG CỤ (PATH hoặc thư mục 'bin'):[/bold red]\n" + "\n".join(missing), title="Lỗi Hệ Thống"))
+            console.print("[yellow]Cài vào PATH (Linux) hoặc tải file .exe bỏ vào folder 'bin' cùng cấp với main.py (Windows)[/yellow]")
             sys.exit(1)
         
         self.use_cookies = os.path.exists(DIRS['cookies'])
+        self.extract_cache, self.tuner, self.sidecar_cache = make_caches()
         self._print_banner()
 
     def _print_banner(self):
+        from rich.panel import Panel
         console.clear()
         banner = """
 [bold cyan]🚀 HUST DOWNLOADER V7.1 - FINAL EDITION[/bold cyan]
-[green]✔ Aria2c Speed[/green] | [yellow]✔ Windows Audio Fix[/yellow] | [magenta]✔ Force Overwrite[/magenta]
+[green]✔ Aria2c Speed[/green] | [yellow]✔ Windows Audio Fix[/yellow] | [magenta]✔ Auto Resume[/magenta]
         """
         console.print(Panel(banner.strip(), border_style="cyan"))
 
     def get_opts(self, url, settings):
+        return get_opts(url, settings, self.use_cookies)
+
+    def download(self, url, settings, progress=None):
         """
-        [CORE ENGINE] Cấu hình yt-dlp theo tiêu chuẩn V7.1
+        Tải 1 link. progress: bảng tiến trình dùng chung (chế độ clipboard nhiều luồng),
+        None thì tự mở bảng riêng. Trả về True nếu tải xong.
         """
-        path_template = os.path.join(DIRS['downloads'], '%(extractor)s', '%(title).200s [%(id)s].%(ext)s')
-        
-        # Kiểm tra xem người dùng có muốn tải thêm (Extras) không
-        want_sub = 'subtitle' in settings.get('extras', [])
-        want_thumb = 'thumbnail' in settings.get('extras', [])
-
-        opts = {
-            # --- CẤU HÌNH CƠ BẢN ---
-            'outtmpl': path_template,
-            'ffmpeg_location': os.path.dirname(DIRS['ffmpeg']),
-            'cookiefile': DIRS['cookies'] if self.use_cookies else None,
-            'quiet': True,
-            'no_warnings': True,
-            'ignoreerrors': True,
-            
-            # --- [V7.1] FORCE OVERWRITE (GHI ĐÈ KHÔNG HỎI) ---
-            'overwrites': True,        # Cho phép ghi đè
-            'force_overwrite': True,   # Bắt buộc ghi đè
-            'no_continue': True,       # Không resume, tải mới từ 0% để tránh lỗi file
-            
-            # --- [V7.1] CLEAN & EMBED LOGIC ---
-            'writethumbnail': want_thumb,
-            'writesubtitles': want_sub,
-            'embedthumbnail': want_thumb,   # Nhúng ảnh vào file
-            'embedsubtitles': want_sub,     # Nhúng sub vào file
-            'subtitleslangs': ['vi', 'en', 'en-US', 'all'] if want_sub else None,
-
-            # --- [ACCELERATOR] ARIA2C ---
-            'external_downloader': {'default': DIRS['aria2c']},
-            'external_downloader_args': {'aria2c': ['-x', '16', '-k', '1M', '-s', '16']},
-            
-            # --- MẠNG & THỬ LẠI ---
-            'retries': 10,
-            'fragment_retries': 10,
-        }
-
-        # --- XỬ LÝ VIDEO ---
-        if settings['type'] == 'video':
-            res_limit = settings['resolution']
-            container = settings['container'] 
-            
-            # Format String: Ưu tiên độ phân giải -> Fallback xuống thấp hơn nếu không có
-            format_string = f"bestvideo[height<={res_limit}][ext={container}]+bestaudio/best[height<={res_limit}][ext={container}]/best"
-            
-            opts.update({
-                'format': format_string,
-                'merge_output_format': container,
-                'subtitlesformat': 'srt' if container == 'mp4' else 'ass/srt/best',
-            })
-
-            # --- [WINDOWS FIX] ---
-            # Ép convert âm thanh Opus sang AAC nếu container là MP4
-            if container == 'mp4':
-                opts['postprocessor_args'] = {'ffmpeg': ['-c:v', 'copy', '-c:a', 'aac']}
-
-            # --- [SPONSORBLOCK] (Youtube Only) ---
-            if 'youtube' in url:
-                opts['sponsorblock_remove'] = ['sponsor', 'intro', 'outro', 'selfpromo']
-
-        # --- XỬ LÝ AUDIO ---
-        elif settings['type'] == 'audio':
-            audio_ext = settings['audio_format']
-            bitrate = '320' if settings['audio_quality'] == 'best' else '128'
-            
-            opts.update({
-                'format': 'bestaudio/best',
-                'postprocessors': [
-                    {'key': 'FFmpegExtractAudio', 'preferredcodec': audio_ext, 'preferredquality': bitrate},
-                    {'key': 'EmbedThumbnail'},
-                    {'key': 'FFmpegMetadata'},
-                ],
-            })
-
-        return opts
-
-    def download(self, url, settings):
+        if progress is None:
+            with make_progress() as progress:
+                return self._download(url, settings, progress)
+        return self._download(url, settings, progress, shared=True)
+
+    def _download(self, url, settings, progress, shared=False):
         opts = self.get_opts(url, settings)
+        task_id = progress.add_task("Khoi tao...", total=None)
         
-        # Giao diện Loading 7 màu
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[bold blue]{task.description}"),
-            BarColumn(),
-            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-            TimeRemainingColumn(),
-            console=console
-        ) as progress:
-            task_id = progress.add_task("Khoi tao...", total=None)
+        # Hook để cập nhật thanh tiến trình
+        def progress_hook(d):
+            if d['status'] == 'downloading':
+                try:
+                    # Lấy % từ output của yt-dlp/aria2c
+                    p = d.get('_percent_str', '0%').replace('%', '')
+                    progress.update(task_id, completed=float(p), description=f"[green]Downloading: {d.get('filename', 'File')}")
+                except: pass
+            elif d['status'] == 'finished':
+                progress.update(task_id, description="[bold magenta]Processing (Embed/Convert/Clean)...")
+
+        opts['progress_hooks'] = [progress_hook]
+
+        # Nhiều link tải cùng lúc (bảng dùng chung) -> ghi rõ link nào xong/lỗi
+        label = url
+        ok = False
+
+        def on_info(info):
+            nonlocal label
+            title = info.get('title', 'Unknown')
+            label = title
+            console.print(f"\n[bold yellow]➤ TARGET:[/bold yellow] {title}")
             
-            # Hook để cập nhật thanh tiến trình
-            def progress_hook(d):
-                if d['status'] == 'downloading':
-                    try:
-                        # Lấy % từ output của yt-dlp/aria2c
-                        p = d.get('_percent_str', '0%').replace('%', '')
-                        progress.update(task_id, completed=float(p), description=f"[green]Downloading: {d.get('filename', 'File')}")
-                    except: pass
-                elif d['status'] == 'finished':
-                    progress.update(task_id, description="[bold magenta]Processing (Embed/Convert/Clean)...")
-
-            opts['progress_hooks'] = [progress_hook]
+            # In thông số cấu hình
+            if settings['type'] == 'video':
+                extras = " + ".join([x.capitalize() for x in settings.get('extras', [])]) or "Clean Mode"
+                console.print(f"[i]Video: {settings['resolution']}p | {settings['container']} | [cyan]{extras}[/cyan][/i]")
+            else:
+                console.print(f"[i]Audio: {settings['audio_format']} | {settings['audio_quality']} mode[/i]")
 
-            try:
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    title = info.get('title', 'Unknown')
-                    console.print(f"\n[bold yellow]➤ TARGET:[/bold yellow] {title}")
-                    
-                    # In thông số cấu hình
-                    if settings['type'] == 'video':
-                        extras = " + ".join([x.capitalize() for x in settings.get('extras', [])]) or "Clean Mode"
-                        console.print(f"[i]Video: {settings['resolution']}p | {settings['container']} | [cyan]{extras}[/cyan][/i]")
-                    else:
-                        console.print(f"[i]Audio: {settings['audio_format']} | {settings['audio_quality']} mode[/i]")
-
-                    ydl.download([url])
-                    console.print(f"[bold green]✔ HOÀN TẤT! (Đã ghi đè & Dọn dẹp)[/bold green]")
-            except Exception as e:
-                console.print(f"[bold red]❌ LỖI:[/bold red] {str(e)}")
+        try:
+            _, _, modes = run_download(
+                url, settings, opts, self.extract_cache, self.tuner, on_info=on_info, sidecar_cache=self.sidecar_cache,
+            )
+            if modes:
+                console.print(f"[i]Post-process: {' + '.join(m.capitalize() for m in modes)}[/i]")
+            console.print(f"[bold green]✔ HOÀN TẤT! (Đã ghi đè & Dọn dẹp)[/bold green]" + (f" {label}" if shared else ""))
+            ok = True
+        except Exception as e:
+            console.print(f"[bold red]❌ LỖI:[/bold red] " + (f"{label}: " if shared else "") + str(e))
+        if shared:
+            progress.remove_task(task_id)
+        return ok
 
 # --- CÁC HÀM TIỆN ÍCH (MODULES) ---
 
 def get_user_settings_wizard():
     """Module Wizard: Menu trắc nghiệm"""
+    import questionary
     mode = questionary.select("Bạn muốn tải gì?", choices=["Video", "Audio Only"]).ask()
 
     if "Video" in mode:
@@ -203,9 +317,107 @@ def get_user_settings_wizard():
         qual = questionary.select("Chất lượng:", choices=["best (320kbps)", "medium (128kbps)"]).ask().split()[0]
         return {'type': 'audio', 'audio_format': fmt, 'audio_quality': qual, 'extras': ['thumbnail']}
 
-def clipboard_monitor(downloader):
-    """Module Automation: Theo dõi Clipboard"""
-    console.print(Panel("[blink bold red]AUTO-CLIPBOARD: ON[/blink bold red]\nCopy link là tự tải. Mặc định: [cyan]1080p MP4 Clean[/cyan]", border_style="red"))
+class DownloadQueue:
+    """
+    Hàng đợi cho chế độ Auto-Clipboard: link trùng bị bỏ qua, N luồng tải song song,
+    tiến trình hiện chung 1 bảng. Luồng đọc clipboard chỉ đẩy link vào, không chờ tải.
+    """
+
+    def __init__(self, downloader, workers=CLIPBOARD_WORKERS):
+        self.downloader = downloader
+        self.workers = max(1, workers)
+        self.pending = queue.Queue()
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.stats = {'waiting': 0, 'running': 0, 'done': 0, 'failed': 0}
+        self.progress = make_progress()
+        self.threads = []
+
+    def start(self):
+        self.progress.start()
+        self.summary = self.progress.add_task("", total=None)
+        self._refresh()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, daemon=True, name=f"clipboard-dl-{i}")
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, url, settings):
+        """Thêm link vào hàng đợi. False nếu link đã có (đang chờ/đang tải/đã tải xong trong phiên này)"""
+        with self.lock:
+            if url in self.seen:
+                return False
+            self.seen.add(url)
+            self.stats['waiting'] += 1
+        self.pending.put((url, settings))
+        self._refresh()
+        return True
+
+    def cancel_pending(self):
+        """Bỏ các link chưa bắt đầu tải, trả về số link bị bỏ"""
+        dropped = 0
+        while True:
+            try:
+                self.pending.get_nowait()
+            except queue.Empty:
+                break
+            dropped += 1
+        self._count(waiting=-dropped)
+        return dropped
+
+    def close(self):
+        """Chờ các link đang tải xong rồi tắt bảng tiến trình"""
+        try:
+            for _ in self.threads:
+                self.pending.put(None)
+            for t in self.threads:
+                t.join()
+        finally:
+            self.progress.stop()
+
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            url, settings = item
+            self._count(waiting=-1, running=1)
+            ok = False
+            try:
+                ok = self.downloader.download(url, settings, progress=self.progress)
+            finally:
+                if not ok:
+                    # Lỗi -> copy lại link là được thử lại
+                    with self.lock:
+                        self.seen.discard(url)
+                self._count(running=-1, **{'done' if ok else 'failed': 1})
+
+    def _count(self, **delta):
+        with self.lock:
+            for name, value in delta.items():
+                self.stats[name] += value
+        self._refresh()
+
+    def _refresh(self):
+        s = self.stats
+        self.progress.update(
+            self.summary,
+            description=f"[bold cyan]HÀNG ĐỢI[/bold cyan] chờ {s['waiting']} | đang tải {s['running']} | "
+                        f"xong {s['done']} | lỗi {s['failed']}",
+        )
+
+
+def clipboard_monitor(downloader, workers=CLIPBOARD_WORKERS):
+    """Module Automation: Theo dõi Clipboard, link mới vào hàng đợi tải song song"""
+    import pyperclip
+    from rich.panel import Panel
+    console.print(Panel(
+        "[blink bold red]AUTO-CLIPBOARD: ON[/blink bold red]\nCopy link là tự tải. Mặc định: [cyan]1080p MP4 Clean[/cyan]\n"
+        f"Tải cùng lúc [cyan]{workers}[/cyan] link, link trùng tự bỏ qua. Ctrl+C để dừng.",
+        border_style="red",
+    ))
+    downloads = DownloadQueue(downloader, workers)
+    downloads.start()
     last_text = ""
     try:
         while True:
@@ -220,13 +432,115 @@ def clipboard_monitor(downloader):
                      # Mặc định video là 1080p MP4 và KHÔNG tải sub/thumb để sạch máy
                      settings = {'type': 'video', 'resolution': '1080', 'container': 'mp4', 'extras': []}
                 
-                console.print(f"\n[DETECT] Link mới: {text}")
-                downloader.download(text, settings)
+                if downloads.submit(text, settings):
+                    console.print(f"[DETECT] Link mới: {text}")
+                else:
+                    console.print(f"[SKIP] Link đã có trong hàng đợi: {text}")
             time.sleep(1)
     except KeyboardInterrupt:
-        console.print("\n[STOP] Đã dừng chế độ tự động.")
+        dropped = downloads.cancel_pending()
+        console.print(f"\n[STOP] Đã dừng chế độ tự động. Bỏ {dropped} link đang chờ, đợi các link đang tải xong (Ctrl+C lần nữa để bỏ dở)...")
+        try:
+            downloads.close()
+        except KeyboardInterrupt:
+            console.print("[STOP] Không chờ nữa: link đang tải chạy nền tới khi thoát chương trình (lần sau tải tiếp từ file .part)")
+
+# --- CHẾ ĐỘ BATCH (KHÔNG TƯƠNG TÁC, CHO SCRIPT/SERVER LINUX) ---
+def read_urls(source):
+    """Link từ file hoặc stdin ('-'): mỗi dòng 1 link, bỏ dòng trống/comment '#' và link trùng"""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        lines = (line.strip() for line in stream)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def batch_settings(args):
+    """Tham số dòng lệnh -> settings giống Wizard (dùng chung get_opts)"""
+    extras = [name for name in ('thumbnail', 'subtitle') if getattr(args, name)]
+    if args.type == 'audio':
+        return {'type': 'audio', 'audio_format': args.audio_format, 'audio_quality': args.audio_quality, 'extras': extras}
+    return {'type': 'video', 'resolution': args.resolution, 'container': args.container, 'extras': extras}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='main.py',
+        description="Tải hàng loạt không tương tác, mỗi link 1 dòng JSON kết quả trên stdout. "
+                    "Chạy không tham số để mở menu tương tác.",
+    )
+    parser.add_argument('input', nargs='?', default='-', help="File danh sách link (mỗi dòng 1 link), '-' = stdin")
+    parser.add_argument('-w', '--workers', type=int, default=BATCH_WORKERS, help='Số link tải cùng lúc')
+    parser.add_argument('-o', '--output-dir', help='Thư mục lưu file (mặc định: downloads/)')
+    parser.add_argument('--type', choices=['video', 'audio'], default='video')
+    parser.add_argument('--resolution', choices=['2160', '1440', '1080', '720', '480'], default='1080')
+    parser.add_argument('--container', choices=['mp4', 'mkv', 'webm'], default='mp4')
+    parser.add_argument('--audio-format', choices=['mp3', 'm4a', 'wav', 'flac'], default='mp3')
+    parser.add_argument('--audio-quality', choices=['best', 'medium'], default='best')
+    parser.add_argument('--subtitle', action='store_true', help='Tải + nhúng phụ đề')
+    parser.add_argument('--thumbnail', action='store_true', help='Tải + nhúng ảnh bìa')
+    parser.add_argument('--dry-run', action='store_true', help='Chỉ in cấu hình yt-dlp của từng link, không tải')
+    return parser
+
+
+def run_batch(argv):
+    args = build_parser().parse_args(argv)
+    if args.output_dir:
+        DIRS['downloads'] = os.path.abspath(args.output_dir)
+    urls = read_urls(args.input)
+    settings = batch_settings(args)
+    use_cookies = os.path.exists(DIRS['cookies'])
+    lock = threading.Lock()
+
+    def emit(record):
+        # stdout chỉ chứa JSON lines, thông báo khác ra stderr
+        with lock:
+            sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            sys.stdout.flush()
+
+    if args.dry_run:
+        for url in urls:
+            emit({'url': url, 'dry_run': True, 'settings': settings, 'opts': get_opts(url, settings, use_cookies)})
+        return 0
+
+    os.makedirs(DIRS['downloads'], exist_ok=True)
+    if not DIRS['ffmpeg']:
+        print("⚠️ Không tìm thấy ffmpeg (PATH hoặc bin/): không ghép/convert được", file=sys.stderr)
+    extract_cache, tuner, sidecar_cache = make_caches()
+
+    def work(url):
+        opts = get_opts(url, settings, use_cookies)
+        opts['noprogress'] = True  # aria2c không in tiến trình ra stdout
+        record = {'url': url, 'ok': False}
+        started = time.monotonic()
+        try:
+            info, files, modes = run_download(url, settings, opts, extract_cache, tuner, sidecar_cache=sidecar_cache)
+            record.update(
+                ok=True, id=info.get('id'), title=info.get('title'), extractor=info.get('extractor_key'),
+                files=files, postprocess=modes,
+            )
+        except Exception as e:
+            record['error'] = str(e)
+        record['seconds'] = round(time.monotonic() - started, 2)
+        emit(record)
+        return record['ok']
+
+    pool = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        results = list(pool.map(work, urls))
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("[STOP] Bỏ các link chưa tải, đợi link đang tải dừng (lần sau tải tiếp từ file .part)", file=sys.stderr)
+        return 130
+    pool.shutdown()
+    print(f"✔ {sum(results)}/{len(results)} link tải xong", file=sys.stderr)
+    return 0 if all(results) else 1
+
 
 def main():
+    import questionary
     downloader = HUSTDownloader()
     while True:
         action = questionary.select(
@@ -248,4 +562,7 @@ def main():
                 questionary.text("Bấm Enter để tiếp tục...").ask()
 
 if __name__ == "__main__":
+    # Có tham số (hoặc link được pipe vào stdin) -> chạy batch, không thì mở menu tương tác
+    if len(sys.argv) > 1 or not sys.stdin.isatty():
+        sys.exit(run_batch(sys.argv[1:]))
     main()
\ No newline at end of file